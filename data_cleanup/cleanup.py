@@ -3,16 +3,19 @@
 import sys
 sys.path.append('../') # This should probably be changed to a more sofisticated system at some point. i.e. install the package
 
-from ast import literal_eval
-
 from data_wrangler import Dataset
+from data_wrangler import col
 from data_wrangler.conversion_functions import split_latitude, split_longitude
+from data_wrangler.conversion_functions import parse_list
 
 # NOTE: The reason I am using Dataset instead of Panda Dataframes is because I would have to work out how to match two Dataframes based on locations
 
 INPUT_FOLDER = '../data/pre_processed_data'
 OUTPUT_FOLDER = '../data/cleaned_data'
 
+# The zone used to project latitudes and longitudes to meters
+UTM_ZONE = (10, 'U')
+
 CRIME = f'{INPUT_FOLDER}/crimes.csv'
 JUNCTIONS = f'{INPUT_FOLDER}/junctions.csv'
 SEGMENTS = f'{INPUT_FOLDER}/segments.csv'
@@ -24,6 +27,8 @@ BUSINESSES = f'{INPUT_FOLDER}/businesses.csv'
 GRAFFITI = f'{INPUT_FOLDER}/graffiti.csv'
 OBSERVATIONS = f'{INPUT_FOLDER}/observations.csv'
 
+JUNCTION_INDEX = f'{OUTPUT_FOLDER}/junctions.spatial'
+
 print("Loading Data")
 crime = Dataset.load_file(CRIME)
 junctions = Dataset.load_file(JUNCTIONS)
@@ -60,7 +65,7 @@ print(f"Initial segment count: {starting_segments_count}")
 segments.convert_properties({
     'id': int,
     'length_metres': float,
-    'neighbors': literal_eval
+    'neighbors': parse_list
 })
 
 segments.filter(lambda row: len(row['neighbors']) >= 2)
@@ -77,6 +82,9 @@ for segment in segments:
         
 junctions.filter(lambda row: len(row['neighbors']) > 0)
 
+# Load the junction index saved by the last run, or build and save it if the junctions have changed
+junctions.spatial_index(JUNCTION_INDEX)
+
 print(f"Removed junctions with no connections. Remaining {len(junctions)} ({len(junctions) / starting_junction_count:.0%})")
 
 ## Cleanup Crimes ##
@@ -90,14 +98,21 @@ crime.convert_properties({
 })
 
 # Filter out null locations
-crime.filter(lambda row: row['latitude'] != 0 or row['longitude'] != 0)
+crime.filter((col('latitude') != 0) | (col('longitude') != 0))
 print(f"Removed crimes with null locations. Remaining: {len(crime)} ({len(crime) / starting_crime_count:.0%})")
     
 # Match to junctions
-crime.match_lat_lng_approx(junctions, 'junction_id', 'junction_dst', count_field='crime_count', distance_limit=200)
-crime.filter(lambda row: row['junction_id'] != 0)
+crime.match_lat_lng(junctions, 'junction_id', 'junction_dst', count_field='crime_count', distance_limit=200)
+crime.filter(col('junction_id') != 0)
 print(f"Removed crimes more than 200 meters from a junction. Remaining {len(crime)} ({len(crime) / starting_crime_count:.0%})")
 
+# Snap to the street segment each crime is on. The projected coordinates are only needed for matching.
+crime.match_segments(segments, junctions, UTM_ZONE, distance_limit=200)
+crime.drop('easting')
+crime.drop('northing')
+junctions.drop('easting')
+junctions.drop('northing')
+
 
 ## Cleanup Store ##
 print()
@@ -126,11 +141,11 @@ stores.drop('year_recorded')
         
 print(f"Removed duplicate stores. Remaining {len(stores)} ({len(stores) / starting_stores_count:.0%})")
 
-stores.filter(lambda store: store['category'] != 'Vacant')
+stores.filter(col('category') != 'Vacant')
 print(f"Removed vacant stores. Remaining {len(stores)} ({len(stores) / starting_stores_count:.0%})")
 
-stores.match_lat_lng_approx(junctions, 'junction_id', 'junction_dst', count_field='stores_count', distance_limit=200)
-stores.filter(lambda row: row['junction_id'] != 0)
+stores.match_lat_lng(junctions, 'junction_id', 'junction_dst', count_field='stores_count', distance_limit=200)
+stores.filter(col('junction_id') != 0)
 print(f"Removed stores with no connections. Remaining {len(stores)} ({len(stores) / starting_stores_count:.0%})")
 
 
@@ -144,8 +159,8 @@ transit.convert_properties({
     'longitude': float
 })
 
-transit.match_lat_lng_approx(junctions, 'junction_id', 'junction_dst', count_field='transit_count', distance_limit=200)
-transit.filter(lambda row: row['junction_id'] != 0)
+transit.match_lat_lng(junctions, 'junction_id', 'junction_dst', count_field='transit_count', distance_limit=200)
+transit.filter(col('junction_id') != 0)
 print(f"Removed transit with no connections. Remaining {len(transit)} ({len(transit) / starting_transit_count:.0%})")
 
 
@@ -159,9 +174,9 @@ rapid_transit.convert_properties({
     'longitude': float
 })
 
-rapid_transit.match_lat_lng_approx(junctions, 'junction_id', 'junction_dst', count_field='rapid_transit_count', distance_limit=200)
-rapid_transit.filter(lambda row: row['junction_id'] != 0)
-rapid_transit.filter(lambda row: row['id'] != 18) # Removing one of the commercial - broadway stations
+rapid_transit.match_lat_lng(junctions, 'junction_id', 'junction_dst', count_field='rapid_transit_count', distance_limit=200)
+rapid_transit.filter(col('junction_id') != 0)
+rapid_transit.filter(col('id') != 18) # Removing one of the commercial - broadway stations
 print(f"Removed rapid transit with no connections. Remaining {len(rapid_transit)} ({len(rapid_transit) / starting_rapid_transit_count:.0%})")
 
 ## Cleanup Schools ##
@@ -174,8 +189,8 @@ schools.convert_properties({
     'longitude': float
 })
 
-schools.match_lat_lng_approx(junctions, 'junction_id', 'junction_dst', count_field='schools_count', distance_limit=200)
-schools.filter(lambda row: row['junction_id'] != 0)
+schools.match_lat_lng(junctions, 'junction_id', 'junction_dst', count_field='schools_count', distance_limit=200)
+schools.filter(col('junction_id') != 0)
 print(f"Removed schools with no connections. Remaining {len(schools)} ({len(schools) / starting_schools_count:.0%})")
 
 ## Cleanup Businesses ##
@@ -186,18 +201,15 @@ businesses.convert_property('latitude', float)
 businesses.convert_property('longitude', float)
 businesses.convert_property('retail', lambda v: True if v == "True" else False)
 
-businesses.match_lat_lng_approx(junctions, 'junction_id', 'junction_dst', count_field='retail_count', distance_limit=200)
-businesses.filter(lambda row: row['junction_id'] != 0)
+businesses.match_lat_lng(junctions, 'junction_id', 'junction_dst', count_field='retail_count', distance_limit=200)
+businesses.filter(col('junction_id') != 0)
 print(f"Removed businesses with no connections. Remaining {len(businesses)} ({len(businesses) / starting_business_count:.0%})")
 
+businesses.create_index('junction_id')
 for junction in junctions:
-    junction['retail_count'] = 0
-    junction['employees'] = 0
-
-for business in businesses:
-    if not business['retail']: continue
-    junctions[business['junction_id']]['retail_count'] += 1
-    junctions[business['junction_id']]['employees'] += business['employees_count']
+    retail = [business for business in businesses.lookup('junction_id', junction['id']) if business['retail']]
+    junction['retail_count'] = len(retail)
+    junction['employees'] = sum(business['employees_count'] for business in retail)
     
 
 
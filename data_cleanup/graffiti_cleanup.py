@@ -9,6 +9,8 @@ import os
 import utm
 
 from data_wrangler import Dataset
+from data_wrangler import col
+from data_wrangler.aggregation import count, mean
 from data_wrangler.conversion_functions import RowFunction
 from data_wrangler.conversion_functions import generate_id
 from data_wrangler.conversion_functions import create_regular_str
@@ -22,6 +24,7 @@ OUTPUT_FOLDER = '../data/cleaned_data'
 GRAFFITI = f'{INPUT_FOLDER}/graffiti.csv'
 OBSERVATIONS = f'{INPUT_FOLDER}/observations.csv'
 JUNCTIONS = f'{OUTPUT_FOLDER}/junctions.csv'
+JUNCTION_INDEX = f'{OUTPUT_FOLDER}/junctions.spatial'
 
 if not os.path.exists(OUTPUT_FOLDER):
     os.makedirs(OUTPUT_FOLDER)
@@ -68,6 +71,9 @@ junctions.convert_properties({
     'longitude': float
 })
 
+# Reuse the junction index saved by cleanup.py
+junctions.spatial_index(JUNCTION_INDEX)
+
 
 starting_graffiti_count = len(graffiti)
 starting_observation_count = len(observations)
@@ -77,46 +83,26 @@ print()
 print(f"Initial graffiti count: {starting_graffiti_count}")
 
 graffiti.match_lat_lng(junctions, 'junction_id', 'junction_dst', count_field='graffiti_count', distance_limit=200, count_attrib='count')
-graffiti.filter(lambda row: row['junction_id'] != 0)
+graffiti.filter(col('junction_id') != 0)
 print(f"Removed graffiti with no connections. Remaining {len(graffiti)} ({len(graffiti) / starting_graffiti_count:.0%})")
 
 ## Cleanup Observations ##
 print()
 print(f"Initial observation count: {starting_observation_count}")
 
-def on_match(row_1, row_2, dst):
-    row_1['junction_id'] = row_2[junctions.primary_key]
-    row_1['junction_dst'] = dst
-    
-    row_2['observation_count'] = row_2['observation_count'] + 1
-    if (row_1['crime_type'] == 1): row_2['theft_likelihood'] += row_1['crime_likelihood']
-    if (row_1['crime_type'] == 2): row_2['mischief_likelihood'] += row_1['crime_likelihood']
-    if (row_1['crime_type'] == 3): row_2['breakins_likelihood'] += row_1['crime_likelihood']
-    if (row_1['crime_type'] == 4): row_2['assault_likelihood'] += row_1['crime_likelihood']
-    if (row_1['crime_type'] == 5): row_2['other_likelihood'] += row_1['crime_likelihood']
-    
-for row in junctions:
-    row['observation_count'] = 0
-    row['theft_likelihood'] = 0
-    row['mischief_likelihood'] = 0
-    row['breakins_likelihood'] = 0
-    row['assault_likelihood'] = 0
-    row['other_likelihood'] = 0
-
-observations.match_lat_lng_custom(junctions, on_match=on_match, distance_limit=200)
+# The likelihoods are the total likelihood of each type of crime divided by the number of observations
+observations.spatial_aggregate(junctions, {
+    'observation_count': count(),
+    'theft_likelihood': mean(col('crime_likelihood') * (col('crime_type') == 1)),
+    'mischief_likelihood': mean(col('crime_likelihood') * (col('crime_type') == 2)),
+    'breakins_likelihood': mean(col('crime_likelihood') * (col('crime_type') == 3)),
+    'assault_likelihood': mean(col('crime_likelihood') * (col('crime_type') == 4)),
+    'other_likelihood': mean(col('crime_likelihood') * (col('crime_type') == 5)),
+}, 'junction_id', 'junction_dst', distance_limit=200)
 #observations.match_lat_lng(junctions, 'junction_id', 'junction_dst', count_field='observation_count', distance_limit=200)
-observations.filter(lambda row: row['junction_id'] != 0)
+observations.filter(col('junction_id') != 0)
 print(f"Removed observations with no connections. Remaining {len(observations)} ({len(observations) / starting_observation_count:.0%})")
 
-for row in junctions:
-    c = row['observation_count']
-    if c == 0: continue
-    row['theft_likelihood'] /= c
-    row['mischief_likelihood'] /= c
-    row['breakins_likelihood'] /= c
-    row['assault_likelihood'] /= c
-    row['other_likelihood'] /= c
-
 junctions.write_to_file(f'{OUTPUT_FOLDER}/junctions.csv')
 graffiti.write_to_file(f'{OUTPUT_FOLDER}/graffiti.csv')
 observations.write_to_file(f'{OUTPUT_FOLDER}/observations.csv')
\ No newline at end of file
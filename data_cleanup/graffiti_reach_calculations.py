@@ -3,21 +3,26 @@ sys.path.append('../') # This should probably be changed to a more sofisticated
 
 import math
 
-from heapq import heappush, heappop
+import numpy as np
 
-from ast import literal_eval
 from data_wrangler import Dataset
+from data_wrangler import binary_format
+from data_wrangler.graph import JunctionGraph
+from data_wrangler.reach import compute_reaches
+from data_wrangler.conversion_functions import parse_list
 
 INPUT_FOLDER = '../data/cleaned_data'
 OUTPUT_FOLDER = '../data/cleaned_data'
 
 JUNCTION_FILE = f'{INPUT_FOLDER}/junctions.csv'
+JUNCTION_CACHE = f'{INPUT_FOLDER}/junctions.npdata'
+# The network neighborhoods of the junctions, shared by every reach script with the same limit
+NEIGHBORHOOD_CACHE = f'{INPUT_FOLDER}/junctions.neighborhoods'
 
 CRIME_SIGMA = 132
 STANDARD_DEVIATION = 400
 
-junctions = Dataset.load_file(JUNCTION_FILE)
-junctions.convert_properties({
+JUNCTION_CONVERSIONS = {
     'id': int,
     'crime_count': int,
     'stores_count': int,
@@ -25,13 +30,26 @@ junctions.convert_properties({
     'rapid_transit_count': int,
     'schools_count': int,
     'retail_count': int,
-    'neighbors': lambda v : literal_eval(v) if v else []
-})
+    'neighbors': parse_list
+}
+
+# Reuse the converted junctions from the last run if junctions.csv and the conversions have not changed since. Both reach
+# scripts share the cache so the key makes sure one never uses junctions converted differently by the other.
+junction_key = binary_format.cache_key(JUNCTION_FILE, JUNCTION_CONVERSIONS)
+if binary_format.is_fresh(JUNCTION_CACHE, JUNCTION_FILE, junction_key):
+    junctions = Dataset.load_binary(JUNCTION_CACHE, columnar=False)
+else:
+    junctions = Dataset.load_file(JUNCTION_FILE)
+    junctions.convert_properties(JUNCTION_CONVERSIONS)
+    junctions.save_binary(JUNCTION_CACHE, junction_key)
+
+# The network as flat arrays. Node i is the ith junction.
+graph = JunctionGraph.from_dataset(junctions)
 
 def normal_dst(distance, standard_deviation):
     scale = 1 / (2 * math.pi * (standard_deviation ** 2))
     power = distance ** 2 / (2 * standard_deviation ** 2)
-    distribution = math.exp(-power)
+    distribution = np.exp(-power)
     return scale * distribution
 
 def reach_dst(distance, scale):
@@ -45,61 +63,20 @@ def reach_dst(distance, scale):
     
     return 1 / ((distance / scale + 1) ** 3)
 
-def calculate_reach(junction, properties, dst_func, limit=float('inf')):
-    """
-    Args:
-        junction (Row): The junction to calculate the reach for
-        prop (str): The property to use for junction weights
-        dst_scale (float): The value to scale distance by. Should be in the range (0, 1]. Likely close to zero.
-
-    Returns:
-        float: The calculated reach.
-    """
-    reaches = { key: 0 for key in properties}
-    visited = set()
-    queue = []
-    heappush(queue, (0, junction['id']))
-    while queue:
-        dst, next_jun = heappop(queue)
-        if next_jun in visited: continue
-        visited.add(next_jun)
-        if dst > limit: continue
-        
-        # The range formula is: weight * 1 / (dst_scale * dst + 1) ^ 2
-        # We have +1 because we want distance of zero to be constant with respect to dst_scale
-        # We square the denominator because this causes it to converge
-        
-        # Update the range values
-        crime_dst = normal_dst(dst, CRIME_SIGMA)
-        scaled_dst = dst_func(dst)
-        for key in properties:
-            if key == 'crime_reach':
-                reaches[key] += junctions[next_jun][properties[key]] * crime_dst
-            else:
-                reaches[key] += junctions[next_jun][properties[key]] * scaled_dst
-              
-        for neighbor, delta, s_id in junctions[next_jun]['neighbors']:
-            if neighbor in visited: continue
-            neighbor_dst = dst + delta
-            heappush(queue, (neighbor_dst, neighbor))
-    return reaches
-
 def calculate_reaches(junctions, properties, dst_func, limit=float('inf')):
-    highest = { key: 0 for key in properties}
+    """ Calculate the reaches of all the junctions in parallel and normalize them so the highest reach is 1 """
+    weights = { key: junctions.get_column(properties[key]) for key in properties }
+    
+    # The crime reach uses its own distribution
+    kernels = { key: (lambda dst: normal_dst(dst, CRIME_SIGMA)) if key == 'crime_reach' else dst_func for key in properties }
+    
+    reaches = compute_reaches(graph, weights, kernels, limit, cache_directory=NEIGHBORHOOD_CACHE)
+    print(f'Calculated {len(junctions)}/{len(junctions)}')
     
-    for i, junction in enumerate(junctions):
-        reaches = calculate_reach(junction, properties, dst_func, limit)
-        for key in reaches:
-            junction[key] = reaches[key]
-            highest[key] = max(highest[key], reaches[key])
-        
-        if (i+1) % 100 == 0:
-            print(f'\rCalculated {i+1}/{len(junctions)}           ', end='')
-    print(f'\rCalculated {len(junctions)}/{len(junctions)}        ')
     print("Normalizing")
-    for junction in junctions:
-        for key in properties:
-            junction[key] /= highest[key]
+    reaches /= reaches.max(axis=0)
+    for column, key in enumerate(properties):
+        junctions.set_column(key, reaches[:, column])
     print("Done")
     
 calculate_reaches(
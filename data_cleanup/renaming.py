@@ -4,12 +4,12 @@ import sys
 sys.path.append('../') # This should probably be changed to a more sofisticated system at some point. i.e. install the package
 
 import os
-import utm
 
 from data_wrangler import Dataset
 from data_wrangler.conversion_functions import RowFunction
 from data_wrangler.conversion_functions import generate_id
 from data_wrangler.conversion_functions import create_regular_str
+from data_wrangler.conversion_functions import convert_if_not_null
 from data_wrangler.conversion_functions import split_latitude, split_longitude
 
 ZONE_NUMBER = 10
@@ -26,6 +26,7 @@ COMMERCIAL_FILE = f'{INPUT_FOLDER}/storefronts-inventory.csv'
 SCHOOL_FILE = f'{INPUT_FOLDER}/schools.csv'
 CRIME_2022 = f'{INPUT_FOLDER}/crime_2022.csv'
 CRIME_2021 = f'{INPUT_FOLDER}/crime_2021.csv'
+CRIME_2023 = f'{INPUT_FOLDER}/crime_2023.csv'
 
 
 if not os.path.exists(OUTPUT_FOLDER):
@@ -163,17 +164,14 @@ crime_conversion_props = {
     'time_of_crime': RowFunction(lambda row, i: f"{create_regular_str(row['HOUR'])}:{create_regular_str(row['MINUTE'])}"),
     'hundred_block': (str, 'HUNDRED_BLOCK'),
     
-    # Determining latitude and longitude from utm location
-    'latitude': RowFunction(lambda row, i: utm.to_latlon(float(row["X"]), float(row["Y"]), ZONE_NUMBER, ZONE_LETTER)[0] if row["X"] and row["Y"] and (float(row["X"]) or float(row["Y"])) else 0),
-    'longitude': RowFunction(lambda row, i: utm.to_latlon(float(row["X"]), float(row["Y"]), ZONE_NUMBER, ZONE_LETTER)[1] if row["X"] and row["Y"] and (float(row["X"]) or float(row["Y"])) else 0),
+    # The utm location. Latitude and longitude are determined from it for all the crimes at once below
+    'easting': (lambda v: convert_if_not_null(v, on_null=0), 'X'),
+    'northing': (lambda v: convert_if_not_null(v, on_null=0), 'Y'),
 }
 
-crime_2022 = Dataset.load_file(CRIME_2022, crime_conversion_props)
-crime_2021 = Dataset.load_file(CRIME_2021, crime_conversion_props)
-
-# Modify the crime 2021 ID values
-crime_2021_id_start = len(crime_2022)
-crime_2021.convert_property('id', lambda id: id + crime_2021_id_start)
-
-crime_2022.merge(crime_2021)
-crime_2022.write_to_file(f'{OUTPUT_FOLDER}/crimes.csv')
\ No newline at end of file
+# The files are loaded in parallel and the generated ids continue from one file to the next
+crimes = Dataset.load_many([CRIME_2022, CRIME_2021, CRIME_2023], crime_conversion_props)
+crimes.unproject_utm(ZONE_NUMBER, ZONE_LETTER)
+crimes.drop('easting')
+crimes.drop('northing')
+crimes.write_to_file(f'{OUTPUT_FOLDER}/crimes.csv')
\ No newline at end of file
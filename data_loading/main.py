@@ -10,9 +10,8 @@ from data_wrangler import Category
 from data_wrangler import Relationship
 from data_wrangler import GraphWriter
 
-from ast import literal_eval
-
 from data_wrangler.conversion_functions import convert_if_not_null
+from data_wrangler.conversion_functions import parse_list
 from data_wrangler.relationship_property_matchers import first_set_prop_match
 from data_wrangler.relationship_property_matchers import match_props
 from data_wrangler.conversion_functions import split_latitude, split_longitude
@@ -38,6 +37,11 @@ OBSERVATIONS_FILE = f'{INPUT_FOLDER}/observations.csv'
 ZONE_NUMBER = 10
 ZONE_LETTER = 'U'
 
+# Store rows as CompactRows instead of dicts to reduce memory use when every category is loaded at once. Off by default since
+# it only shrinks the rows and not list values like neighbors, which saves far less than the 3x that would be worth the change
+# for the junctions and segments. See Dataset.compact.
+COMPACT_ROWS = False
+
 ## Main Program ##
 
 def main():
@@ -123,8 +127,8 @@ def load_junctions():
             'rapid_transit_count': int,
             'retail_count': int,
             'rapid_transit_count': int,
-            'neighbor_ids': (lambda v: [n[0] for n in literal_eval(v if v else '[]')], 'neighbors'),
-            'street_ids': (lambda v: [n[2] for n in literal_eval(v if v else '[]')], 'neighbors'),
+            'neighbor_ids': (lambda v: [n[0] for n in parse_list(v)], 'neighbors'),
+            'street_ids': (lambda v: [n[2] for n in parse_list(v)], 'neighbors'),
             'crime_reach': float,
             'store_reach': float,
             'transit_reach': float,
@@ -132,7 +136,8 @@ def load_junctions():
             'schools_reach': float,
             'retail_reach': float,
             'elevation': float
-        }
+        },
+        compact=COMPACT_ROWS
     )
     
     junctions = Category(
@@ -193,9 +198,10 @@ def load_segments():
             'length_metres': float,
             'latitude': float,
             'longitude': float,
-            'land_uses': literal_eval,
-            'neighbors': literal_eval
-        }
+            'land_uses': parse_list,
+            'neighbors': parse_list
+        },
+        compact=COMPACT_ROWS
     )
     
     print("Loaded Segments")
@@ -217,6 +223,7 @@ def load_transit():
             'junction_id': int,
             'junction_dst': float
         },
+        compact=COMPACT_ROWS
     )
     
     transit = Category(
@@ -251,6 +258,7 @@ def load_crimes():
             'junction_id': int,
             'junction_dst': float
         },
+        compact=COMPACT_ROWS
     )
     
     crimes = Category(
@@ -285,7 +293,8 @@ def load_stores():
             'longitude': float,
             'junction_id': int,
             'junction_dst': float
-        }
+        },
+        compact=COMPACT_ROWS
     )
     
     stores = Category(
@@ -318,7 +327,8 @@ def load_rapid_transit():
             'longitude': float,
             'junction_id': int,
             'junction_dst': float
-        }
+        },
+        compact=COMPACT_ROWS
     )
     
     rtransit = Category(
@@ -350,7 +360,8 @@ def load_schools():
             'longitude': float,
             'junction_id': int,
             'junction_dst': float
-        }
+        },
+        compact=COMPACT_ROWS
     )
     
     schools = Category(
@@ -381,7 +392,8 @@ def load_trees():
             'latitude': (lambda s : split_latitude(s) if len(s.strip()) > 0 else 0, 'geo_point_2d'),
             'longitude': (lambda s : split_longitude(s) if len(s.strip()) > 0 else 0, 'geo_point_2d'),
         },
-        delimiter=';'
+        delimiter=';',
+        compact=COMPACT_ROWS
     )
     
     trees = Category(
@@ -407,7 +419,8 @@ def load_graffiti():
             'longitude': float,
             'junction_id': int,
             'junction_dst': float
-        }
+        },
+        compact=COMPACT_ROWS
     )
     
     graffiti = Category(
@@ -442,7 +455,8 @@ def load_observations():
             'longitude': float,
             'junction_id': int,
             'junction_dst': float
-        }
+        },
+        compact=COMPACT_ROWS
     )
     
     observations = Category(
@@ -487,7 +501,8 @@ def load_businesses():
             'longitude': float,
             'junction_id': int,
             'junction_dst': float
-        }
+        },
+        compact=COMPACT_ROWS
     )
     
     businesses = Category(
@@ -1,6 +1,12 @@
 from .dataset import Dataset
+from .columnar_dataset import ColumnarDataset
+from .lazy_dataset import LazyDataset
 from .category import Category
 from .relationship import Relationship
 from .graph_writer import GraphWriter
+from .predicates import col
 from . import conversion_functions
-from . import relationship_property_matchers
\ No newline at end of file
+from . import relationship_property_matchers
+from . import binary_format
+from . import distance
+from . import aggregation
\ No newline at end of file
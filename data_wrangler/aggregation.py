@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+from typing import Any
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from .predicates import Expression
+
+if TYPE_CHECKING:
+    from .dataset import Dataset
+
+
+class Aggregation:
+    """A summary of the rows of one dataset that are matched to each row of another, eg. the crimes closest to each junction
+
+    Used with Dataset.spatial_aggregate. Create aggregations with count, total or mean instead of calling this directly.
+    Each aggregation is computed for all the target rows at once with np.bincount.
+    """
+
+    def __init__(
+        self, kind: str, column: str | Expression | None = None, where: Expression | None = None, by: str | None = None,
+        labels: dict[Any, str] | None = None
+    ):
+        """ Create an aggregation
+
+        Args:
+            kind (str): 'count', 'total' or 'mean'
+            column (str | Expression | None, optional): The property or expression to total or average. Defaults to None.
+            where (Expression | None, optional): Only include the rows where this is true. Defaults to None.
+            by (str | None, optional): A property to compute the aggregation separately for each value of. Defaults to None.
+            labels (dict[Any, str] | None, optional): The names to use for values of [by] in the property names. Defaults to None.
+        """
+        if kind not in ('count', 'total', 'mean'):
+            raise Exception(f"Unknown aggregation {kind}. Use one of: count, total, mean")
+        if kind != 'count' and column is None:
+            raise Exception(f"A {kind} aggregation needs a column")
+
+        self.kind = kind
+        self.column = column
+        self.where = where
+        self.by = by
+        self.labels = labels or {}
+
+    def compute(self, source: Dataset, positions: np.ndarray, size: int, name: str) -> dict[str, np.ndarray]:
+        """Compute the aggregation for every target row
+
+        Args:
+            source (Dataset): The matched rows
+            positions (np.ndarray): The position of the target row that each source row is matched to, or -1
+            size (int): The number of target rows
+            name (str): The name of the property to store the result in. With [by] it must contain {} which is replaced by each value.
+
+        Returns:
+            dict[str, np.ndarray]: The values for each target row by property name
+        """
+        selected = positions != -1
+        # Expressions overload == so they are compared with is
+        if self.where is not None and len(source) > 0:
+            selected &= self.where.mask(source)
+        bins = positions[selected]
+
+        values = None
+        if self.column is not None:
+            values = self._column_values(source)[selected]
+
+        if self.by == None:
+            return { name: self._reduce(bins, values, size) }
+
+        if '{}' not in name:
+            raise Exception(f"The name of an aggregation by {self.by} must contain {{}} for the value, eg. '{{}}_{name}'")
+
+        categories = source.get_column(self.by)[selected] if len(source) > 0 else np.zeros(0)
+        results = {}
+        for category in dict.fromkeys([*self.labels, *categories.tolist()]):
+            in_category = categories == category
+            results[name.format(self.labels.get(category, category))] = self._reduce(
+                bins[in_category], None if values is None else values[in_category], size
+            )
+        return results
+
+    def _column_values(self, source: Dataset) -> np.ndarray:
+        """Get the values of the column or expression for every source row"""
+        if len(source) == 0: return np.zeros(0)
+        if isinstance(self.column, Expression):
+            return self.column.values(source)
+        return source.get_column(self.column) # type: ignore
+
+    def _reduce(self, bins: np.ndarray, values: np.ndarray | None, size: int) -> np.ndarray:
+        """Combine the values that fall in each bin"""
+        counts = np.bincount(bins, minlength=size)
+        if self.kind == 'count':
+            return counts
+
+        weights = np.asarray(values, dtype=np.float64)
+        totals = np.bincount(bins, weights, minlength=size)
+        if self.kind == 'total':
+            # Totals of whole numbers stay whole numbers
+            return totals.astype(np.int64) if values.dtype.kind in 'biu' else totals # type: ignore
+
+        means = np.zeros(size, dtype=np.float64)
+        np.divide(totals, counts, out=means, where=counts > 0)
+        return means
+
+
+def count(where: Expression | None = None, by: str | None = None, labels: dict[Any, str] | None = None) -> Aggregation:
+    """The number of rows matched to each row
+
+    eg: count(by='type_of_crime') stored in '{}_count'
+
+    Args:
+        where (Expression | None, optional): Only count the rows where this is true. Defaults to None.
+        by (str | None, optional): Count each value of this property separately. Defaults to None.
+        labels (dict[Any, str] | None, optional): The names to use for values of [by]. Defaults to None.
+
+    Returns:
+        Aggregation: The aggregation
+    """
+    return Aggregation('count', where=where, by=by, labels=labels)
+
+def total(column: str | Expression, where: Expression | None = None, by: str | None = None, labels: dict[Any, str] | None = None) -> Aggregation:
+    """The sum of a property of the rows matched to each row. Rows with nothing matched get 0.
+
+    Args:
+        column (str | Expression): The property or expression to add up
+        where (Expression | None, optional): Only include the rows where this is true. Defaults to None.
+        by (str | None, optional): Add up each value of this property separately. Defaults to None.
+        labels (dict[Any, str] | None, optional): The names to use for values of [by]. Defaults to None.
+
+    Returns:
+        Aggregation: The aggregation
+    """
+    return Aggregation('total', column, where, by, labels)
+
+def mean(column: str | Expression, where: Expression | None = None, by: str | None = None, labels: dict[Any, str] | None = None) -> Aggregation:
+    """The average of a property of the rows matched to each row. Rows with nothing matched get 0.
+
+    eg: mean(col('crime_likelihood') * (col('crime_type') == 1)) is the total likelihood of type 1 divided by the number of matches
+
+    Args:
+        column (str | Expression): The property or expression to average
+        where (Expression | None, optional): Only include the rows where this is true. Defaults to None.
+        by (str | None, optional): Average each value of this property separately. Defaults to None.
+        labels (dict[Any, str] | None, optional): The names to use for values of [by]. Defaults to None.
+
+    Returns:
+        Aggregation: The aggregation
+    """
+    return Aggregation('mean', column, where, by, labels)
+
+def aggregate_matches(source: Dataset, target: Dataset, positions: np.ndarray, aggregations: dict[str, Aggregation], reset: bool = True):
+    """Store aggregations of the rows of [source] in the rows of [target] they are matched to
+
+    Args:
+        source (Dataset): The matched rows
+        target (Dataset): The rows to store the aggregations in
+        positions (np.ndarray): The position in [target] of the row that each row of [source] is matched to, or -1
+        aggregations (dict[str, Aggregation]): The aggregations by the name of the property to store them in
+        reset (bool, optional): Whether to replace existing values instead of adding to them. Defaults to True.
+    """
+    for name, aggregation in aggregations.items():
+        for column_name, values in aggregation.compute(source, positions, len(target), name).items():
+            if not reset:
+                values = values + _to_array([row.get(column_name, 0) for row in target])
+            target.set_column(column_name, values)
+
+def _to_array(values: list[Any]) -> np.ndarray:
+    """Convert existing values of a property to an array that can be added to"""
+    return np.asarray(values, dtype=np.int64 if all(type(value) == int for value in values) else np.float64)
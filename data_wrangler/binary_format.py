@@ -0,0 +1,150 @@
+import os
+import json
+import pickle
+import hashlib
+
+from functools import partial
+from types import CodeType
+from typing import Any
+
+import numpy as np
+
+from .conversion_functions import RowFunction
+
+META_FILE = 'meta.json'
+FORMAT_VERSION = 1
+
+
+def save_columns(directory: str, columns: dict[str, np.ndarray], primary_key: str, key: str | None = None):
+    """Save columns to a directory in a binary format
+
+    Numeric and bool columns are saved as .npy files so that they can be memory mapped when loaded.
+    Object columns (strings, lists, tuples) are pickled so nested values are kept exactly.
+
+    Args:
+        directory (str): The directory to save to. Created if it does not exist.
+        columns (dict[str, np.ndarray]): The columns to save
+        primary_key (str): The primary key of the data
+        key (str | None, optional): A cache_key for what the data was made from, checked by is_fresh. Defaults to None.
+    """
+    os.makedirs(directory, exist_ok=True)
+    meta_path = os.path.join(directory, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    column_info = []
+    for i, (name, column) in enumerate(columns.items()):
+        # Column names can contain any character so files are named by position
+        if column.dtype.kind == 'O':
+            file = f'{i}.pkl'
+            with open(os.path.join(directory, file), 'wb') as out_file:
+                pickle.dump(column.tolist(), out_file, protocol=pickle.HIGHEST_PROTOCOL)
+        else:
+            file = f'{i}.npy'
+            np.save(os.path.join(directory, file), np.ascontiguousarray(column))
+        column_info.append({ 'name': name, 'file': file })
+
+    # The meta file is written last so a partially written directory is never treated as valid
+    with open(meta_path, 'w', encoding='utf-8') as meta_file:
+        json.dump({ 'version': FORMAT_VERSION, 'primary_key': primary_key, 'columns': column_info, 'key': key }, meta_file)
+
+def load_columns(directory: str, mmap=True) -> tuple[dict[str, np.ndarray], str]:
+    """Load columns saved with save_columns
+
+    Memory mapped columns are copy on write. They can be changed in memory but the changes are never written back to the file.
+
+    Args:
+        directory (str): The directory to load from
+        mmap (bool, optional): Whether to memory map the numeric columns instead of reading them. Defaults to True.
+
+    Returns:
+        tuple[dict[str, np.ndarray], str]: The columns and the primary key
+    """
+    with open(os.path.join(directory, META_FILE), 'r', encoding='utf-8') as meta_file:
+        meta: dict[str, Any] = json.load(meta_file)
+
+    if meta.get('version') != FORMAT_VERSION:
+        raise Exception(f"{directory} was saved with an unsupported format version: {meta.get('version')}")
+
+    columns = {}
+    for info in meta['columns']:
+        path = os.path.join(directory, info['file'])
+        if info['file'].endswith('.pkl'):
+            with open(path, 'rb') as in_file:
+                values = pickle.load(in_file)
+            columns[info['name']] = np.fromiter(values, dtype=object, count=len(values))
+        else:
+            columns[info['name']] = np.load(path, mmap_mode='c' if mmap else None)
+    return columns, meta['primary_key']
+
+def is_fresh(directory: str, source: str, key: str | None = None) -> bool:
+    """Check that a saved directory exists and can be used instead of the file it was created from
+
+    Without a key the directory only has to be newer than the file. With a key, eg. from cache_key, it must have been saved with
+    the same key, so changing the file or the conversions that were applied to it makes the directory stale.
+
+    Args:
+        directory (str): The saved directory
+        source (str): The file the data was originally loaded from
+        key (str | None, optional): The key the directory must have been saved with. Defaults to None.
+
+    Returns:
+        bool: True if the saved data can be used instead of the source
+    """
+    meta_path = os.path.join(directory, META_FILE)
+    if not os.path.exists(meta_path): return False
+    if key != None:
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+        except (OSError, ValueError):
+            return False
+        return meta.get('version') == FORMAT_VERSION and meta.get('key') == key
+    return not os.path.exists(source) or os.path.getmtime(meta_path) >= os.path.getmtime(source)
+
+def cache_key(source: str, conversions: dict[str, Any] | None = None) -> str:
+    """Get a key for data loaded from a file and converted, to save with the data and check with is_fresh
+
+    The key is a hash of the contents of the file and of the conversion map. Conversion functions are identified by their
+    module and name, and functions defined in python (eg. lambdas) also by their code, so editing a conversion changes the key.
+
+    Args:
+        source (str): The file the data is loaded from
+        conversions (dict[str, Any] | None, optional): The conversion map that is applied to it. Defaults to None.
+
+    Returns:
+        str: The key as hex
+    """
+    digest = hashlib.sha256()
+    with open(source, 'rb') as source_file:
+        for chunk in iter(lambda: source_file.read(1 << 20), b''):
+            digest.update(chunk)
+    for name, conversion in (conversions or {}).items():
+        digest.update(f'{name}={_describe(conversion)};'.encode())
+    return digest.hexdigest()
+
+def _describe(conversion: Any) -> str:
+    """Describe a conversion so that different conversions are described differently"""
+    if isinstance(conversion, (tuple, list)):
+        return f"({','.join(map(_describe, conversion))})"
+    if isinstance(conversion, RowFunction):
+        return f'RowFunction({_describe(conversion.f)})'
+    if isinstance(conversion, partial):
+        return f'partial({_describe(conversion.func)},{conversion.args!r},{conversion.keywords!r})'
+    if not callable(conversion):
+        return repr(conversion)
+
+    description = f"{getattr(conversion, '__module__', '')}.{getattr(conversion, '__qualname__', type(conversion).__qualname__)}"
+    code = getattr(conversion, '__code__', None)
+    if code != None:
+        description += f'[{_code_hash(code)}]'
+    return description
+
+def _code_hash(code: CodeType) -> str:
+    """Hash the bytecode and constants of a function, including the functions defined inside it"""
+    digest = hashlib.sha256(code.co_code)
+    for constant in code.co_consts:
+        # Code objects are hashed by their contents since their repr contains their address
+        digest.update((_code_hash(constant) if isinstance(constant, CodeType) else repr(constant)).encode())
+    digest.update(repr(code.co_names).encode())
+    return digest.hexdigest()
@@ -0,0 +1,78 @@
+from typing import Any
+from collections.abc import Iterable
+
+
+class ColumnIndex:
+    """A multi-map from the values of one column to the primary keys of the rows that have that value
+
+    Created and kept up to date by Dataset.create_index. The values of the column must be hashable.
+    """
+
+    def __init__(self, column: str, keys: Iterable[Any] = (), values: Iterable[Any] = ()):
+        """ Create an index
+
+        Args:
+            column (str): The name of the indexed column
+            keys (Iterable[Any], optional): The primary keys of the rows
+            values (Iterable[Any], optional): The values of the column for each of the rows in keys
+        """
+        self.column = column
+
+        # Dicts with None values are used as ordered sets so the keys stay in row order
+        self._keys: dict[Any, dict[Any, None]] = {}
+        self.rebuild(keys, values)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, value):
+        return value in self._keys
+
+    def __getitem__(self, value) -> list[Any]:
+        return self.get(value)
+
+    def get(self, value: Any) -> list[Any]:
+        """Get the primary keys of the rows with a value
+
+        Args:
+            value (Any): The value to look up
+
+        Returns:
+            list[Any]: The primary keys. Empty if no rows have the value.
+        """
+        return list(self._keys.get(value, ()))
+
+    def values(self):
+        """Get the distinct values in the column"""
+        return self._keys.keys()
+
+    def items(self):
+        """Iterate over (value, list of primary keys) pairs"""
+        return ((value, list(keys)) for value, keys in self._keys.items())
+
+    def rebuild(self, keys: Iterable[Any], values: Iterable[Any]):
+        """Replace the contents of the index in place, so references to it stay valid
+
+        Args:
+            keys (Iterable[Any]): The primary keys of the rows
+            values (Iterable[Any]): The values of the column for each of the rows in keys
+        """
+        self._keys.clear()
+        for key, value in zip(keys, values):
+            self.add(value, key)
+
+    def add(self, value: Any, key: Any):
+        """Record that the row with primary key [key] has [value]"""
+        keys = self._keys.get(value)
+        if keys == None:
+            keys = self._keys[value] = {}
+        keys[key] = None
+
+    def discard(self, value: Any, key: Any):
+        """Remove a row from the index if it is there"""
+        keys = self._keys.get(value)
+        if keys == None: return
+
+        keys.pop(key, None)
+        if len(keys) == 0:
+            del self._keys[value]
@@ -0,0 +1,364 @@
+from __future__ import annotations
+
+from collections.abc import MutableMapping
+from collections.abc import Sequence
+from collections.abc import Iterator
+from itertools import repeat
+from copy import copy
+
+from typing import Any
+from typing import Callable
+
+import numpy as np
+
+from .dataset import Dataset
+from .conversion_functions import Row
+from .conversion_functions import ConversionFunction
+from .columns import SCALAR_TYPES
+from .columns import to_column
+from .columns import convert_column
+from .columns import upcast
+from .predicates import Expression
+from . import file_io
+
+
+class RowView(MutableMapping):
+    """A dict like view of one row of a ColumnarDataset
+
+    Reading or writing a value reads or writes the underlying column. Views are only valid until the dataset
+    they come from is filtered or has its rows otherwise rearranged.
+    """
+
+    __slots__ = ('_dataset', '_position')
+
+    def __init__(self, dataset: ColumnarDataset, position: int):
+        self._dataset = dataset
+        self._position = position
+
+    def __getitem__(self, key: str) -> Any:
+        column = self._dataset._columns[key]
+        value = column[self._position]
+        return value if column.dtype.kind == 'O' else value.item()
+
+    def __setitem__(self, key: str, value: Any):
+        self._dataset._set_value(key, self._position, value)
+
+    def __delitem__(self, key: str):
+        raise Exception(f"Cannot remove {key} from a single row of a columnar dataset. Use drop() instead.")
+
+    def __iter__(self):
+        return iter(self._dataset._columns)
+
+    def __len__(self):
+        return len(self._dataset._columns)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class ColumnarDataset(Dataset):
+    """A Dataset that stores one typed numpy array per column instead of one dict per row
+
+    Rows are still available through iteration and indexing, but as RowView objects backed by the columns.
+    Column wide operations (convert_property, add_property, filter, drop, rename) work on whole arrays.
+    """
+
+    def __init__(self, columns: dict[str, Sequence[Any]], primary_key='id'):
+        self.primary_key = primary_key
+        self._columns: dict[str, np.ndarray] = { name: to_column(values) for name, values in columns.items() }
+
+        if len(self._columns) > 0 and not self.primary_key in self._columns:
+            raise Exception(f"Primary key: {primary_key}, is not a valid key in the dataset")
+
+        self._indexes = {}
+        self._spatial_index = None
+        self._planar_index = None
+        self._projection = None
+        self._build_index()
+
+    @staticmethod
+    def from_rows(rows: Sequence[Row], primary_key='id') -> ColumnarDataset:
+        """Create a columnar dataset from a list of rows
+
+        Args:
+            rows (Sequence[Row]): The rows of the dataset
+            primary_key (str, optional): The primary key of the dataset. Defaults to 'id'.
+
+        Returns:
+            ColumnarDataset: The dataset
+        """
+        if len(rows) == 0: return ColumnarDataset({}, primary_key)
+        return ColumnarDataset({ name: [row.get(name) for row in rows] for name in rows[0] }, primary_key)
+
+    def to_dataset(self) -> Dataset:
+        """Convert this dataset to a row based Dataset
+
+        Returns:
+            Dataset: A Dataset containing a dict for every row
+        """
+        return Dataset([dict(row) for row in self], self.primary_key)
+
+    def to_columnar(self) -> ColumnarDataset:
+        return self
+
+    def compact(self):
+        """Columnar datasets do not store rows so there is nothing to compact"""
+        pass
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self):
+        return (RowView(self, position) for position in list(self._index.values()))
+
+    def __getitem__(self, index):
+        return RowView(self, self._index[index])
+
+    @property
+    def _rows(self) -> dict[Any, Row]:
+        return { key: dict(RowView(self, position)) for key, position in self._index.items() }
+
+    def _size(self) -> int:
+        """The length of the stored columns. Includes rows that have been removed but not compacted yet"""
+        if len(self._columns) == 0: return 0
+        return len(next(iter(self._columns.values())))
+
+    def _build_index(self):
+        """Map each primary key to the position of its row in the columns"""
+        keys = self._columns[self.primary_key].tolist() if self.primary_key in self._columns else []
+        self._index: dict[Any, int] = dict(zip(keys, range(len(keys))))
+
+    def _compact(self):
+        """Remove any rows that are no longer in the index from the columns"""
+        if len(self._index) == self._size(): return
+
+        positions = np.fromiter(self._index.values(), dtype=np.intp, count=len(self._index))
+        self._select(positions)
+
+    def _select(self, selection: np.ndarray):
+        """Keep only the rows in selection
+
+        Args:
+            selection (np.ndarray): A boolean mask or an array of positions
+        """
+        self._columns = { name: column[selection] for name, column in self._columns.items() }
+        self._build_index()
+
+    def _set_value(self, name: str, position: int, value: Any):
+        """Set a single value, changing the type of the column if it cannot hold the value"""
+        if name not in self._columns:
+            self._columns[name] = np.zeros(self._size(), dtype=to_column([value]).dtype)
+            if self._columns[name].dtype.kind == 'O':
+                self._columns[name][:] = None
+
+        column = upcast(self._columns[name], value)
+        try:
+            column[position] = value
+        except (ValueError, TypeError, OverflowError):
+            column = column.astype(object)
+            column[position] = value
+        self._columns[name] = column
+
+    def get_column(self, name: str) -> np.ndarray:
+        """Get all the values of a property as a numpy array
+
+        The returned array is the storage used by the dataset so changes to it change the dataset.
+
+        Args:
+            name (str): The name of the property
+
+        Returns:
+            np.ndarray: The values in row order
+        """
+        self._compact()
+        return self._columns[name]
+
+    def _row_values(self, columnnames: list[str]) -> Iterator[Sequence[Any]]:
+        """Iterate over the values of [columnnames] for each row, encoded for writing, by zipping the columns"""
+        columns = []
+        for name in columnnames:
+            if name not in self._columns:
+                columns.append(repeat('', len(self)))
+            elif self._columns[name].dtype.kind == 'O':
+                columns.append(map(file_io.encode_value, self.get_column(name).tolist()))
+            else:
+                columns.append(self.get_column(name).tolist())
+        return zip(*columns)
+
+    def set_column(self, name: str, values: Sequence[Any] | np.ndarray):
+        """Set the value of a property for every row, adding the property if it does not exist
+
+        Args:
+            name (str): The name of the property
+            values (Sequence[Any] | np.ndarray): The values in row order
+        """
+        if name == self.primary_key:
+            raise Exception("Cannot set the values of the primary key with set_column")
+        if len(values) != len(self):
+            raise Exception(f"Cannot set {name} from {len(values)} values because the dataset has {len(self)} rows")
+
+        self._compact()
+        # Copy arrays so the dataset does not share storage with the caller
+        self._columns[name] = to_column(np.array(values) if isinstance(values, np.ndarray) else values)
+        self._rebuild_indexes([name])
+
+    def remove(self, key_value):
+        """Remove a row from the dataset
+
+        Args:
+            key_value (Any): The primary key of the row to remove
+        """
+        self._unindex(key_value, self[key_value])
+        del self._index[key_value]
+
+    def set_primary_key(self, primary_key: str):
+        """Set the primary key of this dataset
+
+        If the values of the primary key property are not unique some data will be lost
+
+        Args:
+            primary_key (str): The name of the property that will become the primary key
+        """
+        self._compact()
+        self.primary_key = primary_key
+        self._build_index()
+        self._compact()
+        self._rebuild_indexes()
+
+    def add_property(self, name: str, **kwargs):
+        """Add a property to each row of the dataset
+
+        Either value or func should be set. If neither is set default will be 0.
+
+        Args:
+            name (str): The name of the new property
+        Kwargs:
+            value (Any): The default value of the property
+            func (Callable[[Row], Any]): The function to generate values. Is given the row
+        """
+        if name in self._columns:
+            raise Exception(f"Cannot add property {name} because it already exists in the dataset.")
+        self._compact()
+
+        if "value" in kwargs:
+            value = kwargs["value"]
+            if isinstance(value, SCALAR_TYPES):
+                self._columns[name] = np.full(len(self), value, dtype=to_column([value]).dtype)
+            else:
+                self._columns[name] = to_column([copy(value) for _ in range(len(self))])
+        elif "func" in kwargs:
+            self._columns[name] = to_column([kwargs["func"](row) for row in self])
+        else:
+            self._columns[name] = np.zeros(len(self), dtype=np.int64)
+
+    def drop(self, property_name: str):
+        """Remove a property from the dataset
+
+        Args:
+            property_name (str): The propery to remove
+        """
+        del self._columns[property_name]
+        self._indexes.pop(property_name, None)
+
+    def rename(self, original_name: str, new_name: str):
+        if new_name == original_name: return
+        if new_name in self._columns:
+            raise Exception(f"Cannot rename property {original_name} to {new_name} because {new_name} already exists in the dataset")
+
+        if original_name == self.primary_key:
+            self.primary_key = new_name
+
+        self._columns[new_name] = self._columns.pop(original_name)
+
+        if original_name in self._indexes:
+            index = self._indexes.pop(original_name)
+            index.column = new_name
+            self._indexes[new_name] = index
+
+    def convert_property(self, field_name: str, conversion: ConversionFunction):
+        """Apply a conversion function to a property
+
+        int and float conversions are applied to the whole column at once.
+
+        Args:
+            field_name (str): The name of the property to convert
+            conversion (ConversionFunction): The function to apply
+        """
+        self._compact()
+        self._columns[field_name] = convert_column(self._columns[field_name], conversion)
+
+        if field_name == self.primary_key:
+            self._build_index()
+            if len(self._index) != self._size():
+                raise Exception("Conversion resulted in non unique primary key")
+            self._rebuild_indexes()
+        else:
+            self._rebuild_indexes([field_name])
+
+    def convert_properties(self, conversions: dict[str, ConversionFunction]):
+        self._compact()
+        for field_name in conversions:
+            self._columns[field_name] = convert_column(self._columns[field_name], conversions[field_name])
+
+        if self.primary_key in conversions:
+            self._build_index()
+            self._rebuild_indexes()
+        else:
+            self._rebuild_indexes(conversions)
+
+    def get_column_names(self):
+        """Get the names of the columns in the dataset
+
+        The primary key is always the first value
+
+        Returns:
+            list[str]: The column names
+        """
+        if len(self) == 0: return []
+        fieldnames = list(self._columns)
+
+        if fieldnames[0] != self.primary_key:
+            fieldnames.remove(self.primary_key)
+            fieldnames.insert(0, self.primary_key)
+        return fieldnames
+
+    def merge(self, other: Dataset):
+        """Merge two datasets
+
+        The two datasets must have the same columns and primary key. Rows in [other] replace rows in this dataset with the same primary key.
+
+        Args:
+            other (Dataset): The dataset to merge into this one
+        """
+        if self.primary_key != other.primary_key:
+            raise Exception("Cannot merge datasets with different primary keys")
+        if self.get_column_names() != other.get_column_names():
+            raise Exception("Cannot merge datasets with different columns")
+        if len(other) == 0: return
+
+        for key in other.get_column(other.primary_key).tolist():
+            self._index.pop(key, None)
+        self._compact()
+
+        self._columns = {
+            name: np.concatenate([column, to_column(other.get_column(name))]) for name, column in self._columns.items()
+        }
+        self._build_index()
+        self._rebuild_indexes()
+
+    def filter(self, filter: Callable[[Row], bool] | Expression):
+        """Filter rows from the dataset
+
+        The filter function is run for each of the rows. If it returns False the row is removed from the dataset.
+        Expressions built with col() are evaluated on whole columns without visiting the rows.
+
+        Args:
+            filter (Callable[[Row], bool] | Expression): The filter function or expression
+        """
+        self._compact()
+        if isinstance(filter, Expression):
+            mask = filter.mask(self)
+        else:
+            mask = np.fromiter((bool(filter(row)) for row in self), dtype=np.bool_, count=len(self))
+        self._select(mask)
+        self._rebuild_indexes()
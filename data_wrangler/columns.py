@@ -0,0 +1,101 @@
+from collections.abc import Sequence
+
+from typing import Any
+
+import numpy as np
+
+from .conversion_functions import ConversionFunction
+
+BOOL_TYPES = {bool, np.bool_}
+INT_TYPES = {int, np.int8, np.int16, np.int32, np.int64, np.uint8, np.uint16, np.uint32}
+FLOAT_TYPES = {float, np.float16, np.float32, np.float64}
+SCALAR_TYPES = (bool, int, float, str, type(None), np.generic)
+
+
+def to_column(values: Sequence[Any]) -> np.ndarray:
+    """Store a sequence of values in the most specific numpy array that can hold them without loss
+
+    Sequences of only bools, ints or numbers become bool, int64 or float64 arrays. Everything else
+    (strings, lists, mixed values) is stored in an object array.
+
+    Args:
+        values (Sequence[Any]): The values of the column
+
+    Returns:
+        np.ndarray: The column
+    """
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'biufO':
+        return values
+
+    values = list(values)
+    types = set(map(type, values))
+
+    if types and types <= BOOL_TYPES:
+        return np.array(values, dtype=np.bool_)
+    if types and types <= INT_TYPES:
+        try:
+            return np.array(values, dtype=np.int64)
+        except OverflowError:
+            pass
+    elif types and types <= INT_TYPES | FLOAT_TYPES:
+        return np.array(values, dtype=np.float64)
+
+    # Use fromiter so that nested lists are stored as objects instead of becoming extra dimensions
+    return np.fromiter(values, dtype=object, count=len(values))
+
+def convert_column(column: np.ndarray, conversion: ConversionFunction) -> np.ndarray:
+    """Apply a conversion function to every value in a column
+
+    int and float are applied to the whole column at once by numpy. Any other conversion is called once per value.
+
+    Args:
+        column (np.ndarray): The column to convert
+        conversion (ConversionFunction): The function to apply
+
+    Returns:
+        np.ndarray: The converted column
+    """
+    if conversion in (int, float) and column.dtype.kind in 'OUSbiu':
+        try:
+            return column.astype(np.int64 if conversion == int else np.float64)
+        except (ValueError, TypeError, OverflowError):
+            # Fall back to python so that the error (if there is one) is the same as for a row dataset
+            pass
+    return to_column([conversion(value) for value in column.tolist()])
+
+def upcast(column: np.ndarray, value: Any) -> np.ndarray:
+    """Get a version of a column that is able to store a value without loss
+
+    Args:
+        column (np.ndarray): The column the value will be stored in
+        value (Any): The value
+
+    Returns:
+        np.ndarray: column if it can already hold the value otherwise a converted copy
+
+    Bools are stored as 0 and 1 in number columns the same as numpy assignment does:
+
+    >>> upcast(np.array([1, 2]), True).dtype
+    dtype('int64')
+    >>> upcast(np.array([1.5]), np.True_).dtype
+    dtype('float64')
+    >>> upcast(np.array([1, 2]), 'a').dtype
+    dtype('O')
+    """
+    kind = column.dtype.kind
+    value_type = type(value)
+
+    # Object columns can hold anything so they are never copied, which keeps writing a single value cheap
+    if kind == 'O':
+        return column
+    if kind in 'iuf' and value_type in BOOL_TYPES:
+        return column
+    if kind == 'b' and value_type in INT_TYPES:
+        return column.astype(np.int64)
+    if kind in 'bi' and value_type in FLOAT_TYPES:
+        return column.astype(np.float64)
+    if kind == 'f' and value_type in INT_TYPES:
+        return column
+    if (kind == 'b' and value_type in BOOL_TYPES) or (kind in 'iu' and value_type in INT_TYPES) or (kind == 'f' and value_type in FLOAT_TYPES):
+        return column
+    return column.astype(object)
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+from collections.abc import MutableMapping
+from collections.abc import Sequence
+
+from typing import Any
+from typing import Iterable
+
+from .conversion_functions import Row
+
+_row_classes: dict[tuple[str, ...], type[CompactRow]] = {}
+
+
+class CompactRow(MutableMapping):
+    """A row that stores its values in __slots__ instead of a dict
+
+    Every dataset in compact mode has a row class made by make_row_class with one slot per property. The rows behave like dicts,
+    so row['latitude'] style access keeps working, but do not need a hash table per row. Properties that are not part of the
+    class, eg. ones added later with row['name'] = value, are kept in a small dict that is only created when needed.
+    """
+
+    __slots__ = ('_extra',)
+
+    # Set by make_row_class
+    _fields: tuple[str, ...] = ()
+    _slot_names: dict[str, str] = {}
+
+    def __init__(self, values: Iterable[Any] = ()):
+        for slot, value in zip(self.__slots__, values):
+            setattr(self, slot, value)
+
+    @classmethod
+    def from_mapping(cls, row: Row) -> CompactRow:
+        """Create a row of this class with the values from another row
+
+        Args:
+            row (Row): The row to copy
+
+        Returns:
+            CompactRow: The new row
+        """
+        result = cls()
+        for key, value in row.items():
+            result[key] = value
+        return result
+
+    def __getitem__(self, key: str) -> Any:
+        slot = self._slot_names.get(key)
+        if slot != None:
+            try:
+                return getattr(self, slot)
+            except AttributeError:
+                raise KeyError(key) from None
+
+        extra = getattr(self, '_extra', None)
+        if extra == None: raise KeyError(key)
+        return extra[key]
+
+    def __setitem__(self, key: str, value: Any):
+        slot = self._slot_names.get(key)
+        if slot != None:
+            setattr(self, slot, value)
+            return
+
+        extra = getattr(self, '_extra', None)
+        if extra == None:
+            extra = self._extra = {}
+        extra[key] = value
+
+    def __delitem__(self, key: str):
+        slot = self._slot_names.get(key)
+        if slot != None:
+            try:
+                delattr(self, slot)
+            except AttributeError:
+                raise KeyError(key) from None
+            return
+
+        extra = getattr(self, '_extra', None)
+        if extra == None: raise KeyError(key)
+        del extra[key]
+
+    def __iter__(self):
+        for field, slot in self._slot_names.items():
+            if hasattr(self, slot):
+                yield field
+        yield from getattr(self, '_extra', None) or ()
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def __reduce__(self):
+        # The row classes are created at runtime so they are rebuilt from the fieldnames when unpickled
+        return (_rebuild_row, (self._fields, [self[key] if key in self else _MISSING for key in self._fields], getattr(self, '_extra', None)))
+
+
+class _Missing:
+    """Marks an unset slot in a pickled row"""
+    def __reduce__(self):
+        return '_MISSING'
+
+_MISSING = _Missing()
+
+def make_row_class(fieldnames: Sequence[str]) -> type[CompactRow]:
+    """Get the CompactRow class for a set of fieldnames
+
+    Classes are cached so datasets with the same fieldnames share a class.
+
+    Args:
+        fieldnames (Sequence[str]): The names of the properties in the order they should be stored
+
+    Returns:
+        type[CompactRow]: The row class
+    """
+    fields = tuple(fieldnames)
+    if fields not in _row_classes:
+        # Fieldnames are not always valid identifiers so the slots are named by position
+        slots = tuple(f'_{i}' for i in range(len(fields)))
+        _row_classes[fields] = type('CompactRow', (CompactRow,), {
+            '__slots__': slots,
+            '_fields': fields,
+            '_slot_names': dict(zip(fields, slots))
+        })
+    return _row_classes[fields]
+
+def _rebuild_row(fields: tuple[str, ...], values: list[Any], extra: dict[str, Any] | None) -> CompactRow:
+    row = make_row_class(fields)()
+    for slot, value in zip(row.__slots__, values):
+        if value is not _MISSING:
+            setattr(row, slot, value)
+    if extra:
+        row._extra = dict(extra)
+    return row
@@ -1,3 +1,6 @@
+import json
+
+from ast import literal_eval
 from typing import Callable
 from typing import Any
 from typing import TypeAlias
@@ -74,5 +77,25 @@ def split_longitude(latlng: str) -> float:
     """
     return float(latlng.split(',')[1])
 
+def parse_list(value: str) -> Any:
+    """Parse a list (or other nested value) written by Dataset.write_to_file
+    
+    Values are written as json which is much faster to parse than with literal_eval. Json has no tuples so tuples that were
+    written are returned as lists, eg. neighbors is a list of [id, length, segment id] lists. Values written as python literals, 
+    eg. by older versions or dicts with keys that are not strings, are parsed with literal_eval instead and keep their tuples.
+    Empty values become an empty list.
+
+    Args:
+        value (str): The written value
+
+    Returns:
+        Any: The parsed value
+    """
+    if not value: return []
+    try:
+        return json.loads(value)
+    except ValueError:
+        return literal_eval(value)
+
 generate_id = RowFunction(lambda row, i: i + 1)
 """Deprecated. Do not use."""
\ No newline at end of file
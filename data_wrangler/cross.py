@@ -0,0 +1,259 @@
+from __future__ import annotations
+
+import math
+
+from abc import ABC
+from abc import abstractmethod
+
+from typing import Any
+from typing import Callable
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from .distance import EARTH_RADIUS_METRES
+
+if TYPE_CHECKING:
+    from .dataset import Dataset
+
+
+class CrossBlock:
+    """A block of consecutive rows of one side of a cross product, see Dataset.cross_pairs
+
+    block['name'] gives the values of a property for the rows of the block. The values of the first dataset are a column
+    (shape (n, 1)) and the values of the second dataset are a row (shape (1, m)), so numpy operations between the two sides
+    give an (n, m) array with one value for each pair.
+    """
+
+    def __init__(self, get_column: Callable[[str], np.ndarray], positions: np.ndarray, start: int, stop: int, axis: int):
+        """ Create a block. Blocks are created by Dataset.cross_pairs.
+
+        Args:
+            get_column (Callable[[str], np.ndarray]): Returns a column of the dataset in the order of positions
+            positions (np.ndarray): The positions in the dataset of the rows in the order of the columns
+            start (int): The first row of the block
+            stop (int): The row after the last row of the block
+            axis (int): 0 for the first dataset and 1 for the second
+        """
+        self._get_column = get_column
+        self.positions = positions[start:stop]
+        self._start = start
+        self._stop = stop
+        self._shape = (-1, 1) if axis == 0 else (1, -1)
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self._get_column(name)[self._start:self._stop].reshape(self._shape)
+
+    def values(self, name: str) -> np.ndarray:
+        """Get the values of a property for the rows of the block as a flat array"""
+        return self._get_column(name)[self._start:self._stop]
+
+
+class Prefilter(ABC):
+    """A cheap test that rules out whole blocks of pairs before the pair function is run on them
+
+    The rows of each dataset are sorted so that rows that are likely to pair up are in the same blocks, and the pairs of blocks
+    that can not contain a pair are skipped. Create prefilters with within_distance or same_key.
+    """
+
+    @abstractmethod
+    def order(self, get_column: Callable[[str], np.ndarray], axis: int) -> np.ndarray:
+        """Get the order to put the rows of a dataset in
+
+        Args:
+            get_column (Callable[[str], np.ndarray]): Returns a column of the dataset
+            axis (int): 0 for the first dataset and 1 for the second
+
+        Returns:
+            np.ndarray: The positions of the rows in the order they should be blocked
+        """
+
+    @abstractmethod
+    def block_pairs(
+        self, get_column_1: Callable[[str], np.ndarray], starts_1: np.ndarray, get_column_2: Callable[[str], np.ndarray], starts_2: np.ndarray
+    ) -> np.ndarray:
+        """Find the pairs of blocks that may contain pairs
+
+        Args:
+            get_column_1 (Callable[[str], np.ndarray]): Returns a column of the first dataset in sorted order
+            starts_1 (np.ndarray): The first row of each block of the first dataset
+            get_column_2 (Callable[[str], np.ndarray]): Returns a column of the second dataset in sorted order
+            starts_2 (np.ndarray): The first row of each block of the second dataset
+
+        Returns:
+            np.ndarray: A (number of blocks 1, number of blocks 2) boolean array that is False for pairs of blocks to skip
+        """
+
+    def pair_mask(self, block_1: CrossBlock, block_2: CrossBlock) -> np.ndarray | None:
+        """Rule out single pairs within a pair of blocks, or None to leave them all to the pair function"""
+        return None
+
+
+class DistancePrefilter(Prefilter):
+    """Skips blocks whose bounding boxes are more than a distance apart. See within_distance.
+
+    The gap between the longitudes of two blocks is measured both ways around the earth, so pairs on either side of the
+    antimeridian (±180° longitude) are not skipped.
+    """
+
+    def __init__(self, distance: float, latitude: str, longitude: str):
+        self.distance = distance
+        self.latitude = latitude
+        self.longitude = longitude
+
+    def order(self, get_column: Callable[[str], np.ndarray], axis: int) -> np.ndarray:
+        # Rows are sorted along a z-order curve so each block covers a small area
+        latitudes = np.asarray(get_column(self.latitude), dtype=np.float64)
+        longitudes = np.asarray(get_column(self.longitude), dtype=np.float64)
+        rows = np.clip(np.nan_to_num((latitudes + 90) / 180 * 65535), 0, 65535).astype(np.uint64)
+        columns = np.clip(np.nan_to_num((longitudes + 180) / 360 * 65535), 0, 65535).astype(np.uint64)
+
+        codes = np.zeros(len(latitudes), dtype=np.uint64)
+        for bit in range(16):
+            codes |= ((rows >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit + 1)
+            codes |= ((columns >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit)
+
+        # Missing locations go at the end
+        codes[~(np.isfinite(latitudes) & np.isfinite(longitudes))] = np.iinfo(np.uint64).max
+        return np.argsort(codes, kind='stable')
+
+    def _bounds(self, get_column: Callable[[str], np.ndarray], starts: np.ndarray) -> tuple[np.ndarray, ...]:
+        """Get the minimum and maximum latitude and longitude of each block in radians"""
+        latitudes = np.radians(np.asarray(get_column(self.latitude), dtype=np.float64))
+        longitudes = np.radians(np.asarray(get_column(self.longitude), dtype=np.float64))
+        return (
+            np.fmin.reduceat(latitudes, starts), np.fmax.reduceat(latitudes, starts),
+            np.fmin.reduceat(longitudes, starts), np.fmax.reduceat(longitudes, starts)
+        )
+
+    def block_pairs(
+        self, get_column_1: Callable[[str], np.ndarray], starts_1: np.ndarray, get_column_2: Callable[[str], np.ndarray], starts_2: np.ndarray
+    ) -> np.ndarray:
+        min_lat_1, max_lat_1, min_lng_1, max_lng_1 = (bound[:, np.newaxis] for bound in self._bounds(get_column_1, starts_1))
+        min_lat_2, max_lat_2, min_lng_2, max_lng_2 = (bound[np.newaxis, :] for bound in self._bounds(get_column_2, starts_2))
+
+        lat_gap = np.maximum(np.maximum(min_lat_2 - max_lat_1, min_lat_1 - max_lat_2), 0)
+        lng_gap = np.maximum(np.maximum(min_lng_2 - max_lng_1, min_lng_1 - max_lng_2), 0)
+        # Going the other way around the earth can be shorter, eg. from 179° to -179°
+        lng_gap = np.minimum(lng_gap, np.maximum(np.minimum(min_lng_1 - max_lng_2, min_lng_2 - max_lng_1) + 2 * math.pi, 0))
+        furthest = np.maximum(np.maximum(np.abs(min_lat_1), np.abs(max_lat_1)), np.maximum(np.abs(min_lat_2), np.abs(max_lat_2)))
+
+        # The haversine formula with the smallest possible differences and the smallest possible cosines is a lower bound on
+        # the distance between any two points of the blocks
+        d = np.sin(lat_gap / 2) ** 2 + np.cos(furthest) ** 2 * np.sin(np.minimum(lng_gap, math.pi) / 2) ** 2
+        lower_bound = 2 * EARTH_RADIUS_METRES * np.arcsin(np.sqrt(np.minimum(d, 1)))
+
+        # Blocks of only missing locations have nan bounds and are skipped
+        return lower_bound <= self.distance
+
+
+class KeyPrefilter(Prefilter):
+    """Only pairs rows with equal keys. See same_key."""
+
+    def __init__(self, column_1: str, column_2: str):
+        self.columns = (column_1, column_2)
+
+    def order(self, get_column: Callable[[str], np.ndarray], axis: int) -> np.ndarray:
+        return np.argsort(get_column(self.columns[axis]), kind='stable')
+
+    def block_pairs(
+        self, get_column_1: Callable[[str], np.ndarray], starts_1: np.ndarray, get_column_2: Callable[[str], np.ndarray], starts_2: np.ndarray
+    ) -> np.ndarray:
+        # The keys are sorted so the first and last keys of each block are its smallest and largest
+        keys_1, keys_2 = get_column_1(self.columns[0]), get_column_2(self.columns[1])
+        first_1, last_1 = keys_1[starts_1][:, np.newaxis], keys_1[np.append(starts_1[1:], len(keys_1)) - 1][:, np.newaxis]
+        first_2, last_2 = keys_2[starts_2][np.newaxis, :], keys_2[np.append(starts_2[1:], len(keys_2)) - 1][np.newaxis, :]
+        return np.asarray((first_1 <= last_2) & (first_2 <= last_1), dtype=np.bool_)
+
+    def pair_mask(self, block_1: CrossBlock, block_2: CrossBlock) -> np.ndarray | None:
+        return np.asarray(block_1[self.columns[0]] == block_2[self.columns[1]], dtype=np.bool_)
+
+
+def within_distance(distance: float, latitude: str = 'latitude', longitude: str = 'longitude') -> Prefilter:
+    """Skip pairs of blocks whose latitude and longitude bounding boxes are more than [distance] meters apart
+
+    The pair function should still check the exact distance since blocks that are close may contain pairs that are not.
+
+    Args:
+        distance (float): The maximum distance in meters
+        latitude (str, optional): The name of the latitude property of both datasets. Defaults to 'latitude'.
+        longitude (str, optional): The name of the longitude property of both datasets. Defaults to 'longitude'.
+
+    Returns:
+        Prefilter: The prefilter
+    """
+    return DistancePrefilter(distance, latitude, longitude)
+
+def same_key(column_1: str, column_2: str | None = None) -> Prefilter:
+    """Only pair rows where a property of the first dataset is equal to a property of the second, eg. the same junction_id
+
+    Args:
+        column_1 (str): The property of the first dataset
+        column_2 (str | None, optional): The property of the second dataset. Defaults to None which uses column_1.
+
+    Returns:
+        Prefilter: The prefilter
+    """
+    return KeyPrefilter(column_1, column_2 or column_1)
+
+def cross_pairs(
+    data_1: Dataset, data_2: Dataset, func: Callable[[CrossBlock, CrossBlock], Any], prefilter: Prefilter | None = None, block_size: int = 128
+) -> tuple[np.ndarray, np.ndarray]:
+    """See Dataset.cross_pairs"""
+    if block_size < 1:
+        raise Exception(f"The block size must be at least 1 not {block_size}")
+    if len(data_1) == 0 or len(data_2) == 0:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+
+    columns: tuple[dict[str, np.ndarray], dict[str, np.ndarray]] = ({}, {})
+    datasets = (data_1, data_2)
+    orders: list[np.ndarray | None] = [None, None]
+
+    def column_getter(axis: int) -> Callable[[str], np.ndarray]:
+        # Each column is only taken from the dataset and put in blocked order once
+        def get_column(name: str) -> np.ndarray:
+            if name not in columns[axis]:
+                column = datasets[axis].get_column(name)
+                columns[axis][name] = column if orders[axis] is None else column[orders[axis]]
+            return columns[axis][name]
+        return get_column
+
+    get_columns = (column_getter(0), column_getter(1))
+    if prefilter != None:
+        orders = [prefilter.order(get_columns[axis], axis) for axis in (0, 1)]
+        columns[0].clear()
+        columns[1].clear()
+    positions = [np.arange(len(data_1)) if orders[0] is None else orders[0], np.arange(len(data_2)) if orders[1] is None else orders[1]]
+
+    starts_1 = np.arange(0, len(data_1), block_size)
+    starts_2 = np.arange(0, len(data_2), block_size)
+    if prefilter != None:
+        block_pairs = prefilter.block_pairs(get_columns[0], starts_1, get_columns[1], starts_2)
+    else:
+        block_pairs = np.ones((len(starts_1), len(starts_2)), dtype=np.bool_)
+
+    found_1, found_2 = [], []
+    for i, j in zip(*np.nonzero(block_pairs)):
+        start_1, start_2 = int(starts_1[i]), int(starts_2[j])
+        block_1 = CrossBlock(get_columns[0], positions[0], start_1, min(start_1 + block_size, len(data_1)), 0)
+        block_2 = CrossBlock(get_columns[1], positions[1], start_2, min(start_2 + block_size, len(data_2)), 1)
+
+        mask = np.broadcast_to(np.asarray(func(block_1, block_2), dtype=np.bool_), (len(block_1), len(block_2)))
+        pair_mask = prefilter.pair_mask(block_1, block_2) if prefilter != None else None
+        if pair_mask is not None:
+            mask = mask & pair_mask
+
+        rows_1, rows_2 = np.nonzero(mask)
+        found_1.append(block_1.positions[rows_1])
+        found_2.append(block_2.positions[rows_2])
+
+    if len(found_1) == 0:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+
+    # Return the pairs in the same order as cross_data would visit them
+    pairs_1, pairs_2 = np.concatenate(found_1), np.concatenate(found_2)
+    order = np.lexsort((pairs_2, pairs_1))
+    return pairs_1[order], pairs_2[order]
@@ -1,20 +1,60 @@
 from __future__ import annotations
 
+import os
 import csv
-from haversine import haversine, Unit
+import math
+import numpy as np
+import utm
 
 from copy import copy
 
+from itertools import compress
 from itertools import islice
+from itertools import repeat
+from operator import itemgetter
 
 from typing import Callable
 from typing import Any
+from typing import TYPE_CHECKING
+from typing import TextIO
 from collections.abc import Sequence
+from collections.abc import Iterable
+from collections.abc import Iterator
 
 from .conversion_functions import Row
 from .conversion_functions import RowFunction
 from .conversion_functions import ConversionMap
 from .conversion_functions import ConversionFunction
+from .conversion_functions import generate_id
+from .columns import to_column
+from .column_index import ColumnIndex
+from .lazy_dataset import LazyDataset
+from .compact_row import make_row_class
+from .predicates import Expression
+from .spatial import SpatialIndex
+from .spatial import GridIndex
+from .spatial import PlanarIndex
+from .spatial import coordinate_hash
+from .rtree import SegmentRTree
+from .distance import ArrayLike
+from .distance import ColumnDistance
+from .distance import haversine_metres
+from .distance import p_norm_distance
+from .aggregation import Aggregation
+from .cross import CrossBlock
+from .cross import Prefilter
+from . import binary_format
+from . import aggregation
+from . import cross
+from . import file_io
+from . import parallel
+
+if TYPE_CHECKING:
+    from .columnar_dataset import ColumnarDataset
+
+# UTM stretches or shrinks distances by up to about 0.1% within a zone, so projected matches are searched for a little past the
+# distance limit and then checked with the haversine distance
+_UTM_SCALE_TOLERANCE = 1.002
 
 # from deprecated.sphinx import deprecated
 
@@ -28,6 +68,10 @@ class Dataset:
             raise Exception(f"Primary key: {primary_key}, is not a valid key in the dataset")
         
         self._rows = { row[primary_key]: row for row in rows }
+        self._indexes: dict[str, ColumnIndex] = {}
+        self._spatial_index: SpatialIndex | None = None
+        self._planar_index: PlanarIndex | None = None
+        self._projection: tuple | None = None
         
         
     def __len__(self):
@@ -45,7 +89,69 @@ class Dataset:
         Args:
             key_value (Any): The primary key of the row to remove
         """
+        self._unindex(key_value, self._rows[key_value])
         del self._rows[key_value]
+        
+    def create_index(self, column: str) -> ColumnIndex:
+        """Create a secondary index on a column
+        
+        The index maps each value of the column to the primary keys of the rows with that value. It is kept up to date by
+        remove, filter, merge and convert_property, which update the returned index in place so it can be kept and queried
+        directly. Values changed by editing a row directly are not tracked, call create_index again after doing that.
+
+        Args:
+            column (str): The column to index. Its values must be hashable.
+
+        Returns:
+            ColumnIndex: The index
+        """
+        index = self._indexes.get(column)
+        if index == None:
+            index = self._indexes[column] = ColumnIndex(column)
+        if len(self) > 0:
+            index.rebuild(self.get_column(self.primary_key).tolist(), self.get_column(column).tolist())
+        else:
+            index.rebuild((), ())
+        return index
+    
+    def drop_index(self, column: str):
+        """Remove the secondary index on a column
+
+        Args:
+            column (str): The indexed column
+        """
+        del self._indexes[column]
+        
+    def lookup(self, column: str, value: Any) -> list[Row]:
+        """Get all the rows where [column] is equal to [value]
+        
+        Uses the index created by create_index if there is one, otherwise every row is checked.
+
+        Args:
+            column (str): The column to check
+            value (Any): The value to look for
+
+        Returns:
+            list[Row]: The matching rows
+        """
+        if column in self._indexes:
+            return [self[key] for key in self._indexes[column].get(value)]
+        return [row for row in self if row[column] == value]
+    
+    def _unindex(self, key: Any, row: Row):
+        """Remove a row from all the secondary indexes"""
+        for column, index in self._indexes.items():
+            index.discard(row[column], key)
+            
+    def _rebuild_indexes(self, columns: Iterable[str] | None = None):
+        """Recreate secondary indexes after their columns or the primary key changed
+
+        Args:
+            columns (Iterable[str] | None, optional): The columns whose indexes should be rebuilt. Defaults to all of them.
+        """
+        for column in list(self._indexes if columns == None else columns):
+            if column in self._indexes:
+                self.create_index(column)
     
     def set_primary_key(self, primary_key: str):
         """Set the primary key of this dataset
@@ -57,6 +163,7 @@ class Dataset:
         """
         self.primary_key = primary_key
         self._rows = { row[self.primary_key]: row for row in self._rows.values() }
+        self._rebuild_indexes()
     
     def add_property(self, name: str, **kwargs):
         """Add a property to each row of the dataset
@@ -91,6 +198,7 @@ class Dataset:
         """
         for row in self:
             del row[property_name]
+        self._indexes.pop(property_name, None)
     
     def get_single_row(self) -> Row | None:
         """Get the first row in the dataset
@@ -114,6 +222,75 @@ class Dataset:
         """
         return islice(self, row_count)
     
+    def compact(self):
+        """Store every row as a CompactRow
+        
+        Compact rows keep their values in __slots__ instead of a dict. Only the row containers shrink, by about 2.5x for rows with
+        many properties, so the saving depends on what the values are. The cleaned junctions loaded with compact=True take about
+        3x less memory without their neighbors column (6.2 MB -> 2.1 MB), but only about 1.7x less with it (10.1 MB -> 6.1 MB)
+        since the lists of neighbors are stored the same way either way. Use columnar=True to also store scalar values compactly.
+        
+        Rows still support row['name'] style access. Properties added after compacting are stored in a small dict on each row,
+        call compact() again to move them into the slots. The row objects are replaced so references to the old rows are no
+        longer part of the dataset.
+        """
+        if len(self) == 0: return
+        
+        fieldnames = list(dict.fromkeys(key for row in self for key in row))
+        row_class = make_row_class(fieldnames)
+        self._rows = { key: row_class.from_mapping(row) for key, row in self._rows.items() }
+    
+    def lazy(self) -> LazyDataset:
+        """Start recording operations to run together in a single pass
+        
+        See LazyDataset. eg: dataset.lazy().convert_property('id', int).filter(func).collect()
+
+        Returns:
+            LazyDataset: The recorder for this dataset
+        """
+        return LazyDataset(self)
+    
+    def get_column(self, name: str) -> np.ndarray:
+        """Get all the values of a property as a numpy array
+
+        Args:
+            name (str): The name of the property
+
+        Returns:
+            np.ndarray: The values in row order
+        """
+        return to_column(list(map(itemgetter(name), self._rows.values())))
+    
+    def set_column(self, name: str, values: Sequence[Any] | np.ndarray):
+        """Set the value of a property for every row, adding the property if it does not exist
+        
+        Args:
+            name (str): The name of the property
+            values (Sequence[Any] | np.ndarray): The values in row order
+        """
+        if name == self.primary_key:
+            raise Exception("Cannot set the values of the primary key with set_column")
+        if len(values) != len(self):
+            raise Exception(f"Cannot set {name} from {len(values)} values because the dataset has {len(self)} rows")
+        
+        if isinstance(values, np.ndarray):
+            values = values.tolist()
+        for row, value in zip(self._rows.values(), values):
+            row[name] = value
+        self._rebuild_indexes([name])
+    
+    def to_columnar(self) -> ColumnarDataset:
+        """Convert this dataset to a ColumnarDataset
+        
+        The columnar dataset stores one numpy array per property which uses much less memory and allows
+        column wide operations to run without a python loop over the rows.
+
+        Returns:
+            ColumnarDataset: The converted dataset
+        """
+        from .columnar_dataset import ColumnarDataset
+        return ColumnarDataset.from_rows(list(self), self.primary_key)
+    
     def rename(self, original_name: str, new_name: str):
         if new_name != original_name and new_name in self.get_column_names():
             raise Exception(f"Cannot rename property {original_name} to {new_name} because {new_name} already exists in the dataset")
@@ -126,6 +303,11 @@ class Dataset:
             row[new_name] = row[original_name]
             del row[original_name]
             
+        if original_name in self._indexes:
+            index = self._indexes.pop(original_name)
+            index.column = new_name
+            self._indexes[new_name] = index
+            
     def convert_property(self, field_name: str, conversion: ConversionFunction):
         """Apply a conversion function to a property
         
@@ -146,6 +328,9 @@ class Dataset:
                 raise Exception("Conversion resulted in non unique primary key")
             self._rows = new_rows
             self.convert_properties({})
+            self._rebuild_indexes()
+        else:
+            self._rebuild_indexes([field_name])
             
     # @deprecated(reason="Use convert_property for each property instead", version="0.0.1")
     def convert_properties(self, conversions: dict[str, ConversionFunction]):
@@ -155,51 +340,112 @@ class Dataset:
                 
         if self.primary_key in conversions:
             self._rows = { row[self.primary_key]: row for row in self._rows.values() }
+            self._rebuild_indexes()
+        else:
+            self._rebuild_indexes(conversions)
             
-    def match_closest(self, other_data: Dataset, distance_func: Callable[[Row, Row], float], on_match: Callable[[Row, Row, float], None], distance_limit: float=float('inf')):
+    def match_closest(
+        self, other_data: Dataset, distance_func: Callable[[Row, Row], float], on_match: Callable[[Row, Row, float], None], 
+        distance_limit: float=float('inf'), workers: int | None = 1
+    ):
         """ Pair all the nodes in one data set to the closest node in another dataset
         
-        !WARNING: Creates a cross product between the two data sets. May run slowly for large datasets.
+        !WARNING: Creates a cross product between the two data sets. May run slowly for large datasets. 
+        Use match_lat_lng or match_lat_lng_custom for matching by latitude and longitude, which use a spatial index.
+        
+        If distance_func is a distance.ColumnDistance, eg. distance.haversine_distance(), the distances from each row to all of 
+        [other_data] are computed at once with numpy instead of calling distance_func for every pair.
+        
+        With more than one worker the rows of this dataset are split into shards that are matched by separate processes.
+        The closest rows are found first and on_match is then called in this process, in row order, so callbacks that change
+        the rows (eg. counting matches) give the same result for any number of workers.
 
         Args:
             other_data (Dataset): The set of nodes to match this dataset to
             distance_func (Callable[[Row, Row], float]): The function to use for calculating distance between two rows
             on_match (Callable[[Row, Row, float], None]): The function to run when a row is matched with its closest row
             distance_limit (float): The maximum distance beyond which a match should not be made
+            workers (int | None, optional): The number of processes to use. None uses one per cpu. Defaults to 1.
         """
+        rows = list(self)
+        if isinstance(distance_func, ColumnDistance):
+            find_closest = Dataset._column_closest_finder(other_data, distance_func, distance_limit)
+        else:
+            find_closest = Dataset._row_closest_finder(other_data, distance_func, distance_limit)
+        
+        # Progress can only be shown when matching in this process
+        show_progress = workers == 1
+        def match_shard(shard: range) -> list[tuple[int, Any]]:
+            matches = []
+            for i in shard:
+                matches.append(find_closest(rows[i]))
+                if show_progress and i % 100 == 0:
+                    print(f"\r    Matched {i} nodes. {(i / len(rows)):.0%} {' ' * 10}", end='')
+            return matches
+        
+        # Use a few shards per worker so that slow shards do not hold up the others
+        shard_count = 1 if workers == 1 else 4 * (workers or os.cpu_count() or 1)
+        shard_size = max(1, -(-len(rows) // shard_count))
+        shards = [range(start, min(start + shard_size, len(rows))) for start in range(0, len(rows), shard_size)]
         
-        # Match for each node in this dataset
-        for i, row_1 in enumerate(self):
-            closest = None
+        matches = [match for shard in parallel.parallel_map(match_shard, shards, workers) for match in shard]
+        self._apply_matches(other_data, [position for position, _ in matches], [distance for _, distance in matches], on_match)
+        print(f"\r    Matched {len(self)} nodes. 100% {' ' * 10}")
+        
+    @staticmethod
+    def _row_closest_finder(other_data: Dataset, distance_func: Callable[[Row, Row], float], distance_limit: float) -> Callable[[Row], tuple[int, Any]]:
+        """Create a function that finds the position of the closest row in [other_data] by calling distance_func for every row"""
+        other_rows = list(other_data)
+        
+        def find_closest(row_1: Row) -> tuple[int, Any]:
+            closest = -1
             b_dist = distance_limit
             
             # Find the closest node in data set 2
-            for row_2 in other_data:
+            for position, row_2 in enumerate(other_rows):
                 distance = distance_func(row_1, row_2)
                     
                 # Update the closest node
                 if distance < b_dist:
-                    closest = row_2
+                    closest = position
                     b_dist = distance
-              
-            # Write the information about the closest node to [row_1]
-            if closest != None:
-                on_match(row_1, closest, b_dist)
+            return closest, b_dist
+        
+        return find_closest
+        
+    @staticmethod
+    def _column_closest_finder(other_data: Dataset, distance_func: ColumnDistance, distance_limit: float) -> Callable[[Row], tuple[int, Any]]:
+        """Create a function that finds the position of the closest row in [other_data] by comparing with its columns in one numpy operation"""
+        # Only get each column from the other dataset once
+        columns: dict[str, np.ndarray] = {}
+        def get_column(name: str) -> np.ndarray:
+            if name not in columns:
+                columns[name] = other_data.get_column(name)
+            return columns[name]
+        
+        def find_closest(row: Row) -> tuple[int, Any]:
+            if len(other_data) == 0: return -1, distance_limit
+            row_distances = np.asarray(distance_func.to_columns(row, get_column), dtype=np.float64)
             
-            # Log the progress
-            if i % 100 == 0:
-                print(f"\r    Matched {i} nodes. {(i / len(self)):.0%} {' ' * 10}", end='')
-        print(f"\r    Matched {len(self)} nodes. 100% {' ' * 10}")
+            # Distances that are not strictly within the limit (including nan) can never be matched
+            row_distances = np.where(row_distances < distance_limit, row_distances, np.inf)
+            closest = np.argmin(row_distances).item()
+            if row_distances[closest] < distance_limit:
+                return closest, row_distances[closest].item()
+            return -1, distance_limit
+        
+        return find_closest
         
     def match_closest_p_norm(
-        self, other_data: Dataset, match_keys: list[str | tuple[str, str]], on_match: Callable[[Row, Row, float], None], p_norm: float=2, distance_limit: float=float('inf')
+        self, other_data: Dataset, match_keys: list[str | tuple[str, str]], on_match: Callable[[Row, Row, float], None], p_norm: float=2, 
+        distance_limit: float=float('inf'), workers: int | None = 1
     ):
         """ Pair all the nodes in one data set to the closest node in another dataset
         
         match_keys is used to select the properties used for finding the distance. The dimension used is the number of match_keys.
         eg: If there is one match key then one dimensional distance is used. If there are four, then four dimensional distance is used.
         
-        !WARNING: Creates a cross product between the two data sets. May run slowly for large datasets.
+        The distances from each row to all of [other_data] are computed at once with numpy.
 
         Args:
             other_data (Dataset): The set of nodes used for finding the closest node
@@ -207,69 +453,376 @@ class Dataset:
             on_match (Callable[[Row, Row, float], None]): The function to run when a row is matched with its closest row
             p_norm (float, optional): The p_norm function to use for calculating distance. Defaults to 2 (Euclidean distance)
             distance_limit (float): The maximum distance beyond which a match should not be made
+            workers (int | None, optional): The number of processes to use. See match_closest. Defaults to 1.
         """
-        def distance(row_1: Row, row_2: Row) -> float:
-            distance = 0
-            for key in match_keys:
-                if type(key) == tuple:
-                    delta = row_1[key[0]] - row_2[key[1]]
-                else:
-                    delta = row_1[key] - row_2[key]              # type: ignore  # Ignoring type because it should be str
-                distance += pow(abs(delta), p_norm)
-            return pow(distance, 1/p_norm)
-        
-        self.match_closest(other_data, distance, on_match)
+        self.match_closest(other_data, p_norm_distance(match_keys, p_norm), on_match, distance_limit=distance_limit, workers=workers)
         
-    def match_lat_lng(self, other_data: Dataset, match_field: str, dst_field:str, count_field: str = '', distance_limit=float('inf'), count_attrib='', reset_count=True):
+    def match_lat_lng(
+        self, other_data: Dataset, match_field: str, dst_field:str, count_field: str = '', distance_limit=float('inf'), count_attrib='', reset_count=True,
+        utm_zone: tuple[int, str] | None = None
+    ):
         """ Pair all the rows in this dataset with the closest row in [other_data] based on latitude and longitude.
         
-        The haversine formula is used to calculate distance in meters from latitude and longitude
+        The haversine formula is used to calculate distance in meters from latitude and longitude. See match_lat_lng_custom.
 
         Args:
             other_data (Dataset): The data to match to
             match_field (str): The name of the field in which to store the primary key of the other row of the match
             dst_field (str): The name of the field in which to store the distance of the match
+            count_field (str, optional): The name of a field in [other_data] in which to count the rows matched to each row. Defaults to ''.
             distance_limit (float): The maximum distance beyond which a match should not be made
+            count_attrib (str, optional): A field in this dataset to add to the count instead of 1. Defaults to ''.
+            reset_count (bool, optional): Whether to set the counts to zero before matching. Defaults to True.
+            utm_zone (tuple[int, str] | None, optional): Match using projected coordinates in this zone. See match_lat_lng_custom. Defaults to None.
         """
+        positions, distances = self._nearest_lat_lng(other_data, distance_limit, utm_zone)
+        self._store_matches(other_data, positions, distances, match_field, dst_field, count_field, count_attrib, reset_count)
+        print(f"\r    Matched {len(self)} nodes. 100% {' ' * 10}")
         
-        if count_field:
-            for row in other_data:
-                if not reset_count:
-                    row[count_field] = row.get(count_field, 0)
-                else:
-                    row[count_field] = 0
-                
-        for row in self:
-            row[match_field] = 0
-            row[dst_field] = 0
+    def match_lat_lng_approx(
+        self, other_data: Dataset, match_field: str, dst_field:str, count_field: str = '', distance_limit: float = 200, count_attrib='', reset_count=True
+    ):
+        """ Pair all the rows in this dataset with the closest row in [other_data] within [distance_limit] meters
         
-        def on_match(row_1, row_2, dst):
-            row_1[match_field] = row_2[other_data.primary_key]
-            row_1[dst_field] = dst
-            
-            increment = 1
-            if count_attrib:
-                increment = row_1[count_attrib]
-            
-            if count_field:
-                row_2[count_field] = row_2[count_field] + increment
-            
-        def distance(row_1: Row, row_2: Row):
-            p1 = (row_1['latitude'], row_1['longitude'])
-            p2 = (row_2['latitude'], row_2['longitude'])
-            
-            return haversine(p1, p2, unit=Unit.METERS)
+        Takes the same arguments as match_lat_lng. The rows of [other_data] are put into a grid of latitude and longitude cells 
+        [distance_limit] meters across, and each row is only compared with the rows in its own cell and the cells around it. 
+        This is fast when distance_limit is small compared to the area of the data, eg. 200 meters within a city.
         
-        self.match_closest(other_data, distance, on_match, distance_limit=distance_limit)
+        Only the distance limit is approximate: the grid does not wrap around the antimeridian. Within a city the matches are
+        the same as match_lat_lng.
+
+        Args:
+            other_data (Dataset): The data to match to
+            match_field (str): The name of the field in which to store the primary key of the other row of the match
+            dst_field (str): The name of the field in which to store the distance of the match
+            count_field (str, optional): The name of a field in [other_data] in which to count the rows matched to each row. Defaults to ''.
+            distance_limit (float): The maximum distance beyond which a match should not be made. Must be finite. Defaults to 200.
+            count_attrib (str, optional): A field in this dataset to add to the count instead of 1. Defaults to ''.
+            reset_count (bool, optional): Whether to set the counts to zero before matching. Defaults to True.
+        """
+        if not 0 < distance_limit < float('inf'):
+            raise Exception(f"match_lat_lng_approx needs a positive finite distance_limit not {distance_limit}. Use match_lat_lng instead.")
+        
+        positions, distances = np.full(len(self), -1, dtype=np.intp), np.zeros(len(self))
+        if len(self) > 0 and len(other_data) > 0:
+            grid = GridIndex(other_data.get_column('latitude'), other_data.get_column('longitude'), distance_limit)
+            positions, distances = grid.nearest(self.get_column('latitude'), self.get_column('longitude'), distance_limit)
+        self._store_matches(other_data, positions, distances, match_field, dst_field, count_field, count_attrib, reset_count)
+        print(f"\r    Matched {len(self)} nodes. 100% {' ' * 10}")
         
-    def match_lat_lng_custom(self, other_data: Dataset, on_match, distance_limit=float('inf')):
-        def distance(row_1: Row, row_2: Row):
-            p1 = (row_1['latitude'], row_1['longitude'])
-            p2 = (row_2['latitude'], row_2['longitude'])
+    def match_lat_lng_custom(
+        self, other_data: Dataset, on_match: Callable[[Row, Row, float], None], distance_limit=float('inf'), utm_zone: tuple[int, str] | None = None
+    ):
+        """ Pair all the rows in this dataset with the closest row in [other_data] based on latitude and longitude.
+        
+        Gives the same matches as match_closest with the haversine distance in meters, but the spatial index of [other_data] is 
+        used so each row is matched in logarithmic time instead of being compared with every row in [other_data].
+        
+        If utm_zone is set, eg. (10, 'U'), both datasets are projected with project_utm (which is only computed once per dataset)
+        and the closest rows are found by straight line distance on the projection. Only the distance of each match is computed 
+        with haversine. Within a city the matches are the same except for points that are almost equally close to two rows. The
+        distance limit is applied to both distances, so every match is strictly closer than it by haversine distance.
+
+        Args:
+            other_data (Dataset): The data to match to
+            on_match (Callable[[Row, Row, float], None]): The function to run when a row is matched with its closest row
+            distance_limit (float): The maximum distance beyond which a match should not be made
+            utm_zone (tuple[int, str] | None, optional): The UTM zone number and letter to project to. Defaults to None.
+        """
+        positions, distances = self._nearest_lat_lng(other_data, distance_limit, utm_zone)
+        self._apply_matches(other_data, positions.tolist(), distances.tolist(), on_match)
+        print(f"\r    Matched {len(self)} nodes. 100% {' ' * 10}")
+        
+    def spatial_aggregate(
+        self, target: Dataset, aggregations: dict[str, Aggregation], match_field: str = '', dst_field: str = '', distance_limit=float('inf'),
+        utm_zone: tuple[int, str] | None = None
+    ):
+        """ Match each row to the closest row in [target] and store summaries of the matched rows in [target]
+        
+        The matches are the same as match_lat_lng. Each aggregation is then computed for all of [target] at once, eg. to count 
+        the observations near each junction and average their likelihoods::
+        
+            from data_wrangler.aggregation import count, mean
             
-            return haversine(p1, p2, unit=Unit.METERS)
+            observations.spatial_aggregate(junctions, {
+                'observation_count': count(),
+                'likelihood': mean('crime_likelihood'),
+                '{}_count': count(by='crime_type', labels={ 1: 'theft', 2: 'mischief' }),
+            }, 'junction_id', 'junction_dst', distance_limit=200)
+
+        Args:
+            target (Dataset): The data to match to and store the aggregations in
+            aggregations (dict[str, Aggregation]): The aggregations by the name of the property of [target] to store them in. See aggregation.py.
+            match_field (str, optional): The name of the field in which to store the primary key of the matched row. Defaults to '' which does not store it.
+            dst_field (str, optional): The name of the field in which to store the distance of the match. Defaults to '' which does not store it.
+            distance_limit (float): The maximum distance beyond which a match should not be made
+            utm_zone (tuple[int, str] | None, optional): Match using projected coordinates in this zone. See match_lat_lng_custom. Defaults to None.
+        """
+        positions, distances = self._nearest_lat_lng(target, distance_limit, utm_zone)
+        self._store_matches(target, positions, distances, match_field, dst_field, '', '', True)
+        aggregation.aggregate_matches(self, target, positions, aggregations)
+        print(f"\r    Matched {len(self)} nodes. 100% {' ' * 10}")
+        
+    def _nearest_lat_lng(self, other_data: Dataset, distance_limit: float, utm_zone: tuple[int, str] | None) -> tuple[np.ndarray, np.ndarray]:
+        """Find the position in [other_data] of the closest row to each row, or -1, and the distances. See match_lat_lng_custom."""
+        if len(self) == 0 or len(other_data) == 0:
+            return np.full(len(self), -1, dtype=np.intp), np.zeros(len(self))
+        
+        if utm_zone == None:
+            return other_data.spatial_index().nearest(self.get_column('latitude'), self.get_column('longitude'), distance_limit)
+        
+        eastings, northings = self.project_utm(*utm_zone)
+        positions, _ = other_data.planar_index(*utm_zone).nearest(eastings, northings, distance_limit * _UTM_SCALE_TOLERANCE)
+        
+        # Only the matches need the exact distance
+        matched = np.flatnonzero(positions != -1)
+        distances = np.zeros(len(self))
+        distances[matched] = haversine_metres(
+            self.get_column('latitude')[matched], self.get_column('longitude')[matched],
+            other_data.get_column('latitude')[positions[matched]], other_data.get_column('longitude')[positions[matched]]
+        )
+        
+        # The projection stretches distances slightly so the limit is checked again with the distances that are reported
+        too_far = matched[distances[matched] >= distance_limit]
+        positions[too_far] = -1
+        distances[too_far] = 0
+        return positions, distances
+        
+    def spatial_index(self, cache_directory: str | None = None) -> SpatialIndex:
+        """Get a spatial index over the latitude and longitude of the rows
+        
+        The index is kept and reused until the latitudes or longitudes change, so matching several datasets against the same
+        data, eg. the junctions, only builds it once. Positions in the index are positions in the row order of the dataset.
+        
+        With a cache directory the index is also saved to disk, eg. junctions.spatial next to junctions.csv, so later runs
+        load it instead of building it. The saved index is only used if it was built from exactly the same coordinates in 
+        the same order, otherwise it is rebuilt and replaced. Call this before matching so match_lat_lng uses the loaded index.
+
+        Args:
+            cache_directory (str | None, optional): The directory to save the index to and load it from. Defaults to None.
+
+        Returns:
+            SpatialIndex: The index
+        """
+        if len(self) == 0: return SpatialIndex([], [])
+        
+        latitudes, longitudes = self.get_column('latitude'), self.get_column('longitude')
+        if cache_directory == None:
+            if self._spatial_index == None or not self._spatial_index.matches(latitudes, longitudes):
+                self._spatial_index = SpatialIndex(latitudes, longitudes)
+            return self._spatial_index
+        
+        saved = SpatialIndex.saved_hash(cache_directory) == coordinate_hash(latitudes, longitudes)
+        if self._spatial_index == None or not self._spatial_index.matches(latitudes, longitudes):
+            self._spatial_index = SpatialIndex.load(cache_directory) if saved else SpatialIndex(latitudes, longitudes)
+        if not saved:
+            self._spatial_index.save(cache_directory)
+        return self._spatial_index
+    
+    def project_utm(self, zone_number: int, zone_letter: str, easting: str = 'easting', northing: str = 'northing') -> tuple[np.ndarray, np.ndarray]:
+        """Add properties with the UTM easting and northing of each row, in metres
+        
+        Distances between projected points can be computed with plain euclidean math, which is much cheaper than haversine and
+        almost exactly the same within a city. Every row is projected into the same zone, eg. zone 10U for Vancouver.
+        
+        The projection is only computed once. Calling this again returns the stored values unless the latitudes or longitudes
+        have changed since. Rows with a missing (nan) latitude or longitude get nan.
+
+        Args:
+            zone_number (int): The UTM zone number
+            zone_letter (str): The UTM zone letter
+            easting (str, optional): The name of the property for the easting. Defaults to 'easting'.
+            northing (str, optional): The name of the property for the northing. Defaults to 'northing'.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The eastings and northings
+        """
+        if len(self) == 0: return np.zeros(0), np.zeros(0)
+        
+        latitudes = np.asarray(self.get_column('latitude'), dtype=np.float64)
+        longitudes = np.asarray(self.get_column('longitude'), dtype=np.float64)
+        key = (zone_number, zone_letter, easting, northing)
+        if (
+            self._projection != None and self._projection[0] == key and easting in self.get_single_row() and northing in self.get_single_row() and
+            np.array_equal(self._projection[1], latitudes, equal_nan=True) and np.array_equal(self._projection[2], longitudes, equal_nan=True)
+        ):
+            return self.get_column(easting), self.get_column(northing)
+        
+        eastings = np.full(len(self), np.nan)
+        northings = np.full(len(self), np.nan)
+        valid = np.isfinite(latitudes) & np.isfinite(longitudes)
+        if valid.any():
+            eastings[valid], northings[valid], _, _ = utm.from_latlon(
+                latitudes[valid], longitudes[valid], force_zone_number=zone_number, force_zone_letter=zone_letter
+            )
+        
+        self.set_column(easting, eastings)
+        self.set_column(northing, northings)
+        self._projection = (key, latitudes, longitudes)
+        return eastings, northings
+    
+    def unproject_utm(self, zone_number: int, zone_letter: str, easting: str = 'easting', northing: str = 'northing', missing: Any = 0):
+        """Set the latitude and longitude of each row from UTM easting and northing properties
+        
+        All of the rows are converted at once. Rows where the easting and northing are both 0 or are missing get [missing] as 
+        their latitude and longitude. If every row has a location the projection is remembered so a later project_utm with the same zone is free.
+
+        Args:
+            zone_number (int): The UTM zone number
+            zone_letter (str): The UTM zone letter
+            easting (str, optional): The name of the easting property. Defaults to 'easting'.
+            northing (str, optional): The name of the northing property. Defaults to 'northing'.
+            missing (Any, optional): The latitude and longitude of rows without a location. Defaults to 0.
+        """
+        if len(self) == 0: return
+        
+        eastings = np.asarray(self.get_column(easting), dtype=np.float64)
+        northings = np.asarray(self.get_column(northing), dtype=np.float64)
+        valid = np.isfinite(eastings) & np.isfinite(northings) & ((eastings != 0) | (northings != 0))
+        
+        latitudes = np.full(len(self), np.nan)
+        longitudes = np.full(len(self), np.nan)
+        if valid.any():
+            latitudes[valid], longitudes[valid] = utm.to_latlon(eastings[valid], northings[valid], zone_number, zone_letter)
+        
+        valid_list = valid.tolist()
+        self.set_column('latitude', [value if ok else missing for value, ok in zip(latitudes.tolist(), valid_list)])
+        self.set_column('longitude', [value if ok else missing for value, ok in zip(longitudes.tolist(), valid_list)])
+        
+        # The eastings and northings of rows without a location are not their projection so the projection is only kept if there are none
+        if valid.all():
+            self._projection = ((zone_number, zone_letter, easting, northing), latitudes, longitudes)
+        
+    def planar_index(self, zone_number: int, zone_letter: str) -> PlanarIndex:
+        """Get an index over the UTM coordinates of the rows. See project_utm.
+        
+        The index is kept and reused until the coordinates change.
+
+        Args:
+            zone_number (int): The UTM zone number
+            zone_letter (str): The UTM zone letter
+
+        Returns:
+            PlanarIndex: The index
+        """
+        eastings, northings = self.project_utm(zone_number, zone_letter)
+        if self._planar_index == None or not self._planar_index.matches(eastings, northings):
+            self._planar_index = PlanarIndex(eastings, northings)
+        return self._planar_index
+
+    def match_segments(
+        self, segments: Dataset, junctions: Dataset, utm_zone: tuple[int, str], match_field: str = 'segment_id', dst_field: str = 'segment_dst',
+        offset_field: str = 'segment_offset', count_field: str = '', distance_limit=float('inf'), endpoints: str = 'neighbors', count_attrib='', reset_count=True
+    ):
+        """ Pair all the rows in this dataset with the closest street segment
+
+        Each segment is the straight line between the first two junctions in its [endpoints] property, eg. the neighbors of
+        the cleaned segments. Segments with fewer than two junctions in [junctions] are never matched. The distance is measured
+        to the closest point on the line, not to its middle, and the offset is how far along the line that point is from the
+        first junction. Both are in meters on the UTM projection (see project_utm).
+
+        The segments are put into an R-tree so each row is only compared with the segments near it.
+
+        Args:
+            segments (Dataset): The segments to match to
+            junctions (Dataset): The junctions at the ends of the segments
+            utm_zone (tuple[int, str]): The UTM zone number and letter to project to, eg. (10, 'U')
+            match_field (str, optional): The name of the field in which to store the primary key of the segment. Defaults to 'segment_id'.
+            dst_field (str, optional): The name of the field in which to store the distance to the segment. Defaults to 'segment_dst'.
+            offset_field (str, optional): The name of the field in which to store the offset along the segment. Defaults to 'segment_offset'.
+            count_field (str, optional): The name of a field in [segments] in which to count the rows matched to each segment. Defaults to ''.
+            distance_limit (float): The maximum distance beyond which a match should not be made
+            endpoints (str, optional): The property of [segments] with the list of junction ids. Defaults to 'neighbors'.
+            count_attrib (str, optional): A field in this dataset to add to the count instead of 1. Defaults to ''.
+            reset_count (bool, optional): Whether to set the counts to zero before matching. Defaults to True.
+        """
+        positions, distances, offsets = np.full(len(self), -1, dtype=np.intp), np.zeros(len(self)), np.zeros(len(self))
+
+        if len(self) > 0 and len(segments) > 0 and len(junctions) > 0:
+            eastings, northings = junctions.project_utm(*utm_zone)
+            junction_positions = dict(zip(junctions.get_column(junctions.primary_key).tolist(), range(len(junctions))))
+
+            # Segments without two known junctions get the position of a nan point so they are never matched
+            missing = len(junctions)
+            eastings, northings = np.append(eastings, np.nan), np.append(northings, np.nan)
+            ends = np.full((len(segments), 2), missing, dtype=np.intp)
+            for i, junction_ids in enumerate(segments.get_column(endpoints).tolist()):
+                if len(junction_ids) >= 2:
+                    ends[i] = [junction_positions.get(junction_id, missing) for junction_id in junction_ids[:2]]
+
+            tree = SegmentRTree(eastings[ends[:, 0]], northings[ends[:, 0]], eastings[ends[:, 1]], northings[ends[:, 1]])
+            positions, distances, offsets = tree.nearest(*self.project_utm(*utm_zone), distance_limit)
+
+        self._store_matches(segments, positions, distances, match_field, dst_field, count_field, count_attrib, reset_count)
+        self.set_column(offset_field, offsets)
+        print(f"\r    Matched {len(self)} nodes. 100% {' ' * 10}")
+
+    def query_radius(self, points: Dataset | tuple[ArrayLike, ArrayLike], radius: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Find all the rows within [radius] meters of each point
         
-        self.match_closest(other_data, distance, on_match, distance_limit=distance_limit)
+        eg. all the junctions within 200 meters of each crime::
+        
+            offsets, positions, distances = junctions.query_radius(crime, 200)
+            junction_ids = junctions.get_column('id')[positions[offsets[i]:offsets[i + 1]]]  # For the ith crime
+            graffiti_counts = np.diff(graffiti.query_radius(junctions, 100)[0])                  # Graffiti near each junction
+
+        Args:
+            points (Dataset | tuple[ArrayLike, ArrayLike]): A dataset with latitude and longitude properties, or (latitudes, longitudes)
+            radius (float): The maximum distance in meters (inclusive)
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: Offsets, positions of rows in this dataset and distances. See SpatialIndex.query_radius.
+        """
+        latitudes, longitudes = Dataset._lat_lng_of(points)
+        return self.spatial_index().query_radius(latitudes, longitudes, radius)
+    
+    def query_knn(self, points: Dataset | tuple[ArrayLike, ArrayLike], k: int, distance_limit: float = float('inf')) -> tuple[np.ndarray, np.ndarray]:
+        """Find the [k] closest rows to each point
+        
+        eg. the 3 closest transit stops to each junction::
+        
+            positions, distances = transit.query_knn(junctions, 3)
+
+        Args:
+            points (Dataset | tuple[ArrayLike, ArrayLike]): A dataset with latitude and longitude properties, or (latitudes, longitudes)
+            k (int): The number of rows to find for each point
+            distance_limit (float, optional): Only find rows within this many meters. Defaults to float('inf').
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: (number of points, k) arrays of positions of rows in this dataset and distances. Missing matches are -1 and inf.
+        """
+        latitudes, longitudes = Dataset._lat_lng_of(points)
+        return self.spatial_index().query_knn(latitudes, longitudes, k, distance_limit)
+    
+    @staticmethod
+    def _lat_lng_of(points: Dataset | tuple[ArrayLike, ArrayLike]) -> tuple[np.ndarray, np.ndarray]:
+        """Get the latitudes and longitudes of a dataset or a (latitudes, longitudes) tuple"""
+        if isinstance(points, Dataset):
+            if len(points) == 0: return np.zeros(0), np.zeros(0)
+            return points.get_column('latitude'), points.get_column('longitude')
+        return np.asarray(points[0], dtype=np.float64), np.asarray(points[1], dtype=np.float64)
+        
+    def _store_matches(
+        self, other_data: Dataset, positions: np.ndarray, distances: np.ndarray, match_field: str, dst_field: str, count_field: str, 
+        count_attrib: str, reset_count: bool
+    ):
+        """Store the matches found by match_lat_lng in the fields it fills in. Unmatched rows get 0."""
+        matched = positions != -1
+        if match_field:
+            keys = other_data.get_column(other_data.primary_key).tolist() if len(other_data) > 0 else []
+            self.set_column(match_field, [keys[position] if position != -1 else 0 for position in positions.tolist()])
+        if dst_field:
+            self.set_column(dst_field, np.where(matched, distances, 0))
+        if count_field:
+            counts = { count_field: aggregation.total(count_attrib) if count_attrib else aggregation.count() }
+            aggregation.aggregate_matches(self, other_data, positions, counts, reset=reset_count)
+        
+    def _apply_matches(self, other_data: Dataset, positions: Sequence[int], distances: Sequence[Any], on_match: Callable[[Row, Row, float], None]):
+        """Call on_match for each row with the row of [other_data] at the matched position, in row order. Positions of -1 are not matched."""
+        other_rows = list(other_data)
+        for row_1, position, distance in zip(self, positions, distances):
+            if position != -1:
+                on_match(row_1, other_rows[position], distance)
         
     def get_column_names(self):
         """Get the names of the columns in the dataset
@@ -303,30 +856,53 @@ class Dataset:
             raise Exception("Cannot merge datasets with different columns")
             
         self._rows.update(other._rows)
+        self._rebuild_indexes()
         
-    def filter(self, filter: Callable[[Row], bool]):
+    def filter(self, filter: Callable[[Row], bool] | Expression):
         """Filter rows from the dataset
         
         The filter function is run for each of the rows. If it returns False the row is removed from the dataset.
+        
+        The filter can also be an expression built with col(), eg. col('junction_id') != 0. Expressions are evaluated on whole
+        columns at once and the rows are selected in one step.
 
         Args:
-            filter (Callable[[Row], bool]): The filter function
+            filter (Callable[[Row], bool] | Expression): The filter function or expression
         """
+        if isinstance(filter, Expression):
+            mask = filter.mask(self)
+            if self._indexes:
+                for key, row in compress(self._rows.items(), ~mask):
+                    self._unindex(key, row)
+            self._rows = dict(compress(self._rows.items(), mask))
+            return
+        
         toDelete = []
         for row in self:
             if not filter(row):
                 toDelete.append(row)
         for row in toDelete: 
+            self._unindex(row[self.primary_key], row)
             del self._rows[row[self.primary_key]]
         
-    def write_to_file(self, filename: str, delimiter: str = ',', columnnames=None, write_header = True):
+    def write_to_file(self, filename: str, delimiter: str = ',', columnnames=None, write_header = True, append = False, compression: str | None = None):
         """ Write the dataset to a csv file
+        
+        Rows are streamed straight to a csv writer without building a dict per row. Lists, tuples and dicts are written as compact
+        json so they take less space and can be read back quickly with conversion_functions.parse_list. Tuples are read back as
+        lists, eg. each neighbor of a junction is read as an [id, length, segment id] list. Dicts with keys that are not strings
+        are written as python literals so their keys are kept. See file_io.encode_value.
+        
+        Files ending in .gz or .zst are compressed with gzip or zstd. zstd needs the optional zstandard package. Compressed files
+        can be read back with load_file like any other file.
 
         Args:
             filename (str): The name of the csv file
             delimiter (str, optional): The delimiter to use for separating values. Defaults to ','.
             fieldnames (list[str], optional): The fieldnames to write. If not provided then writes all values.
             write_header (bool, optional): Whether or not the header should be written. Defaults to True.
+            append (bool, optional): Add the rows to the end of the file instead of replacing it. The header is only written if the file is empty. Defaults to False.
+            compression (str | None, optional): 'gzip', 'zstd' or 'none'. Defaults to None which uses the file extension.
         """
         if len(self) == 0:
             print("No data to write!")
@@ -334,20 +910,107 @@ class Dataset:
         
         if columnnames == None:
             columnnames = self.get_column_names()
+        columnnames = list(columnnames)
         
-        with open(filename, 'w+', newline='', encoding='utf-8-sig') as out_file:
-            writer = csv.DictWriter(out_file, fieldnames=columnnames, delimiter=delimiter, quoting=csv.QUOTE_MINIMAL)
+        # Only the start of the file should have a byte order mark
+        encoding = 'utf-8-sig'
+        if append and os.path.exists(filename) and os.path.getsize(filename) > 0:
+            write_header = False
+            encoding = 'utf-8'
+        
+        with file_io.open_text(filename, 'a' if append else 'w', compression, encoding) as out_file:
+            writer = csv.writer(out_file, delimiter=delimiter, quoting=csv.QUOTE_MINIMAL)
             
             if write_header:
-                writer.writeheader()
+                writer.writerow(columnnames)
                 
-            writer.writerows(self._rows.values())
+            writer.writerows(self._row_values(columnnames))
+            
+    def _row_values(self, columnnames: list[str]) -> Iterator[Sequence[Any]]:
+        """Iterate over the values of [columnnames] for each row, encoded for writing
+        
+        Missing values are written as empty strings like csv.DictWriter does. Every value is encoded with 
+        file_io.encode_value, so nested values are written the same way wherever they are in a column.
+        """
+        rows = self._rows.values()
+        getter = itemgetter(*columnnames)
+        encode_value = file_io.encode_value
+        
+        def get_values(row: Row) -> Sequence[Any]:
+            try:
+                values = getter(row)
+            except KeyError:
+                return [encode_value(row.get(name, '')) for name in columnnames]
+            return list(map(encode_value, values)) if len(columnnames) > 1 else (encode_value(values),)
+        
+        return map(get_values, rows)
+            
+    @staticmethod
+    def write_chunks(chunks: Iterable[Dataset], filename: str, delimiter: str = ',', columnnames=None) -> int:
+        """ Write a sequence of datasets, eg. from load_file_chunks, to a single csv file
+        
+        The header is written once, from the columns of the first non empty chunk if columnnames is not provided.
+
+        Args:
+            chunks (Iterable[Dataset]): The datasets to write
+            filename (str): The name of the csv file
+            delimiter (str, optional): The delimiter to use for separating values. Defaults to ','.
+            columnnames (list[str], optional): The fieldnames to write. If not provided then uses the columns of the first chunk.
+
+        Returns:
+            int: The number of rows written
+        """
+        written = 0
+        for chunk in chunks:
+            if len(chunk) == 0: continue
+            
+            if columnnames == None:
+                columnnames = chunk.get_column_names()
+            chunk.write_to_file(filename, delimiter, columnnames, append=written > 0)
+            written += len(chunk)
+            
+        if written == 0:
+            print("No data to write!")
+        return written
+    
+    def save_binary(self, directory: str, key: str | None = None):
+        """ Save the dataset to a directory in a binary columnar format
+        
+        Column types are kept, including nested values like lists of tuples, so the data does not need to be converted again when
+        it is loaded with load_binary. Numeric columns are stored so that they can be memory mapped.
+        
+        The object columns are pickled so only load directories that you created yourself.
+
+        Args:
+            directory (str): The directory to save to
+            key (str | None, optional): A binary_format.cache_key for what the dataset was made from, checked by binary_format.is_fresh. Defaults to None.
+        """
+        columns = { name: self.get_column(name) for name in self.get_column_names() }
+        binary_format.save_columns(directory, columns, self.primary_key, key)
+        
+    @staticmethod
+    def load_binary(directory: str, columnar=True, mmap=True) -> Dataset:
+        """ Load a dataset saved with save_binary
+
+        Args:
+            directory (str): The directory to load from
+            columnar (bool, optional): Whether to return a ColumnarDataset. If False the rows are converted to dicts. Defaults to True.
+            mmap (bool, optional): Whether to memory map the numeric columns. Defaults to True.
+
+        Returns:
+            Dataset: The loaded dataset
+        """
+        from .columnar_dataset import ColumnarDataset
+        
+        columns, primary_key = binary_format.load_columns(directory, mmap)
+        dataset = ColumnarDataset(columns, primary_key)
+        return dataset if columnar else dataset.to_dataset()
     
     @staticmethod
     def cross_data(data_1: Dataset, data_2: Dataset, func: Callable[[Row, Row], None]):
         """ Run a function on the cross product of two data sets
         
-        !WARNING: Creates a cross product between the two data sets. May run slowly for large datasets.
+        !WARNING: Creates a cross product between the two data sets. May run slowly for large datasets. See cross_pairs.
         
         Useful for computing something based on the combination of two data sets. eg. matching nodes
         [func] will receive every combination of pairs of rows with 1 row from data set 1 and 1 row from data set 2
@@ -360,9 +1023,44 @@ class Dataset:
         for row_1 in data_1:
             for row_2 in data_2:
                 func(row_1, row_2)
+
+    @staticmethod
+    def cross_pairs(
+        data_1: Dataset, data_2: Dataset, func: Callable[[CrossBlock, CrossBlock], Any], prefilter: Prefilter | None = None, block_size: int = 128
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """ Find the pairs of rows of two data sets for which a vectorized function is true
+        
+        A blocked version of cross_data. The cross product is walked in blocks of [block_size] rows from each data set and
+        [func] is called once per pair of blocks with the columns of both blocks. It should return an (n, m) boolean array, 
+        eg. all the stores within 500 meters of a school::
+        
+            from data_wrangler.cross import within_distance
+            from data_wrangler.distance import haversine_metres
+            
+            stores_i, schools_i = Dataset.cross_pairs(
+                stores, schools,
+                lambda a, b: haversine_metres(a['latitude'], a['longitude'], b['latitude'], b['longitude']) < 500,
+                prefilter=within_distance(500)
+            )
+            
+        A prefilter (cross.within_distance or cross.same_key) sorts the rows so that nearby rows are in the same blocks and 
+        skips the pairs of blocks that can not contain a match without calling [func].
+
+        Args:
+            data_1 (Dataset): The first data set
+            data_2 (Dataset): The second data set
+            func (Callable[[CrossBlock, CrossBlock], Any]): Returns whether each pair of rows in two blocks is a match
+            prefilter (Prefilter | None, optional): A cheap test to skip pairs of blocks. Defaults to None.
+            block_size (int, optional): The number of rows of each data set in a block. Smaller blocks are skipped more often by a prefilter
+                but have more overhead. Defaults to 128.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The positions in data_1 and data_2 of the pairs, in the order cross_data visits them
+        """
+        return cross.cross_pairs(data_1, data_2, func, prefilter, block_size)
     
     @staticmethod
-    def load_file(filename: str, conversion_map: ConversionMap | None = None, primary_key='id', delimiter: str =',', fieldnames: Sequence[str] | None=None, has_header=True, primary_key_start=0):
+    def load_file(filename: str, conversion_map: ConversionMap | None = None, primary_key='id', delimiter: str =',', fieldnames: Sequence[str] | None=None, has_header=True, primary_key_start=0, columnar=False, compact=False):
         """Load data from a csv file
         
         WARNING: conversion_map is deprecated. Don't use conversion_map instead use conver_property() and rename_property()
@@ -383,13 +1081,19 @@ class Dataset:
         The value matched to "Name" in the input is passed to str and stored in "name" in the output.
         The row and an index value is passed to the lambda function which joins the index with the "Name" attribute of the input, and the result is
         stored in "indexName" of the output.
+        
+        The conversion map is compiled into a column schema before the file is read. Functions on one parameter are applied to a whole
+        column at once so plain functions like int, float or split_latitude run without any per value wrapper. RowFunctions are still
+        called once per row, and generate_id is replaced by a range.
 
         Args:
-            filename (str): The name of the file to load. Should be a csv file.
+            filename (str): The name of the file to load. Should be a csv file, optionally compressed (.gz or .zst).
             conversion_map (ConversionMap, optional): A mapping between fieldnames in the output data and a function on the input data. If not provided then all values are loaded as strings.
             delimiter (str, optional): The delimiter used by the csv file. Defaults to ','.
             fieldnames (Sequence[str] | None): The names to use for the fields. Defaults to None.
             has_header (boolean): Whether or not there is a header row in the file. Must be true if fieldnames is None.
+            columnar (boolean): Whether to store the data in a ColumnarDataset. Defaults to False.
+            compact (boolean): Whether to store each row as a CompactRow instead of a dict, sharing equal values between rows. See Dataset.compact for how much memory this saves. Defaults to False.
 
         Returns:
             RowData: The loaded data
@@ -400,74 +1104,293 @@ class Dataset:
             raise Exception("If fieldnames is None then has_header must be True")
         
         # Open the file
-        with open(filename, 'r', encoding='utf-8-sig') as input_file:
-            data = []
+        with file_io.open_text(filename, 'r') as input_file:
+            reader, fieldnames, schema = Dataset._prepare_reader(input_file, conversion_map, delimiter, fieldnames, has_header)
+            
+            rows = Dataset._read_rows(reader, len(fieldnames))
+            return Dataset._convert_rows(rows, fieldnames, schema, primary_key, 0, primary_key_start, columnar, compact)
+        
+    @staticmethod
+    def load_file_chunks(
+        filename: str, conversion_map: ConversionMap | None = None, chunk_size: int = 10000, primary_key='id', delimiter: str =',', 
+        fieldnames: Sequence[str] | None=None, has_header=True, primary_key_start=0, columnar=False, compact=False
+    ) -> Iterator[Dataset]:
+        """Load data from a csv file in chunks of at most [chunk_size] rows
+        
+        Only one chunk is held in memory at a time so files that are too large to load with load_file can be processed.
+        Conversions are applied the same way as in load_file, and RowFunctions and generated primary keys receive the index
+        of the row in the whole file so the chunks fit together. When matching chunks with count_field use reset_count=False
+        so that the counts add up over all the chunks.
+        
+        Example::
+        
+            chunks = Dataset.load_file_chunks(CRIME_FILE, {'id': int, 'latitude': float, 'longitude': float})
             
-            # Read each row of the file
-            rows = csv.DictReader(input_file, quoting=csv.QUOTE_MINIMAL, delimiter=delimiter, fieldnames=fieldnames)
-            # Read the header if necessary
-            if(fieldnames != None and has_header):
-                next(rows)
+            def process(chunk):
+                chunk.match_lat_lng(junctions, 'junction_id', 'junction_dst', distance_limit=200)
+                chunk.filter(lambda row: row['junction_id'] != 0)
+                return chunk
             
-            if conversion_map != None:
-                # Make all conversions using IndexedConversionMap
-                conversions, required_fieldnames = Dataset._fix_conversion(conversion_map)
-                
-                for req_name in required_fieldnames:
-                    if req_name not in rows.fieldnames:
-                        print(f"{req_name} is not a valid fieldname. The availiable fieldnames are {rows.fieldnames}")
+            Dataset.write_chunks(map(process, chunks), OUTPUT_FILE)
+
+        Args:
+            filename (str): The name of the file to load. Should be a csv file.
+            conversion_map (ConversionMap, optional): See load_file. If not provided then all values are loaded as strings.
+            chunk_size (int, optional): The maximum number of rows in each chunk. Defaults to 10000.
+            delimiter (str, optional): The delimiter used by the csv file. Defaults to ','.
+            fieldnames (Sequence[str] | None): The names to use for the fields. Defaults to None.
+            has_header (boolean): Whether or not there is a header row in the file. Must be true if fieldnames is None.
+            columnar (boolean): Whether to store each chunk in a ColumnarDataset. Defaults to False.
+            compact (boolean): Whether to store each row as a CompactRow instead of a dict. Defaults to False.
+
+        Yields:
+            Dataset: The next chunk of the file
+        """
+        if (fieldnames == None and not has_header):
+            raise Exception("If fieldnames is None then has_header must be True")
+        if chunk_size < 1:
+            raise Exception("chunk_size must be at least 1")
+        
+        with file_io.open_text(filename, 'r') as input_file:
+            reader, fieldnames, schema = Dataset._prepare_reader(input_file, conversion_map, delimiter, fieldnames, has_header)
+            
+            index_start = 0
+            while True:
+                rows = Dataset._read_rows(islice(reader, chunk_size), len(fieldnames))
+                if len(rows) == 0: break
                 
-                # Read each row
-                for i, row in enumerate(rows):
-                    # Apply the conversion to the row to get a result
-                    result = { key: conversions[key](row, i) for key in conversions }
-                    
-                    if primary_key not in result:
-                        result[primary_key] = i + primary_key_start
-                    
-                    data.append(result)
-            else:
-                data = list(rows)
+                yield Dataset._convert_rows(rows, fieldnames, schema, primary_key, index_start, primary_key_start, columnar, compact)
+                index_start += len(rows)
                 
-                # Generate a primary key if it is not in the data
-                if len(data) > 0 and primary_key not in data[0]:
-                    for i, row in enumerate(data):
-                        row[primary_key] = i + primary_key_start
+    @staticmethod
+    def load_many(
+        filenames: Sequence[str], conversion_map: ConversionMap | None = None, primary_key='id', delimiter: str =',', 
+        fieldnames: Sequence[str] | None=None, has_header=True, workers: int | None = None, columnar=False, compact=False
+    ) -> Dataset:
+        """Load several csv files with the same columns, eg. one file per year, into a single dataset
+        
+        The files are parsed in parallel by separate processes with load_file and the results are concatenated in the order of
+        [filenames]. The columns of each file are not checked against each other like merge does.
+        
+        Generated primary keys (from generate_id, or because the primary key is not in the data) continue from one file to the
+        next as if the files were one long file, so they never overlap. Other primary keys must be unique over all the files.
+        
+        Example::
+        
+            crime = Dataset.load_many([CRIME_2022, CRIME_2021, CRIME_2023], crime_conversion_map)
+
+        Args:
+            filenames (Sequence[str]): The names of the files to load
+            conversion_map (ConversionMap, optional): See load_file. If not provided then all values are loaded as strings.
+            delimiter (str, optional): The delimiter used by the csv files. Defaults to ','.
+            fieldnames (Sequence[str] | None): The names to use for the fields. Defaults to None.
+            has_header (boolean): Whether or not there is a header row in the files. Must be true if fieldnames is None.
+            workers (int | None, optional): The number of processes to use. Defaults to None which uses one per cpu.
+            columnar (boolean): Whether to store the data in a ColumnarDataset. Defaults to False.
+            compact (boolean): Whether to store each row as a CompactRow instead of a dict. Defaults to False.
+
+        Returns:
+            Dataset: The loaded data
+        """
+        filenames = list(filenames)
+        if len(filenames) == 0:
+            raise Exception("No files to load")
+        
+        datasets: list[Dataset] = parallel.parallel_map(
+            lambda filename: Dataset.load_file(
+                filename, conversion_map, primary_key, delimiter, fieldnames, has_header, columnar=columnar, compact=compact
+            ), 
+            filenames, 
+            workers
+        )
+        
+        # Work out whether the primary keys were generated from the schema and header of the first file
+        with file_io.open_text(filenames[0], 'r') as input_file:
+            _, names, schema = Dataset._prepare_reader(input_file, conversion_map, delimiter, fieldnames, has_header)
+        if schema == None:
+            generated = primary_key not in names
+        else:
+            outputs = { key: func for key, _, func in schema }
+            generated = primary_key not in outputs or outputs[primary_key] is generate_id.f
+        
+        offsets = [0] * len(datasets)
+        if generated:
+            for i in range(1, len(datasets)):
+                offsets[i] = offsets[i - 1] + len(datasets[i - 1])
+        
+        count = sum(len(dataset) for dataset in datasets)
+        datasets, offsets = [dataset for dataset in datasets if len(dataset)], [o for dataset, o in zip(datasets, offsets) if len(dataset)]
+        if len(datasets) == 0:
+            return Dataset([], primary_key)
+        
+        if columnar:
+            from .columnar_dataset import ColumnarDataset
+            columns = {
+                name: np.concatenate([
+                    dataset.get_column(name) + offset if name == primary_key and offset else dataset.get_column(name) 
+                    for dataset, offset in zip(datasets, offsets)
+                ])
+                for name in datasets[0].get_column_names()
+            }
+            result: Dataset = ColumnarDataset(columns, primary_key)
+        else:
+            rows = []
+            for dataset, offset in zip(datasets, offsets):
+                if offset:
+                    for row in dataset:
+                        row[primary_key] += offset
+                rows.extend(dataset._rows.values())
+            result = Dataset(rows, primary_key)
+            
+        if len(result) != count:
+            raise Exception("The files contain duplicate primary keys")
+        return result
                 
-            return Dataset(data, primary_key)
+    @staticmethod
+    def _prepare_reader(
+        input_file: TextIO, conversion_map: ConversionMap | None, delimiter: str, fieldnames: Sequence[str] | None, has_header: bool
+    ) -> tuple[Iterator[list[str]], list[str], list[tuple[str, str | None, Callable]] | None]:
+        """Create a csv reader for an open file, read the header and compile the conversion map
+
+        Returns:
+            tuple[Iterator[list[str]], list[str], list[tuple[str, str | None, Callable]] | None]: The non blank rows, the fieldnames and the schema
+        """
+        reader = csv.reader(input_file, quoting=csv.QUOTE_MINIMAL, delimiter=delimiter)
+        
+        # Read the header if necessary
+        if fieldnames == None:
+            fieldnames = next(reader, [])
+        elif has_header:
+            next(reader, None)
+        fieldnames = list(fieldnames)
+            
+        schema = None
+        if conversion_map != None:
+            schema = Dataset._compile_conversion(conversion_map)
+            
+            for _, req_name, _ in schema:
+                if req_name != None and req_name not in fieldnames:
+                    print(f"{req_name} is not a valid fieldname. The availiable fieldnames are {fieldnames}")
+                    
+        return filter(None, reader), fieldnames, schema
+            
+    @staticmethod
+    def _read_rows(reader: Iterable[list[str]], width: int) -> list[list[str | None]]:
+        """Read the rows from a csv reader making sure they all have [width] values
+        
+        Like csv.DictReader blank rows are skipped and short rows are padded with None.
+
+        Args:
+            reader (Iterable[list[str]]): The csv reader
+            width (int): The number of fieldnames
+
+        Returns:
+            list[list[str | None]]: The rows
+        """
+        rows = list(filter(None, reader))
+        
+        if set(map(len, rows)) - {width}:
+            rows = [row if len(row) == width else (row + [None] * (width - len(row)))[:width] for row in rows]
+        return rows
+        
+    @staticmethod
+    def _convert_rows(
+        rows: list[list[str | None]], fieldnames: list[str], schema: list[tuple[str, str | None, Callable]] | None, primary_key: str, 
+        index_start: int, primary_key_start: int, columnar: bool, compact: bool = False
+    ) -> Dataset:
+        """Apply a compiled conversion schema to rows read from a csv file and create a Dataset
+
+        Args:
+            rows (list[list[str | None]]): The rows read by _read_rows
+            fieldnames (list[str]): The names of the values in each row
+            schema (list[tuple[str, str | None, Callable]] | None): The compiled conversion map. If None the values are kept as strings.
+            primary_key (str): The primary key of the dataset
+            index_start (int): The index of the first row in the file. Passed on to RowFunctions.
+            primary_key_start (int): The value to start generated primary keys at
+            columnar (bool): Whether to create a ColumnarDataset
+            compact (bool, optional): Whether to store the rows as CompactRows. Ignored if columnar is True. Defaults to False.
+
+        Returns:
+            Dataset: The dataset
+        """
+        count = len(rows)
+        
+        # Later fieldnames take precedence over earlier ones with the same name like in csv.DictReader
+        positions = { name: i for i, name in enumerate(fieldnames) }
+        
+        if schema == None:
+            columns: dict[str, Sequence[Any]] = { name: list(map(itemgetter(i), rows)) for name, i in positions.items() }
+        else:
+            columns = {}
+            row_dicts = None
+            for key, fieldname, func in schema:
+                if fieldname != None:
+                    # Apply the function to the whole column at once
+                    columns[key] = list(map(func, map(itemgetter(positions[fieldname]), rows)))
+                elif func is generate_id.f:
+                    columns[key] = range(index_start + 1, index_start + count + 1)
+                else:
+                    if row_dicts == None:
+                        row_dicts = list(map(dict, map(zip, repeat(fieldnames), rows)))
+                    columns[key] = [func(row, index_start + i) for i, row in enumerate(row_dicts)]
+        
+        # Generate a primary key if it is not in the data
+        if primary_key not in columns:
+            columns[primary_key] = range(primary_key_start + index_start, primary_key_start + index_start + count)
+            
+        if columnar:
+            from .columnar_dataset import ColumnarDataset
+            return ColumnarDataset(columns, primary_key)
+        
+        names = list(columns)
+        if compact:
+            # Share equal values (eg. repeated strings and zeros) between rows so each is only stored once
+            values = [Dataset._share_values(column) for column in columns.values()]
+            return Dataset(list(map(make_row_class(names), zip(*values))), primary_key)
+        return Dataset(list(map(dict, map(zip, repeat(names), zip(*columns.values())))), primary_key)
         
     @staticmethod
-    def _fix_conversion(conversions: ConversionMap) -> tuple[dict[str, Callable[[Row, int], Any]], list[str]]:
-        """Modify a ConversionMap to only used IndexedConversionFunctions   
+    def _share_values(values: Sequence[Any]) -> Sequence[Any]:
+        """Replace equal values in a column with the same object
 
         Args:
-            conversions (ConversionMap): The conversion map to fix
+            values (Sequence[Any]): The column
 
         Returns:
-            dict[str, IndexedConversionFunction]: The fixed conversion map
+            Sequence[Any]: The column with shared values. Unchanged if the values are not hashable.
         """
+        shared: dict[Any, Any] = {}
+        try:
+            # -0.0 == 0.0 but they are not the same value, so the sign of zeros is part of the key
+            return [
+                shared.setdefault((type(value), value, value == 0 and math.copysign(1.0, value)) if isinstance(value, float) else (type(value), value), value)
+                for value in values
+            ]
+        except TypeError:
+            return values
         
-        result = {}
-        required_fieldnames = []
-        for key in conversions:
+    @staticmethod
+    def _compile_conversion(conversions: ConversionMap) -> list[tuple[str, str | None, Callable]]:
+        """Compile a ConversionMap into a column schema
+        
+        Each entry of the schema is (output fieldname, input fieldname, function). When the input fieldname is set the function is
+        applied to every value of that input column. When it is None the function is a RowFunction and is given each row and its index.
+
+        Args:
+            conversions (ConversionMap): The conversion map to compile
+
+        Returns:
+            list[tuple[str, str | None, Callable]]: The schema
+        """
+        schema = []
+        for key, conversion in conversions.items():
             # The conversion is (function, key_in)
-            if type(conversions[key]) == tuple:
-                func = conversions[key][0]                                                  # type: ignore
-                fieldname = conversions[key][1]                                             # type: ignore
-                required_fieldnames.append(fieldname)
-                
-                # Have to use instantly called lambda expression wrapper to avoid late binding
-                result[key] = (lambda func, fn: 
-                    lambda row, index: func(row[fn]))(func, fieldname)
+            if type(conversion) == tuple:
+                schema.append((key, conversion[1], conversion[0]))
             # The conversion is RowFunction(function)
-            elif type(conversions[key]) == RowFunction:
-                # Have to use instantly called lambda expression wrapper to avoid late binding
-                result[key] = (lambda rowf: rowf.f)(conversions[key])                       # type: ignore
+            elif type(conversion) == RowFunction:
+                schema.append((key, None, conversion.f))
             # The conversion is function
             else:
-                required_fieldnames.append(key)
-                # Have to use instantly called lambda expression wrapper to avoid late binding
-                result[key] = (lambda key: 
-                    lambda row, index: conversions[key](row[key])                           # type: ignore
-                )(key)    
-        return result, required_fieldnames
\ No newline at end of file
+                schema.append((key, key, conversion))
+        return schema
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+from typing import Any
+from typing import Callable
+from collections.abc import Sequence
+
+import numpy as np
+
+from .conversion_functions import Row
+
+# The same earth radius as the haversine package uses for Unit.METERS
+EARTH_RADIUS_METRES = 6371.0088 * 1000.0
+
+ArrayLike = float | Sequence[float] | np.ndarray
+
+
+def haversine_metres(latitudes_1: ArrayLike, longitudes_1: ArrayLike, latitudes_2: ArrayLike, longitudes_2: ArrayLike) -> np.ndarray:
+    """Calculate haversine distances in metres for whole arrays of points at once
+
+    The arguments are broadcast against each other like any numpy operation, so this computes the distance from one point to
+    an array of points, or between two arrays of points pair by pair. Uses the same formula and earth radius as
+    haversine(p1, p2, unit=Unit.METERS).
+
+    eg: haversine_metres(49.26, -123.11, junction_latitudes, junction_longitudes)
+
+    Args:
+        latitudes_1 (ArrayLike): The latitudes of the first points in degrees
+        longitudes_1 (ArrayLike): The longitudes of the first points in degrees
+        latitudes_2 (ArrayLike): The latitudes of the second points in degrees
+        longitudes_2 (ArrayLike): The longitudes of the second points in degrees
+
+    Returns:
+        np.ndarray: The distances in metres
+    """
+    lat_1 = np.radians(np.asarray(latitudes_1, dtype=np.float64))
+    lng_1 = np.radians(np.asarray(longitudes_1, dtype=np.float64))
+    lat_2 = np.radians(np.asarray(latitudes_2, dtype=np.float64))
+    lng_2 = np.radians(np.asarray(longitudes_2, dtype=np.float64))
+
+    d = np.sin((lat_2 - lat_1) * 0.5) ** 2 + np.cos(lat_1) * np.cos(lat_2) * np.sin((lng_2 - lng_1) * 0.5) ** 2
+    return 2 * EARTH_RADIUS_METRES * np.arcsin(np.sqrt(np.minimum(d, 1)))
+
+def haversine_matrix(latitudes_1: ArrayLike, longitudes_1: ArrayLike, latitudes_2: ArrayLike, longitudes_2: ArrayLike) -> np.ndarray:
+    """Calculate the haversine distance in metres between every pair of points from two arrays
+
+    Args:
+        latitudes_1 (ArrayLike): The latitudes of the first points in degrees
+        longitudes_1 (ArrayLike): The longitudes of the first points in degrees
+        latitudes_2 (ArrayLike): The latitudes of the second points in degrees
+        longitudes_2 (ArrayLike): The longitudes of the second points in degrees
+
+    Returns:
+        np.ndarray: An (n1, n2) array where [i, j] is the distance between the ith first point and the jth second point
+    """
+    return haversine_metres(
+        np.asarray(latitudes_1, dtype=np.float64)[:, np.newaxis], np.asarray(longitudes_1, dtype=np.float64)[:, np.newaxis],
+        np.asarray(latitudes_2, dtype=np.float64)[np.newaxis, :], np.asarray(longitudes_2, dtype=np.float64)[np.newaxis, :]
+    )
+
+
+class ColumnDistance:
+    """A distance function between two rows that can also compute the distance from one row to every row of a dataset at once
+
+    It can be passed anywhere a Callable[[Row, Row], float] distance function is used. Dataset.match_closest recognises it and
+    compares each row with the columns of the other dataset in one numpy operation instead of calling it for every pair.
+    """
+
+    def __init__(self, row_distance: Callable[[Row, Row], float], to_columns: Callable[[Row, Callable[[str], np.ndarray]], np.ndarray]):
+        """ Create a distance function. Use haversine_distance or p_norm_distance instead of calling this directly.
+
+        Args:
+            row_distance (Callable[[Row, Row], float]): The distance between two rows
+            to_columns (Callable[[Row, Callable[[str], np.ndarray]], np.ndarray]): The distances from a row to every row of a dataset given a function that returns its columns
+        """
+        self._row_distance = row_distance
+        self._to_columns = to_columns
+
+    def __call__(self, row_1: Row, row_2: Row) -> float:
+        return self._row_distance(row_1, row_2)
+
+    def to_columns(self, row: Row, get_column: Callable[[str], np.ndarray]) -> np.ndarray:
+        """Calculate the distance from [row] to every row of a dataset
+
+        Args:
+            row (Row): The row to measure from
+            get_column (Callable[[str], np.ndarray]): Returns a column of the other dataset, eg. Dataset.get_column
+
+        Returns:
+            np.ndarray: The distances in the row order of the other dataset
+        """
+        return self._to_columns(row, get_column)
+
+
+def haversine_distance(latitude: str = 'latitude', longitude: str = 'longitude') -> ColumnDistance:
+    """The haversine distance in metres between the latitude and longitude of two rows
+
+    Args:
+        latitude (str, optional): The name of the latitude property. Defaults to 'latitude'.
+        longitude (str, optional): The name of the longitude property. Defaults to 'longitude'.
+
+    Returns:
+        ColumnDistance: The distance function
+    """
+    return ColumnDistance(
+        lambda row_1, row_2: haversine_metres(row_1[latitude], row_1[longitude], row_2[latitude], row_2[longitude]).item(),
+        lambda row, get_column: haversine_metres(row[latitude], row[longitude], get_column(latitude), get_column(longitude))
+    )
+
+def p_norm_distance(match_keys: Sequence[str | tuple[str, str]], p_norm: float = 2) -> ColumnDistance:
+    """The p-norm distance between properties of two rows
+
+    Args:
+        match_keys (Sequence[str | tuple[str, str]]): The properties to use. A tuple is (property of the first row, property of the second row).
+        p_norm (float, optional): The p to use. Defaults to 2 (Euclidean distance).
+
+    Returns:
+        ColumnDistance: The distance function
+    """
+    keys = [key if type(key) == tuple else (key, key) for key in match_keys]
+
+    def row_distance(row_1: Row, row_2: Row) -> float:
+        distance = 0
+        for key_1, key_2 in keys:
+            distance += pow(abs(row_1[key_1] - row_2[key_2]), p_norm)
+        return pow(distance, 1 / p_norm)
+
+    def to_columns(row: Row, get_column: Callable[[str], np.ndarray]) -> np.ndarray:
+        distance: Any = 0
+        for key_1, key_2 in keys:
+            distance = distance + np.abs(row[key_1] - get_column(key_2)) ** p_norm
+        return distance ** (1 / p_norm)
+
+    return ColumnDistance(row_distance, to_columns)
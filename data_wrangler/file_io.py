@@ -0,0 +1,102 @@
+import io
+import os
+import gzip
+import json
+
+from typing import Any
+from typing import TextIO
+
+COMPRESSION_EXTENSIONS = { '.gz': 'gzip', '.zst': 'zstd' }
+
+# Values of these types are written as json so they can be read back with parse_list
+NESTED_TYPES = (list, tuple, dict)
+_encode_json = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False).encode
+
+
+def get_compression(filename: str, compression: str | None = None) -> str | None:
+    """Determine the compression of a file
+
+    Args:
+        filename (str): The name of the file
+        compression (str | None, optional): 'gzip', 'zstd' or 'none' to override the file extension. Defaults to None.
+
+    Returns:
+        str | None: 'gzip', 'zstd' or None if the file is not compressed
+    """
+    if compression == None:
+        return COMPRESSION_EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+    if compression == 'none':
+        return None
+    if compression not in COMPRESSION_EXTENSIONS.values():
+        raise Exception(f"Unknown compression {compression}. Use one of: {', '.join(COMPRESSION_EXTENSIONS.values())}, none")
+    return compression
+
+def open_text(filename: str, mode: str = 'r', compression: str | None = None, encoding: str = 'utf-8-sig') -> TextIO:
+    """Open a text file for csv reading or writing, decompressing or compressing it if needed
+
+    gzip uses the standard library. zstd needs the optional zstandard package.
+    Appending to a compressed file adds a new compressed block to the end, which is read back as part of the same file.
+
+    Args:
+        filename (str): The name of the file
+        mode (str, optional): 'r', 'w' or 'a'. Defaults to 'r'.
+        compression (str | None, optional): See get_compression. Defaults to None which uses the file extension.
+        encoding (str, optional): The text encoding. Defaults to 'utf-8-sig'.
+
+    Returns:
+        TextIO: The open file
+    """
+    compression = get_compression(filename, compression)
+
+    if compression == None:
+        return open(filename, mode, newline='', encoding=encoding)
+    if compression == 'gzip':
+        # Level 1 is several times faster than the default of 9 and only slightly larger for csv data
+        return gzip.open(filename, mode + 't', compresslevel=1, newline='', encoding=encoding) # type: ignore
+
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception("zstd compression requires the zstandard package. Install it with: pip install zstandard") from None
+
+    raw_file = open(filename, mode + 'b')
+    if mode == 'r':
+        # Appended files contain several frames so keep reading past the end of the first one
+        stream = zstandard.ZstdDecompressor().stream_reader(raw_file, read_across_frames=True, closefd=True)
+    else:
+        stream = zstandard.ZstdCompressor(level=3).stream_writer(raw_file, closefd=True)
+    return io.TextIOWrapper(stream, newline='', encoding=encoding) # type: ignore
+
+def encode_value(value: Any) -> Any:
+    """Encode a value for writing to a csv file
+
+    Lists, tuples and dicts are written as compact json so they can be read back with parse_list. Json has no tuples so tuples
+    are read back as lists, eg. neighbors becomes a list of [id, length, segment id] lists. Dicts with keys that are not strings
+    would have their keys turned into strings by json, so values containing them are written as python literals instead. Every
+    other value is left for the csv writer.
+
+    Args:
+        value (Any): The value
+
+    Returns:
+        Any: The value to write
+    """
+    if isinstance(value, NESTED_TYPES):
+        try:
+            encoded = _encode_json(value)
+        except TypeError:
+            # Values that json does not support are written as python literals which parse_list can also read
+            return repr(value)
+        # Only values whose json has a { can contain a dict, so most values skip the check
+        if '{' in encoded and not _has_string_keys(value):
+            return repr(value)
+        return encoded
+    return value
+
+def _has_string_keys(value: Any) -> bool:
+    """Check that every dict in a nested value only has string keys"""
+    if isinstance(value, dict):
+        return all(type(key) == str for key in value) and all(_has_string_keys(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return all(_has_string_keys(item) for item in value if isinstance(item, NESTED_TYPES))
+    return True
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import hashlib
+
+from heapq import heappush, heappop
+from itertools import chain
+from operator import itemgetter
+
+from typing import Any
+from typing import TYPE_CHECKING
+from collections.abc import Sequence
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from .dataset import Dataset
+
+
+class JunctionGraph:
+    """A road network stored as a compressed sparse row (CSR) adjacency
+
+    Nodes are numbered 0 to n - 1 in the row order of the junctions they were built from. The edges leaving node i are
+    edges offsets[i] to offsets[i + 1] - 1: targets holds the node each edge leads to, lengths its length in meters and
+    segment_ids the id of the street segment it follows. Walking the graph only reads these flat arrays instead of looking up
+    rows and their lists of neighbor tuples.
+    """
+
+    def __init__(self, ids: np.ndarray, offsets: np.ndarray, targets: np.ndarray, lengths: np.ndarray, segment_ids: np.ndarray):
+        """ Create a graph from its arrays. Use from_dataset to build one from junctions.
+
+        Args:
+            ids (np.ndarray): The id of the junction of each node
+            offsets (np.ndarray): The position of the first edge of each node, with the number of edges at the end
+            targets (np.ndarray): The node each edge leads to
+            lengths (np.ndarray): The length of each edge
+            segment_ids (np.ndarray): The segment id of each edge
+        """
+        if len(offsets) != len(ids) + 1 or offsets[-1] != len(targets):
+            raise Exception(f"The offsets of a graph with {len(ids)} nodes and {len(targets)} edges must have {len(ids) + 1} values ending with {len(targets)}")
+        if not len(targets) == len(lengths) == len(segment_ids):
+            raise Exception("The targets, lengths and segment ids of a graph must have one value per edge")
+
+        self.ids = ids
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.targets = np.asarray(targets, dtype=np.int32)
+        self.lengths = np.asarray(lengths, dtype=np.float64)
+        self.segment_ids = np.asarray(segment_ids, dtype=np.int64)
+        self._index: dict[Any, int] | None = None
+
+        # Lists of the arrays and a best distance for every node, created by the first search. Python lists are much faster
+        # than numpy arrays to read one value at a time.
+        self._search_lists: tuple[list[int], list[int], list[float], list[float]] | None = None
+
+    @staticmethod
+    def from_dataset(junctions: Dataset, neighbors: str = 'neighbors') -> JunctionGraph:
+        """Build the graph of a junctions dataset
+
+        The neighbors property of each junction is a list of (neighbor id, length, segment id) tuples, the same as the
+        cleaned junctions. The order of the neighbors is kept.
+
+        Args:
+            junctions (Dataset): The junctions
+            neighbors (str, optional): The name of the neighbors property. Defaults to 'neighbors'.
+
+        Returns:
+            JunctionGraph: The graph
+        """
+        if len(junctions) == 0:
+            return JunctionGraph(np.zeros(0, dtype=np.int64), np.zeros(1, dtype=np.int64), np.zeros(0), np.zeros(0), np.zeros(0))
+
+        ids = junctions.get_column(junctions.primary_key)
+        neighbor_lists = junctions.get_column(neighbors).tolist()
+        counts = np.fromiter(map(len, neighbor_lists), dtype=np.int64, count=len(neighbor_lists))
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+
+        edges = list(chain.from_iterable(neighbor_lists))
+        edge_count = len(edges)
+        neighbor_ids = np.fromiter(map(itemgetter(0), edges), dtype=ids.dtype if ids.dtype.kind != 'O' else object, count=edge_count)
+        lengths = np.fromiter(map(itemgetter(1), edges), dtype=np.float64, count=edge_count)
+        segment_ids = np.fromiter(map(itemgetter(2), edges), dtype=np.int64, count=edge_count)
+
+        graph = JunctionGraph(ids, offsets, np.zeros(edge_count, dtype=np.int32), lengths, segment_ids)
+        graph.targets = graph.indices_of(neighbor_ids)
+        return graph
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def edge_count(self) -> int:
+        """The number of edges. Each street between two junctions is an edge in both directions."""
+        return len(self.targets)
+
+    def network_hash(self) -> str:
+        """Get a hash of the edges that changes if any edge, its length or the order of the nodes changes
+
+        Results that only depend on the network, eg. saved neighborhoods, can be reused while the hash stays the same.
+
+        Returns:
+            str: The hash as hex
+        """
+        digest = hashlib.sha256()
+        digest.update(self.offsets.tobytes())
+        digest.update(np.ascontiguousarray(self.targets).tobytes())
+        digest.update(np.ascontiguousarray(self.lengths).tobytes())
+        return digest.hexdigest()
+
+    def index_of(self, junction_id: Any) -> int:
+        """Get the node of a junction
+
+        Args:
+            junction_id (Any): The id of the junction
+
+        Returns:
+            int: The node
+        """
+        if self._index == None:
+            self._index = { junction_id: i for i, junction_id in enumerate(self.ids.tolist()) }
+        if junction_id not in self._index:
+            raise Exception(f"There is no junction with id {junction_id} in the graph")
+        return self._index[junction_id]
+
+    def indices_of(self, junction_ids: Sequence[Any] | np.ndarray) -> np.ndarray:
+        """Get the nodes of many junctions at once
+
+        Args:
+            junction_ids (Sequence[Any] | np.ndarray): The ids of the junctions
+
+        Returns:
+            np.ndarray: The nodes as int32
+        """
+        junction_ids = np.asarray(junction_ids)
+        if self.ids.dtype.kind in 'iu' and junction_ids.dtype.kind in 'iu':
+            order = np.argsort(self.ids, kind='stable')
+            found = np.minimum(np.searchsorted(self.ids, junction_ids, sorter=order), max(len(order) - 1, 0))
+            missing = np.flatnonzero(self.ids[order[found]] != junction_ids) if len(order) > 0 else np.arange(len(junction_ids))
+            if len(missing) > 0:
+                raise Exception(f"There is no junction with id {junction_ids[missing[0]]} in the graph")
+            return order[found].astype(np.int32)
+        return np.fromiter(map(self.index_of, junction_ids.tolist()), dtype=np.int32, count=len(junction_ids))
+
+    def neighbors(self, node: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Get the edges leaving a node
+
+        Args:
+            node (int): The node
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: The nodes they lead to, their lengths and their segment ids
+        """
+        start, end = self.offsets[node], self.offsets[node + 1]
+        return self.targets[start:end], self.lengths[start:end], self.segment_ids[start:end]
+
+    def neighborhood(self, source: int, limit: float = float('inf')) -> tuple[np.ndarray, np.ndarray]:
+        """Find every node within [limit] meters of [source] along the network with Dijkstra's algorithm
+
+        The search is bounded: a node is only put on the queue if it is within the limit and closer than it has been reached
+        before, so the search never grows past the limit and there is at most one queued entry per improvement. Searches
+        should not be run from several threads at once on the same graph.
+
+        Args:
+            source (int): The node to start from
+            limit (float, optional): The maximum distance (inclusive). Defaults to float('inf').
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The nodes in the order they are reached, starting with [source], and their distances
+        """
+        if self._search_lists == None:
+            self._search_lists = (self.offsets.tolist(), self.targets.tolist(), self.lengths.tolist(), [float('inf')] * len(self))
+        offsets, targets, lengths, best = self._search_lists
+
+        nodes = []
+        distances = []
+        best[source] = 0.0
+        queue = [(0.0, source)]
+        try:
+            while queue:
+                dst, node = heappop(queue)
+                # Skip entries for nodes that were reached by a shorter path after they were queued
+                if dst > best[node]: continue
+
+                nodes.append(node)
+                distances.append(dst)
+                # Settled nodes get a negative best distance so they are never queued or settled again
+                best[node] = -1.0
+                for edge in range(offsets[node], offsets[node + 1]):
+                    neighbor = targets[edge]
+                    neighbor_dst = dst + lengths[edge]
+                    if neighbor_dst <= limit and neighbor_dst < best[neighbor]:
+                        best[neighbor] = neighbor_dst
+                        heappush(queue, (neighbor_dst, neighbor))
+        finally:
+            # Only the nodes that were touched need to be reset for the next search
+            for node in nodes:
+                best[node] = float('inf')
+            for _, node in queue:
+                best[node] = float('inf')
+
+        return np.array(nodes, dtype=np.int32), np.array(distances, dtype=np.float64)
+
+    def degrees(self) -> np.ndarray:
+        """Get the number of edges leaving each node"""
+        return np.diff(self.offsets)
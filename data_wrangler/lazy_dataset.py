@@ -0,0 +1,292 @@
+from __future__ import annotations
+
+from copy import copy
+
+from typing import Any
+from typing import Callable
+from typing import TYPE_CHECKING
+from collections.abc import Iterable
+
+from .conversion_functions import Row
+from .conversion_functions import ConversionFunction
+from .predicates import Expression
+
+if TYPE_CHECKING:
+    from .dataset import Dataset
+
+# An operation is a tuple whose first item is its type:
+#   ('convert', column, function)
+#   ('filter', function, columns read by the function or None if unknown)
+#   ('add', column, kwargs of add_property)
+#   ('drop', column)
+#   ('select', columns to keep)
+#   ('pipe', function given the whole dataset)
+Operation = tuple
+
+
+class LazyDataset:
+    """Records operations on a Dataset and runs them together when collect() is called
+
+    Created with Dataset.lazy(). Consecutive row operations are fused so every row is visited once instead of once per operation.
+    Before running, the recorded operations are optimized:
+
+    - Filters that declare the columns they read are moved ahead of conversions, and new properties, that do not change those columns.
+    - Conversions of columns that are removed by drop or select before anything reads them are skipped.
+
+    Operations that need the whole dataset, like match_lat_lng, split the work into separate passes.
+
+    Example::
+
+        crime.lazy() \\
+            .convert_properties({ 'id': int, 'latitude': float, 'longitude': float }) \\
+            .filter((col('latitude') != 0) | (col('longitude') != 0)) \\
+            .match_lat_lng(junctions, 'junction_id', 'junction_dst', distance_limit=200) \\
+            .filter(lambda row: row['junction_id'] != 0, columns=['junction_id']) \\
+            .write_to_file(OUTPUT_FILE)
+    """
+
+    def __init__(self, dataset: Dataset):
+        self._dataset = dataset
+        self._operations: list[Operation] = []
+
+    def convert_property(self, field_name: str, conversion: ConversionFunction) -> LazyDataset:
+        """Record Dataset.convert_property"""
+        self._operations.append(('convert', field_name, conversion))
+        return self
+
+    def convert_properties(self, conversions: dict[str, ConversionFunction]) -> LazyDataset:
+        """Record Dataset.convert_properties"""
+        for field_name, conversion in conversions.items():
+            self.convert_property(field_name, conversion)
+        return self
+
+    def filter(self, filter: Callable[[Row], bool] | Expression, columns: Iterable[str] | None = None) -> LazyDataset:
+        """Record Dataset.filter
+
+        Args:
+            filter (Callable[[Row], bool] | Expression): The filter function or expression
+            columns (Iterable[str] | None, optional): The columns that the filter reads. Filters are only reordered if this is given.
+                Defaults to None, or the columns of the expression if filter is an expression built with col().
+        """
+        if columns == None and isinstance(filter, Expression):
+            columns = filter.columns
+        self._operations.append(('filter', filter, None if columns == None else set(columns)))
+        return self
+
+    def add_property(self, name: str, **kwargs) -> LazyDataset:
+        """Record Dataset.add_property"""
+        self._operations.append(('add', name, kwargs))
+        return self
+
+    def drop(self, property_name: str) -> LazyDataset:
+        """Record Dataset.drop"""
+        self._operations.append(('drop', property_name))
+        return self
+
+    def select(self, columns: Iterable[str]) -> LazyDataset:
+        """Keep only [columns]. The primary key is always kept.
+
+        Args:
+            columns (Iterable[str]): The columns to keep
+        """
+        self._operations.append(('select', set(columns) | { self._dataset.primary_key }))
+        return self
+
+    def pipe(self, func: Callable[[Dataset], Any]) -> LazyDataset:
+        """Record an operation that needs the whole dataset
+
+        Args:
+            func (Callable[[Dataset], Any]): The function to run on the dataset. Its return value is ignored.
+        """
+        self._operations.append(('pipe', func))
+        return self
+
+    def match_lat_lng(self, *args, **kwargs) -> LazyDataset:
+        """Record Dataset.match_lat_lng"""
+        return self.pipe(lambda dataset: dataset.match_lat_lng(*args, **kwargs))
+
+    def match_lat_lng_custom(self, *args, **kwargs) -> LazyDataset:
+        """Record Dataset.match_lat_lng_custom"""
+        return self.pipe(lambda dataset: dataset.match_lat_lng_custom(*args, **kwargs))
+
+    def spatial_aggregate(self, *args, **kwargs) -> LazyDataset:
+        """Record Dataset.spatial_aggregate"""
+        return self.pipe(lambda dataset: dataset.spatial_aggregate(*args, **kwargs))
+
+    def match_segments(self, *args, **kwargs) -> LazyDataset:
+        """Record Dataset.match_segments"""
+        return self.pipe(lambda dataset: dataset.match_segments(*args, **kwargs))
+
+    def collect(self) -> Dataset:
+        """Run the recorded operations
+
+        The operations are applied to the dataset that lazy() was called on, in place.
+
+        Returns:
+            Dataset: The dataset
+        """
+        operations = LazyDataset._optimize(self._operations)
+        self._operations = []
+
+        stage = []
+        for operation in operations:
+            if operation[0] == 'pipe':
+                self._run_stage(stage)
+                stage = []
+                operation[1](self._dataset)
+            else:
+                stage.append(operation)
+        self._run_stage(stage)
+
+        return self._dataset
+
+    def write_to_file(self, filename: str, *args, **kwargs):
+        """Run the recorded operations and write the result with Dataset.write_to_file"""
+        self.collect().write_to_file(filename, *args, **kwargs)
+
+    def _run_stage(self, operations: list[Operation]):
+        """Run row operations on the dataset
+
+        Row datasets are processed in a single pass over the rows. Columnar datasets run each operation on whole columns instead.
+        """
+        if len(operations) == 0: return
+        dataset = self._dataset
+
+        from .columnar_dataset import ColumnarDataset
+        if isinstance(dataset, ColumnarDataset):
+            for operation in operations:
+                LazyDataset._run_eager(dataset, operation)
+            return
+
+        primary_key = dataset.primary_key
+        keep = []
+        for row in dataset:
+            for operation in operations:
+                kind = operation[0]
+                if kind == 'convert':
+                    row[operation[1]] = operation[2](row[operation[1]])
+                elif kind == 'filter':
+                    if not operation[1](row): break
+                elif kind == 'add':
+                    LazyDataset._add_value(row, operation[1], operation[2])
+                elif kind == 'drop':
+                    del row[operation[1]]
+                elif kind == 'select':
+                    for key in [key for key in row if key not in operation[1]]:
+                        del row[key]
+            else:
+                keep.append(row)
+
+        keys = [row[primary_key] for row in keep]
+        if len(set(keys)) != len(keys):
+            raise Exception("Conversion resulted in non unique primary key")
+        dataset._rows = dict(zip(keys, keep))
+        
+        for operation in operations:
+            if operation[0] == 'drop':
+                dataset._indexes.pop(operation[1], None)
+            elif operation[0] == 'select':
+                for column in [column for column in dataset._indexes if column not in operation[1]]:
+                    del dataset._indexes[column]
+        dataset._rebuild_indexes()
+
+    @staticmethod
+    def _add_value(row: Row, name: str, kwargs: dict[str, Any]):
+        """Set the value of a new property in a single row the same way add_property does"""
+        if name in row:
+            raise Exception(f"Cannot add property {name} because it already exists in the dataset.")
+
+        if "value" in kwargs:
+            row[name] = copy(kwargs["value"])
+        elif "func" in kwargs:
+            row[name] = kwargs["func"](row)
+        else:
+            row[name] = 0
+
+    @staticmethod
+    def _run_eager(dataset: Dataset, operation: Operation):
+        """Run a single row operation with the normal Dataset method"""
+        kind = operation[0]
+        if kind == 'convert':
+            dataset.convert_property(operation[1], operation[2])
+        elif kind == 'filter':
+            dataset.filter(operation[1])
+        elif kind == 'add':
+            dataset.add_property(operation[1], **operation[2])
+        elif kind == 'drop':
+            dataset.drop(operation[1])
+        elif kind == 'select':
+            for name in dataset.get_column_names():
+                if name not in operation[1]:
+                    dataset.drop(name)
+
+    @staticmethod
+    def _optimize(operations: list[Operation]) -> list[Operation]:
+        """Reorder filters ahead of conversions and remove conversions that are never used
+
+        Args:
+            operations (list[Operation]): The recorded operations
+
+        Returns:
+            list[Operation]: The operations to run
+        """
+        return LazyDataset._remove_dead_conversions(LazyDataset._push_filters(operations))
+
+    @staticmethod
+    def _push_filters(operations: list[Operation]) -> list[Operation]:
+        """Move each filter with known columns ahead of the conversions and new properties that do not affect those columns"""
+        result: list[Operation] = []
+        for operation in operations:
+            position = len(result)
+            if operation[0] == 'filter' and operation[2] != None:
+                while position > 0:
+                    previous = result[position - 1]
+                    if previous[0] not in ('convert', 'add') or previous[1] in operation[2]: break
+                    position -= 1
+            result.insert(position, operation)
+        return result
+
+    @staticmethod
+    def _remove_dead_conversions(operations: list[Operation]) -> list[Operation]:
+        """Remove conversions of columns that are dropped before anything reads them"""
+        # Walking backwards, either every column except those in dead is read later (live_all)
+        # or only the columns in live are read later
+        live_all = True
+        dead: set[str] = set()
+        live: set[str] = set()
+        result: list[Operation] = []
+
+        for operation in reversed(operations):
+            kind = operation[0]
+            if kind == 'convert':
+                if (operation[1] in dead) if live_all else (operation[1] not in live): continue
+            elif kind == 'filter':
+                if operation[2] == None:
+                    live_all, dead = True, set()
+                elif live_all:
+                    dead -= operation[2]
+                else:
+                    live |= operation[2]
+            elif kind == 'add':
+                if "func" in operation[2]:
+                    live_all, dead = True, set()
+                elif live_all:
+                    dead.add(operation[1])
+                else:
+                    live.discard(operation[1])
+            elif kind == 'drop':
+                if live_all:
+                    dead.add(operation[1])
+                else:
+                    live.discard(operation[1])
+            elif kind == 'select':
+                if live_all:
+                    live_all, live = False, operation[1] - dead
+                else:
+                    live &= operation[1]
+            elif kind == 'pipe':
+                live_all, dead = True, set()
+            result.append(operation)
+
+        result.reverse()
+        return result
@@ -0,0 +1,49 @@
+import os
+import multiprocessing
+
+from typing import Any
+from typing import Callable
+from collections.abc import Iterable
+
+# The task of a worker process. Set by _start_worker in each worker, never in the process that calls parallel_map, so calls
+# from several threads at once do not share them.
+_task: Callable[[Any], Any] | None = None
+_items: list[Any] = []
+
+
+def parallel_map(func: Callable[[Any], Any], items: Iterable[Any], workers: int | None = None) -> list[Any]:
+    """Call func on each item in a pool of worker processes
+
+    The workers are forked so func and the items do not need to be picklable, which means lambdas and conversion maps can be
+    used. Only the return values are sent back to this process.
+
+    The items are processed in this process instead if there is only one item or worker, if fork is not available (eg. on
+    Windows), or if this is already running in a worker.
+
+    Args:
+        func (Callable[[Any], Any]): The function to call
+        items (Iterable[Any]): The items to call it on
+        workers (int | None, optional): The number of processes to use. Defaults to None which uses one per cpu.
+
+    Returns:
+        list[Any]: The results in the same order as the items
+    """
+    items = list(items)
+
+    if workers == None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(items))
+
+    if workers <= 1 or 'fork' not in multiprocessing.get_all_start_methods() or multiprocessing.current_process().daemon:
+        return [func(item) for item in items]
+
+    # The workers are forked so the initializer arguments are inherited instead of being pickled
+    with multiprocessing.get_context('fork').Pool(workers, initializer=_start_worker, initargs=(func, items)) as pool:
+        return pool.map(_run_task, range(len(items)), chunksize=1)
+
+def _start_worker(func: Callable[[Any], Any], items: list[Any]):
+    global _task, _items
+    _task, _items = func, items
+
+def _run_task(index: int) -> Any:
+    return _task(_items[index]) # type: ignore
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import operator
+
+from typing import Any
+from typing import Callable
+from typing import TYPE_CHECKING
+from collections.abc import Iterable
+
+import numpy as np
+
+from .conversion_functions import Row
+
+if TYPE_CHECKING:
+    from .dataset import Dataset
+
+
+class Expression:
+    """A value computed from the properties of a row
+
+    Expressions are built with col() and comparison operators, eg. col('junction_id') != 0 or col('category').isin(['A', 'B']),
+    and combined with & (and), | (or) and ~ (not). Values can also be computed with +, -, * and /. They can be evaluated for a single row like a normal filter function, or for
+    a whole dataset at once with mask(), which works on the columns as numpy arrays.
+    """
+
+    def __init__(self, columns: set[str], evaluate: Callable[[Callable[[str], np.ndarray]], Any], evaluate_row: Callable[[Row], Any]):
+        """ Create an expression. Use col() instead of calling this directly.
+
+        Args:
+            columns (set[str]): The names of the properties the expression reads
+            evaluate (Callable[[Callable[[str], np.ndarray]], Any]): Computes the values for a dataset given a function that returns a column
+            evaluate_row (Callable[[Row], Any]): Computes the value for a single row
+        """
+        self.columns = columns
+        self._evaluate = evaluate
+        self._evaluate_row = evaluate_row
+
+    def __call__(self, row: Row) -> Any:
+        return self._evaluate_row(row)
+
+    def mask(self, dataset: Dataset) -> np.ndarray:
+        """Evaluate the expression for every row of a dataset at once
+
+        Args:
+            dataset (Dataset): The dataset
+
+        Returns:
+            np.ndarray: A boolean array with one value per row, in row order
+        """
+        return np.asarray(self.values(dataset), dtype=np.bool_)
+
+    def values(self, dataset: Dataset) -> np.ndarray:
+        """Evaluate the expression for every row of a dataset at once without converting the result to booleans
+
+        eg: (col('crime_likelihood') * (col('crime_type') == 1)).values(observations)
+
+        Args:
+            dataset (Dataset): The dataset
+
+        Returns:
+            np.ndarray: One value per row, in row order
+        """
+        if len(dataset) == 0: return np.zeros(0)
+
+        # Only get each column from the dataset once
+        columns: dict[str, np.ndarray] = {}
+        def get_column(name: str) -> np.ndarray:
+            if name not in columns:
+                columns[name] = dataset.get_column(name)
+            return columns[name]
+
+        result = np.asarray(self._evaluate(get_column))
+        return np.broadcast_to(result, (len(dataset),))
+
+    def __bool__(self):
+        raise TypeError("Expressions can not be used as booleans. Use & and | instead of 'and' and 'or'.")
+
+    def isin(self, values: Iterable[Any]) -> Expression:
+        """Check whether the value is one of [values]
+
+        Args:
+            values (Iterable[Any]): The accepted values
+
+        Returns:
+            Expression: The check
+        """
+        accepted = set(values)
+
+        def evaluate(get_column):
+            column = self._evaluate(get_column)
+            if isinstance(column, np.ndarray) and column.dtype.kind != 'O':
+                return np.isin(column, list(accepted))
+            return np.fromiter((value in accepted for value in column), dtype=np.bool_, count=len(column))
+
+        return Expression(self.columns, evaluate, lambda row: self(row) in accepted)
+
+    def _binary(self, other: Any, op: Callable[[Any, Any], Any], vector_op: Callable[[Any, Any], Any] | None = None) -> Expression:
+        """Create an expression that combines this expression with another expression or a constant"""
+        vector_op = vector_op or op
+        if isinstance(other, Expression):
+            return Expression(
+                self.columns | other.columns,
+                lambda get_column: vector_op(self._evaluate(get_column), other._evaluate(get_column)),
+                lambda row: op(self(row), other(row))
+            )
+        return Expression(
+            self.columns,
+            lambda get_column: vector_op(self._evaluate(get_column), other),
+            lambda row: op(self(row), other)
+        )
+
+    def __eq__(self, other): return self._binary(other, operator.eq)                             # type: ignore
+    def __ne__(self, other): return self._binary(other, operator.ne)                             # type: ignore
+    def __lt__(self, other): return self._binary(other, operator.lt)
+    def __le__(self, other): return self._binary(other, operator.le)
+    def __gt__(self, other): return self._binary(other, operator.gt)
+    def __ge__(self, other): return self._binary(other, operator.ge)
+
+    def __add__(self, other): return self._binary(other, operator.add)
+    def __sub__(self, other): return self._binary(other, operator.sub)
+    def __mul__(self, other): return self._binary(other, operator.mul)
+    def __truediv__(self, other): return self._binary(other, operator.truediv)
+
+    # The row versions use python's and/or/not so that they work on plain bools
+    def __and__(self, other): return self._binary(other, lambda a, b: bool(a) and bool(b), np.logical_and)
+    def __or__(self, other): return self._binary(other, lambda a, b: bool(a) or bool(b), np.logical_or)
+
+    def __invert__(self):
+        return Expression(self.columns, lambda get_column: np.logical_not(self._evaluate(get_column)), lambda row: not self(row))
+
+    __hash__ = None # type: ignore
+
+
+def col(name: str) -> Expression:
+    """Refer to a property for use in a filter
+
+    eg: dataset.filter(col('junction_id') != 0)
+
+    Args:
+        name (str): The name of the property
+
+    Returns:
+        Expression: The expression
+    """
+    return Expression({ name }, lambda get_column: get_column(name), lambda row: row[name])
@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import os
+import json
+
+from typing import Callable
+from collections.abc import Sequence
+
+import numpy as np
+from scipy import sparse
+
+from .graph import JunctionGraph
+from . import parallel
+
+# A function of the network distance in meters that gives the share of a junction's weight that reaches the source.
+# It is called with a numpy array of distances.
+Kernel = Callable[[np.ndarray], np.ndarray]
+
+NEIGHBORHOOD_META_FILE = 'meta.json'
+NEIGHBORHOOD_FORMAT_VERSION = 1
+
+
+class Neighborhoods:
+    """The network distances from every junction to the junctions within a limit, stored as compressed sparse rows
+
+    The junctions within the limit of node i are nodes[offsets[i]:offsets[i + 1]], in the order they are reached, and
+    distances holds their network distances in meters. Each junction is in its own neighborhood at distance 0. Create
+    neighborhoods with network_neighborhoods.
+    """
+
+    def __init__(self, offsets: np.ndarray, nodes: np.ndarray, distances: np.ndarray, limit: float):
+        """ Create neighborhoods from their arrays
+
+        Args:
+            offsets (np.ndarray): The position of the first neighbor of each node, with the number of neighbors at the end
+            nodes (np.ndarray): The neighbor nodes
+            distances (np.ndarray): The network distance to each neighbor
+            limit (float): The maximum distance they were found with
+        """
+        if len(offsets) == 0 or offsets[-1] != len(nodes) or len(nodes) != len(distances):
+            raise Exception(f"The offsets of neighborhoods with {len(nodes)} nodes must end with {len(nodes)} and there must be a distance for each node")
+
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.nodes = np.asarray(nodes, dtype=np.int32)
+        self.distances = np.asarray(distances, dtype=np.float64)
+        self.limit = limit
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def save(self, directory: str, graph_hash: str):
+        """Save the neighborhoods to a directory as .npy files that can be memory mapped by load
+
+        Args:
+            directory (str): The directory to save to. Created if it does not exist.
+            graph_hash (str): The JunctionGraph.network_hash of the graph they were found in
+        """
+        os.makedirs(directory, exist_ok=True)
+        meta_path = os.path.join(directory, NEIGHBORHOOD_META_FILE)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+        # Each array is written to a new file that replaces the old one, so neighborhoods that were loaded from this directory
+        # keep their memory mapped files instead of having them changed underneath them
+        for name, values in (('offsets', self.offsets), ('nodes', self.nodes), ('distances', self.distances)):
+            path = os.path.join(directory, f'{name}.npy')
+            with open(f'{path}.tmp', 'wb') as array_file:
+                np.save(array_file, values)
+            os.replace(f'{path}.tmp', path)
+
+        # The meta file is written last so a partially written directory is never treated as valid
+        with open(meta_path, 'w', encoding='utf-8') as meta_file:
+            json.dump({
+                'version': NEIGHBORHOOD_FORMAT_VERSION, 'hash': graph_hash, 'limit': self.limit, 'count': len(self)
+            }, meta_file)
+
+    @staticmethod
+    def saved_key(directory: str) -> tuple[str, float] | None:
+        """Get the graph hash and limit of the neighborhoods saved in a directory
+
+        Args:
+            directory (str): The directory the neighborhoods were saved to
+
+        Returns:
+            tuple[str, float] | None: The hash and limit, or None if there are no usable neighborhoods in the directory
+        """
+        try:
+            with open(os.path.join(directory, NEIGHBORHOOD_META_FILE), 'r', encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+        except (OSError, ValueError):
+            return None
+        if meta.get('version') != NEIGHBORHOOD_FORMAT_VERSION:
+            return None
+        return meta.get('hash'), meta.get('limit')
+
+    @staticmethod
+    def load(directory: str, mmap=True) -> Neighborhoods:
+        """Load neighborhoods saved with save
+
+        Args:
+            directory (str): The directory to load from
+            mmap (bool, optional): Whether to memory map the arrays instead of reading them. Defaults to True.
+
+        Returns:
+            Neighborhoods: The neighborhoods
+        """
+        key = Neighborhoods.saved_key(directory)
+        if key == None:
+            raise Exception(f"There are no neighborhoods saved in {directory}")
+
+        mmap_mode = 'r' if mmap else None
+        return Neighborhoods(
+            np.load(os.path.join(directory, 'offsets.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(directory, 'nodes.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(directory, 'distances.npy'), mmap_mode=mmap_mode),
+            key[1]
+        )
+
+    def matrix(self, kernel: Kernel | None = None) -> sparse.csr_matrix:
+        """Get the neighborhoods as a sparse (number of junctions, number of junctions) matrix
+
+        Args:
+            kernel (Kernel | None, optional): A function to apply to every distance. Defaults to None which keeps the distances.
+
+        Returns:
+            sparse.csr_matrix: The matrix with the (kernel of the) distance from junction i to junction j at (i, j)
+        """
+        values = self.distances if kernel == None else np.asarray(kernel(self.distances), dtype=np.float64)
+        # The distance of each junction to itself is an explicit 0 so the kernel is applied to it
+        return sparse.csr_matrix((values, self.nodes, self.offsets), shape=(len(self), len(self)))
+
+    def reaches(self, weights: dict[str, Sequence[float] | np.ndarray], kernels: dict[str, Kernel]) -> np.ndarray:
+        """Calculate the reach of every junction for each weight
+
+        The kernel matrix is built once for each distinct kernel and all the weights that use it are done with one sparse
+        matrix product, so adding a weight costs one more column rather than another search of the network.
+
+        Args:
+            weights (dict[str, Sequence[float] | np.ndarray]): The weight of each junction, in node order, for each reach
+            kernels (dict[str, Kernel]): The kernel for each reach. Must have the same keys as weights.
+
+        Returns:
+            np.ndarray: A (number of junctions, number of reaches) array with the reaches in the order of weights
+        """
+        if set(weights) != set(kernels):
+            raise Exception(f"There must be a kernel for each weight. Weights: {', '.join(weights)}. Kernels: {', '.join(kernels)}")
+
+        names = list(weights)
+        weight_matrix = np.column_stack([np.asarray(weights[name], dtype=np.float64) for name in names]) if names else np.zeros((len(self), 0))
+        if len(weight_matrix) != len(self):
+            raise Exception(f"There must be a weight for each of the {len(self)} junctions, not {len(weight_matrix)}")
+
+        # Group the reaches that share a kernel
+        columns_by_kernel: dict[int, list[int]] = {}
+        for column, name in enumerate(names):
+            columns_by_kernel.setdefault(id(kernels[name]), []).append(column)
+
+        reaches = np.zeros((len(self), len(names)))
+        for columns in columns_by_kernel.values():
+            kernel_matrix = self.matrix(kernels[names[columns[0]]])
+            reaches[:, columns] = kernel_matrix @ weight_matrix[:, columns]
+        return reaches
+
+
+def network_neighborhoods(
+    graph: JunctionGraph, limit: float = float('inf'), workers: int | None = None, cache_directory: str | None = None
+) -> Neighborhoods:
+    """Find the junctions within [limit] meters along the network of every junction
+
+    Every junction is independent so the junctions are split into shards that are run by a pool of worker processes. The
+    workers are forked so they share the graph with this process instead of receiving a copy, and only the neighborhoods are
+    sent back.
+
+    With a cache directory the neighborhoods are also saved to disk, eg. junctions.neighborhoods next to junctions.csv, so
+    later runs memory map them instead of searching the network. The saved neighborhoods are only used if they were found
+    with the same limit in a graph with the same JunctionGraph.network_hash, otherwise they are found again and replaced.
+
+    Args:
+        graph (JunctionGraph): The network
+        limit (float, optional): The maximum network distance in meters. Defaults to float('inf').
+        workers (int | None, optional): The number of processes to use. None uses one per cpu. Defaults to None.
+        cache_directory (str | None, optional): The directory to save the neighborhoods to and load them from. Defaults to None.
+
+    Returns:
+        Neighborhoods: The neighborhood of every junction
+    """
+    if cache_directory != None:
+        graph_hash = graph.network_hash()
+        if Neighborhoods.saved_key(cache_directory) == (graph_hash, limit):
+            return Neighborhoods.load(cache_directory)
+
+        neighborhoods = network_neighborhoods(graph, limit, workers)
+        neighborhoods.save(cache_directory, graph_hash)
+        return neighborhoods
+
+    def neighborhood_shard(shard: range) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        counts = np.zeros(len(shard), dtype=np.int64)
+        shard_nodes = []
+        shard_distances = []
+        for row, source in enumerate(shard):
+            nodes, distances = graph.neighborhood(source, limit)
+            counts[row] = len(nodes)
+            shard_nodes.append(nodes)
+            shard_distances.append(distances)
+        if len(shard_nodes) == 0:
+            return counts, np.zeros(0, dtype=np.int32), np.zeros(0)
+        return counts, np.concatenate(shard_nodes), np.concatenate(shard_distances)
+
+    # Use a few shards per worker so that slow shards do not hold up the others
+    shard_count = 4 * (workers or os.cpu_count() or 1)
+    shard_size = max(1, -(-len(graph) // shard_count))
+    shards = [range(start, min(start + shard_size, len(graph))) for start in range(0, len(graph), shard_size)]
+
+    results = parallel.parallel_map(neighborhood_shard, shards, workers)
+    if len(results) == 0:
+        return Neighborhoods(np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0), limit)
+
+    counts, nodes, distances = (np.concatenate(arrays) for arrays in zip(*results))
+    return Neighborhoods(np.concatenate(([0], np.cumsum(counts))), nodes, distances, limit)
+
+def compute_reaches(
+    graph: JunctionGraph, weights: dict[str, Sequence[float] | np.ndarray], kernels: dict[str, Kernel], limit: float = float('inf'),
+    workers: int | None = None, cache_directory: str | None = None
+) -> np.ndarray:
+    """Calculate the reach of every junction
+
+    The reach of a junction for a weight is the sum over every junction within [limit] meters along the network of its weight
+    times the kernel of its network distance, including the junction itself at distance 0.
+
+    The network is only searched once, by network_neighborhoods, and all the reaches are then computed from the
+    neighborhoods with sparse matrix products. Keep the neighborhoods and use Neighborhoods.reaches directly to compute more
+    reaches with the same limit.
+
+    Args:
+        graph (JunctionGraph): The network
+        weights (dict[str, Sequence[float] | np.ndarray]): The weight of each junction, in node order, for each reach
+        kernels (dict[str, Kernel]): The kernel for each reach. Must have the same keys as weights.
+        limit (float, optional): The maximum network distance in meters. Defaults to float('inf').
+        workers (int | None, optional): The number of processes to use for the search. None uses one per cpu. Defaults to None.
+        cache_directory (str | None, optional): The directory to save the neighborhoods to and load them from, see network_neighborhoods. Defaults to None.
+
+    Returns:
+        np.ndarray: A (number of junctions, number of reaches) array with the reaches in the order of weights
+    """
+    if set(weights) != set(kernels):
+        raise Exception(f"There must be a kernel for each weight. Weights: {', '.join(weights)}. Kernels: {', '.join(kernels)}")
+    return network_neighborhoods(graph, limit, workers, cache_directory).reaches(weights, kernels)
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import math
+
+from collections.abc import Sequence
+
+import numpy as np
+
+
+class SegmentRTree:
+    """A packed R-tree over straight line segments in projected coordinates, eg. UTM eastings and northings in metres
+
+    The tree is built once with Sort-Tile-Recursive packing: the segments are sorted into vertical slices by the x coordinate
+    of their centres, each slice is sorted by y and every [node_size] consecutive segments become a node. The nodes are packed
+    the same way until there is a single root. Every node is full except the last one of each level, so the tree is shallow and
+    its bounding boxes overlap very little.
+
+    Queries walk the tree one level at a time for all of the query points at once, so the work is done in numpy instead of a
+    python loop per point. Segments with a missing (nan) coordinate are never returned.
+    """
+
+    def __init__(
+        self,
+        start_x: Sequence[float] | np.ndarray, start_y: Sequence[float] | np.ndarray,
+        end_x: Sequence[float] | np.ndarray, end_y: Sequence[float] | np.ndarray,
+        node_size: int = 16
+    ):
+        """ Build the tree
+
+        Args:
+            start_x (Sequence[float] | np.ndarray): The x coordinates of the start of each segment
+            start_y (Sequence[float] | np.ndarray): The y coordinates of the start of each segment
+            end_x (Sequence[float] | np.ndarray): The x coordinates of the end of each segment
+            end_y (Sequence[float] | np.ndarray): The y coordinates of the end of each segment
+            node_size (int, optional): The number of children of each node. Defaults to 16.
+        """
+        if node_size < 2:
+            raise Exception(f"The node size of an R-tree must be at least 2 not {node_size}")
+
+        # Copied so the tree does not change if the columns it was built from are edited
+        self.start_x = np.array(start_x, dtype=np.float64)
+        self.start_y = np.array(start_y, dtype=np.float64)
+        self.end_x = np.array(end_x, dtype=np.float64)
+        self.end_y = np.array(end_y, dtype=np.float64)
+        self.node_size = node_size
+
+        valid = np.isfinite(self.start_x) & np.isfinite(self.start_y) & np.isfinite(self.end_x) & np.isfinite(self.end_y)
+        positions = np.flatnonzero(valid)
+        boxes = np.column_stack((
+            np.minimum(self.start_x, self.end_x), np.minimum(self.start_y, self.end_y),
+            np.maximum(self.start_x, self.end_x), np.maximum(self.start_y, self.end_y)
+        ))[valid]
+
+        # The leaves are the segments themselves in packed order
+        order = self._str_order(boxes)
+        self._positions = positions[order]
+        self._boxes = [boxes[order]]
+        self._child_starts: list[np.ndarray] = []
+        self._child_counts: list[np.ndarray] = []
+
+        while len(self._boxes[-1]) > 1:
+            children = self._boxes[-1]
+            starts = np.arange(0, len(children), node_size)
+            parents = np.column_stack((
+                np.minimum.reduceat(children[:, 0], starts), np.minimum.reduceat(children[:, 1], starts),
+                np.maximum.reduceat(children[:, 2], starts), np.maximum.reduceat(children[:, 3], starts)
+            ))
+            counts = np.diff(np.append(starts, len(children)))
+
+            # The parents can be reordered freely because each one keeps the range of its children
+            order = self._str_order(parents)
+            self._boxes.append(parents[order])
+            self._child_starts.append(starts[order])
+            self._child_counts.append(counts[order])
+
+    def __len__(self):
+        return len(self.start_x)
+
+    def _str_order(self, boxes: np.ndarray) -> np.ndarray:
+        """Get the Sort-Tile-Recursive order of boxes, which groups boxes that are close together into runs of node_size"""
+        if len(boxes) == 0: return np.zeros(0, dtype=np.intp)
+
+        centre_x = boxes[:, 0] + boxes[:, 2]
+        centre_y = boxes[:, 1] + boxes[:, 3]
+        slice_count = math.ceil(math.sqrt(math.ceil(len(boxes) / self.node_size)))
+        slice_size = slice_count * self.node_size
+
+        ranks = np.empty(len(boxes), dtype=np.intp)
+        ranks[np.argsort(centre_x, kind='stable')] = np.arange(len(boxes))
+        return np.lexsort((centre_y, ranks // slice_size))
+
+    def nearest(
+        self, x: Sequence[float] | np.ndarray, y: Sequence[float] | np.ndarray, distance_limit: float = float('inf')
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Find the closest segment to each of the query points that is strictly closer than distance_limit
+
+        Ties go to the segment with the lowest position, eg. for a point closest to a junction shared by several segments.
+
+        Args:
+            x (Sequence[float] | np.ndarray): The x coordinates of the query points
+            y (Sequence[float] | np.ndarray): The y coordinates of the query points
+            distance_limit (float, optional): The maximum distance. Defaults to float('inf').
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: The position of the closest segment for each query point, or -1 if there
+                is no match, the distance to it and the offset of the closest point on it from the start of the segment
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        positions = np.full(len(x), -1, dtype=np.intp)
+        distances = np.zeros(len(x), dtype=np.float64)
+        offsets = np.zeros(len(x), dtype=np.float64)
+        if len(x) == 0 or len(self._positions) == 0: return positions, distances, offsets
+
+        queried = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+        query_x, query_y = x[queried], y[queried]
+
+        # Pairs of (query point, node) that could contain the closest segment, starting from the root
+        pair_points = np.arange(len(queried))
+        pair_nodes = np.zeros(len(queried), dtype=np.intp)
+
+        # The squared distance that the closest segment of each point is known to be within. Every node contains a segment
+        # so the distance to the far corner of any node is a bound.
+        bounds = np.full(len(queried), distance_limit * distance_limit, dtype=np.float64)
+
+        for level in range(len(self._child_starts) - 1, -1, -1):
+            counts = self._child_counts[level][pair_nodes]
+            first_children = np.repeat(self._child_starts[level][pair_nodes] - (np.cumsum(counts) - counts), counts)
+            pair_nodes = first_children + np.arange(len(first_children))
+            pair_points = np.repeat(pair_points, counts)
+
+            boxes = self._boxes[level][pair_nodes]
+            px, py = query_x[pair_points], query_y[pair_points]
+            near_x = np.maximum(np.maximum(boxes[:, 0] - px, px - boxes[:, 2]), 0)
+            near_y = np.maximum(np.maximum(boxes[:, 1] - py, py - boxes[:, 3]), 0)
+            far_x = np.maximum(px - boxes[:, 0], boxes[:, 2] - px)
+            far_y = np.maximum(py - boxes[:, 1], boxes[:, 3] - py)
+            np.minimum.at(bounds, pair_points, far_x * far_x + far_y * far_y)
+
+            keep = near_x * near_x + near_y * near_y <= bounds[pair_points]
+            pair_points, pair_nodes = pair_points[keep], pair_nodes[keep]
+
+        segments = self._positions[pair_nodes]
+        pair_distances, pair_offsets = self._distance_to_segments(query_x[pair_points], query_y[pair_points], segments)
+
+        matched = pair_distances < distance_limit
+        pair_points, segments = pair_points[matched], segments[matched]
+        pair_distances, pair_offsets = pair_distances[matched], pair_offsets[matched]
+
+        # The first pair of each point after sorting is its closest segment
+        order = np.lexsort((segments, pair_distances, pair_points))
+        first = order[np.flatnonzero(np.diff(pair_points[order], prepend=-1))]
+
+        points = queried[pair_points[first]]
+        positions[points] = segments[first]
+        distances[points] = pair_distances[first]
+        offsets[points] = pair_offsets[first]
+        return positions, distances, offsets
+
+    def _distance_to_segments(self, x: np.ndarray, y: np.ndarray, segments: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Get the distance from each point to its segment and the offset of the closest point on the segment from its start"""
+        start_x, start_y = self.start_x[segments], self.start_y[segments]
+        dx, dy = self.end_x[segments] - start_x, self.end_y[segments] - start_y
+        length_squared = dx * dx + dy * dy
+
+        # The fraction of the way along the segment of the closest point. Segments with no length are treated as their start.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(length_squared > 0, ((x - start_x) * dx + (y - start_y) * dy) / length_squared, 0)
+        t = np.clip(t, 0, 1)
+
+        return np.hypot(x - (start_x + t * dx), y - (start_y + t * dy)), t * np.sqrt(length_squared)
@@ -0,0 +1,518 @@
+from __future__ import annotations
+
+import os
+import json
+import math
+import pickle
+import hashlib
+
+from typing import TYPE_CHECKING
+from collections.abc import Sequence
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from .distance import EARTH_RADIUS_METRES
+from .distance import haversine_metres
+from .distance import haversine_matrix
+
+if TYPE_CHECKING:
+    from .dataset import Dataset
+
+# Chord lengths closer than this (relative) are treated as ties and resolved with the exact haversine distance
+_TIE_TOLERANCE = 1e-9
+
+INDEX_META_FILE = 'meta.json'
+INDEX_FORMAT_VERSION = 1
+
+
+def to_unit_vectors(latitudes: Sequence[float] | np.ndarray, longitudes: Sequence[float] | np.ndarray) -> np.ndarray:
+    """Convert latitudes and longitudes in degrees to points on the unit sphere
+
+    The straight line (chord) distance between two of the points only depends on the great circle distance between them, so
+    the closest point by chord distance is also the closest point by haversine distance.
+
+    Args:
+        latitudes (Sequence[float] | np.ndarray): The latitudes in degrees
+        longitudes (Sequence[float] | np.ndarray): The longitudes in degrees
+
+    Returns:
+        np.ndarray: An (n, 3) array of x, y, z coordinates
+    """
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lng = np.radians(np.asarray(longitudes, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lng), cos_lat * np.sin(lng), np.sin(lat)))
+
+def coordinate_hash(latitudes: Sequence[float] | np.ndarray, longitudes: Sequence[float] | np.ndarray) -> str:
+    """Get a hash of the points that changes if any of the coordinates or their order changes
+
+    Args:
+        latitudes (Sequence[float] | np.ndarray): The latitudes in degrees
+        longitudes (Sequence[float] | np.ndarray): The longitudes in degrees
+
+    Returns:
+        str: The hash as hex
+    """
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(latitudes, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(longitudes, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+def chord_to_metres(chord: np.ndarray | float) -> np.ndarray | float:
+    """Convert a chord length on the unit sphere to a great circle distance in metres"""
+    return 2 * EARTH_RADIUS_METRES * np.arcsin(np.minimum(np.asarray(chord) / 2, 1))
+
+def metres_to_chord(distance: float) -> float:
+    """Convert a great circle distance in metres to a chord length on the unit sphere. Distances past the far side of the earth are inf."""
+    angle = distance / EARTH_RADIUS_METRES
+    if angle >= math.pi: return float('inf')
+    return 2 * math.sin(angle / 2)
+
+
+class SpatialIndex:
+    """A KD-tree over latitude and longitude points for finding the closest point by great circle distance
+
+    The points are stored as 3d points on the unit sphere so there are no problems near the poles or the antimeridian.
+    Points with a missing (nan) latitude or longitude are never returned.
+    """
+
+    def __init__(self, latitudes: Sequence[float] | np.ndarray, longitudes: Sequence[float] | np.ndarray):
+        """ Build the index
+
+        Args:
+            latitudes (Sequence[float] | np.ndarray): The latitudes of the points in degrees
+            longitudes (Sequence[float] | np.ndarray): The longitudes of the points in degrees
+        """
+        # Copied so the index does not change if the columns it was built from are edited
+        self.latitudes = np.array(latitudes, dtype=np.float64)
+        self.longitudes = np.array(longitudes, dtype=np.float64)
+
+        points = to_unit_vectors(self.latitudes, self.longitudes)
+        valid = np.isfinite(points).all(axis=1)
+
+        # Positions in the tree are mapped back to positions in the original points
+        self._positions = np.flatnonzero(valid)
+        self._tree = cKDTree(points[valid])
+
+    @staticmethod
+    def from_dataset(dataset: Dataset) -> SpatialIndex:
+        """Build an index over the 'latitude' and 'longitude' properties of a dataset. Positions are in row order."""
+        return SpatialIndex(dataset.get_column('latitude'), dataset.get_column('longitude'))
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def save(self, directory: str):
+        """Save the index to a directory so it can be loaded with load instead of being built again
+
+        The coordinates are saved as .npy files that are memory mapped when loaded. The tree is pickled, which stores its nodes
+        as they are so loading it does not repeat the build.
+
+        Args:
+            directory (str): The directory to save to. Created if it does not exist.
+        """
+        os.makedirs(directory, exist_ok=True)
+        meta_path = os.path.join(directory, INDEX_META_FILE)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+        np.save(os.path.join(directory, 'latitudes.npy'), self.latitudes)
+        np.save(os.path.join(directory, 'longitudes.npy'), self.longitudes)
+        np.save(os.path.join(directory, 'positions.npy'), self._positions)
+        with open(os.path.join(directory, 'tree.pkl'), 'wb') as tree_file:
+            pickle.dump(self._tree, tree_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # The meta file is written last so a partially written directory is never treated as valid
+        with open(meta_path, 'w', encoding='utf-8') as meta_file:
+            json.dump({ 
+                'version': INDEX_FORMAT_VERSION, 'hash': coordinate_hash(self.latitudes, self.longitudes), 'count': len(self) 
+            }, meta_file)
+
+    @staticmethod
+    def saved_hash(directory: str) -> str | None:
+        """Get the coordinate_hash of the index saved in a directory
+
+        Args:
+            directory (str): The directory the index was saved to
+
+        Returns:
+            str | None: The hash, or None if there is no usable index in the directory
+        """
+        try:
+            with open(os.path.join(directory, INDEX_META_FILE), 'r', encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+        except (OSError, ValueError):
+            return None
+        return meta.get('hash') if meta.get('version') == INDEX_FORMAT_VERSION else None
+
+    @staticmethod
+    def load(directory: str, mmap=True) -> SpatialIndex:
+        """Load an index saved with save
+
+        The tree is unpickled so only load directories that you created yourself.
+
+        Args:
+            directory (str): The directory to load from
+            mmap (bool, optional): Whether to memory map the coordinates instead of reading them. Defaults to True.
+
+        Returns:
+            SpatialIndex: The index
+        """
+        if SpatialIndex.saved_hash(directory) == None:
+            raise Exception(f"There is no spatial index saved in {directory}")
+
+        mmap_mode = 'r' if mmap else None
+        index = SpatialIndex.__new__(SpatialIndex)
+        index.latitudes = np.load(os.path.join(directory, 'latitudes.npy'), mmap_mode=mmap_mode)
+        index.longitudes = np.load(os.path.join(directory, 'longitudes.npy'), mmap_mode=mmap_mode)
+        index._positions = np.load(os.path.join(directory, 'positions.npy'), mmap_mode=mmap_mode)
+        with open(os.path.join(directory, 'tree.pkl'), 'rb') as tree_file:
+            index._tree = pickle.load(tree_file)
+        return index
+
+    def _set_matches(
+        self, positions: np.ndarray, distances: np.ndarray, queries: np.ndarray, closest: np.ndarray, 
+        latitudes: np.ndarray, longitudes: np.ndarray, distance_limit: float
+    ):
+        """Record the closest point of each query if it is within the distance limit"""
+        found_distances = haversine_metres(latitudes[queries], longitudes[queries], self.latitudes[closest], self.longitudes[closest])
+        within = found_distances < distance_limit
+        positions[queries[within]] = closest[within]
+        distances[queries[within]] = found_distances[within]
+
+    def nearest(
+        self, latitudes: Sequence[float] | np.ndarray, longitudes: Sequence[float] | np.ndarray, distance_limit: float = float('inf')
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Find the closest indexed point to each of the query points
+
+        Only points strictly closer than distance_limit are matched. If several points are exactly as close the one with the lowest
+        position wins, the same as checking every point in order. The returned distances are haversine distances computed with
+        distance.haversine_metres.
+
+        Args:
+            latitudes (Sequence[float] | np.ndarray): The latitudes of the query points in degrees
+            longitudes (Sequence[float] | np.ndarray): The longitudes of the query points in degrees
+            distance_limit (float, optional): The maximum distance in metres. Defaults to float('inf').
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The position of the closest point for each query point, or -1 if there is no match, and the distances in metres
+        """
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        count = len(latitudes)
+        positions = np.full(count, -1, dtype=np.intp)
+        distances = np.zeros(count, dtype=np.float64)
+        if count == 0 or self._tree.n == 0: return positions, distances
+
+        points = to_unit_vectors(latitudes, longitudes)
+        queried = np.flatnonzero(np.isfinite(points).all(axis=1))
+
+        # Search a little past the limit so rounding in the chord conversion never loses a match. The exact limit is checked below.
+        bound = metres_to_chord(distance_limit) * (1 + _TIE_TOLERANCE)
+        k = min(2, self._tree.n)
+        chords, found = self._tree.query(points[queried], k=k, distance_upper_bound=bound)
+        chords, found = chords.reshape(len(queried), k), found.reshape(len(queried), k)
+
+        matched = found[:, 0] != self._tree.n
+        tied = matched & (chords[:, -1] <= chords[:, 0] * (1 + _TIE_TOLERANCE)) if k > 1 else np.zeros(len(queried), dtype=np.bool_)
+
+        # Most points have a single closest point so their distances are computed together
+        single = matched & ~tied
+        queries = queried[single]
+        closest = self._positions[found[single, 0]]
+        self._set_matches(positions, distances, queries, closest, latitudes, longitudes, distance_limit)
+
+        # Check all of the equally close points in order so ties go to the first point
+        for query, chord in zip(queried[tied].tolist(), chords[tied, 0].tolist()):
+            candidates = self._positions[sorted(self._tree.query_ball_point(points[query], chord * (1 + _TIE_TOLERANCE)))]
+            candidate_distances = haversine_metres(latitudes[query], longitudes[query], self.latitudes[candidates], self.longitudes[candidates])
+            best = np.argmin(candidate_distances)
+            if candidate_distances[best] < distance_limit:
+                positions[query] = candidates[best]
+                distances[query] = candidate_distances[best]
+
+        return positions, distances
+
+    def matches(self, latitudes: np.ndarray, longitudes: np.ndarray) -> bool:
+        """Check whether the index was built from these points, eg. to decide if a cached index can be reused"""
+        return (
+            np.array_equal(self.latitudes, np.asarray(latitudes, dtype=np.float64), equal_nan=True) and 
+            np.array_equal(self.longitudes, np.asarray(longitudes, dtype=np.float64), equal_nan=True)
+        )
+
+    def query_radius(
+        self, latitudes: Sequence[float] | np.ndarray, longitudes: Sequence[float] | np.ndarray, radius: float
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Find all the indexed points within [radius] metres of each query point
+
+        The result is in compressed sparse row form: the matches of query point i are positions[offsets[i]:offsets[i + 1]] with
+        distances[offsets[i]:offsets[i + 1]], ordered from closest to furthest.
+
+        Args:
+            latitudes (Sequence[float] | np.ndarray): The latitudes of the query points in degrees
+            longitudes (Sequence[float] | np.ndarray): The longitudes of the query points in degrees
+            radius (float): The maximum distance in metres (inclusive)
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: The offsets, positions and distances
+        """
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        if len(latitudes) == 0 or self._tree.n == 0:
+            return np.zeros(len(latitudes) + 1, dtype=np.intp), np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.float64)
+
+        points = to_unit_vectors(latitudes, longitudes)
+        queried = np.flatnonzero(np.isfinite(points).all(axis=1))
+        found = self._tree.query_ball_point(points[queried], metres_to_chord(radius) * (1 + _TIE_TOLERANCE))
+
+        # Flatten the lists of matches so the distances are computed in one call
+        lengths = np.fromiter(map(len, found), dtype=np.intp, count=len(found))
+        query_of = np.repeat(queried, lengths)
+        positions = self._positions[np.fromiter((p for matches in found for p in matches), dtype=np.intp, count=lengths.sum())]
+        distances = haversine_metres(latitudes[query_of], longitudes[query_of], self.latitudes[positions], self.longitudes[positions])
+
+        within = distances <= radius
+        query_of, positions, distances = query_of[within], positions[within], distances[within]
+        order = np.lexsort((positions, distances, query_of))
+        query_of, positions, distances = query_of[order], positions[order], distances[order]
+
+        counts = np.bincount(query_of, minlength=len(latitudes))
+        offsets = np.zeros(len(latitudes) + 1, dtype=np.intp)
+        np.cumsum(counts, out=offsets[1:])
+        return offsets, positions, distances
+
+    def query_knn(
+        self, latitudes: Sequence[float] | np.ndarray, longitudes: Sequence[float] | np.ndarray, k: int, distance_limit: float = float('inf')
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Find the [k] closest indexed points to each query point
+
+        Args:
+            latitudes (Sequence[float] | np.ndarray): The latitudes of the query points in degrees
+            longitudes (Sequence[float] | np.ndarray): The longitudes of the query points in degrees
+            k (int): The number of points to find for each query point
+            distance_limit (float, optional): Only find points within this many metres (inclusive). Defaults to float('inf').
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: (n, k) arrays of positions and distances from closest to furthest. When fewer than k points are found the rest are -1 and inf.
+        """
+        if k < 1:
+            raise Exception(f"k must be at least 1 not {k}")
+
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        positions = np.full((len(latitudes), k), -1, dtype=np.intp)
+        distances = np.full((len(latitudes), k), np.inf, dtype=np.float64)
+        if len(latitudes) == 0 or self._tree.n == 0: return positions, distances
+
+        points = to_unit_vectors(latitudes, longitudes)
+        queried = np.flatnonzero(np.isfinite(points).all(axis=1))
+        bound = metres_to_chord(distance_limit) * (1 + _TIE_TOLERANCE)
+        _, found = self._tree.query(points[queried], k=k, distance_upper_bound=bound)
+        found = found.reshape(len(queried), k)
+
+        valid = found != self._tree.n
+        rows, columns = np.nonzero(valid)
+        point_positions = self._positions[found[valid]]
+        point_distances = haversine_metres(
+            latitudes[queried[rows]], longitudes[queried[rows]], self.latitudes[point_positions], self.longitudes[point_positions]
+        )
+
+        # The tree finds points by chord length, the exact limit is checked with the haversine distance
+        within = point_distances <= distance_limit
+        positions[queried[rows[within]], columns[within]] = point_positions[within]
+        distances[queried[rows[within]], columns[within]] = point_distances[within]
+        return positions, distances
+
+
+class PlanarIndex:
+    """A KD-tree over projected coordinates in metres, eg. UTM eastings and northings, for finding the closest point by straight line distance
+
+    Within a city the straight line distance between projected points is very close to the haversine distance and much cheaper
+    to compute. See Dataset.project_utm.
+    """
+
+    def __init__(self, eastings: Sequence[float] | np.ndarray, northings: Sequence[float] | np.ndarray):
+        """ Build the index
+
+        Args:
+            eastings (Sequence[float] | np.ndarray): The x coordinates of the points in metres
+            northings (Sequence[float] | np.ndarray): The y coordinates of the points in metres
+        """
+        # Copied so the index does not change if the columns it was built from are edited
+        self.eastings = np.array(eastings, dtype=np.float64)
+        self.northings = np.array(northings, dtype=np.float64)
+
+        points = np.column_stack((self.eastings, self.northings))
+        valid = np.isfinite(points).all(axis=1)
+        self._positions = np.flatnonzero(valid)
+        self._tree = cKDTree(points[valid])
+
+    def __len__(self):
+        return len(self.eastings)
+
+    def matches(self, eastings: np.ndarray, northings: np.ndarray) -> bool:
+        """Check whether the index was built from these points, eg. to decide if a cached index can be reused"""
+        return (
+            np.array_equal(self.eastings, np.asarray(eastings, dtype=np.float64), equal_nan=True) and 
+            np.array_equal(self.northings, np.asarray(northings, dtype=np.float64), equal_nan=True)
+        )
+
+    def nearest(
+        self, eastings: Sequence[float] | np.ndarray, northings: Sequence[float] | np.ndarray, distance_limit: float = float('inf')
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Find the closest indexed point to each of the query points that is strictly closer than distance_limit
+
+        Ties go to the point with the lowest position. The result has the same form as SpatialIndex.nearest.
+
+        Args:
+            eastings (Sequence[float] | np.ndarray): The x coordinates of the query points in metres
+            northings (Sequence[float] | np.ndarray): The y coordinates of the query points in metres
+            distance_limit (float, optional): The maximum distance in metres. Defaults to float('inf').
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The position of the closest point for each query point, or -1 if there is no match, and the straight line distances in metres
+        """
+        points = np.column_stack((np.asarray(eastings, dtype=np.float64), np.asarray(northings, dtype=np.float64)))
+        positions = np.full(len(points), -1, dtype=np.intp)
+        distances = np.zeros(len(points), dtype=np.float64)
+        if len(points) == 0 or self._tree.n == 0: return positions, distances
+
+        queried = np.flatnonzero(np.isfinite(points).all(axis=1))
+        k = min(2, self._tree.n)
+        found_distances, found = self._tree.query(points[queried], k=k, distance_upper_bound=distance_limit)
+        found_distances, found = found_distances.reshape(len(queried), k), found.reshape(len(queried), k)
+
+        # The upper bound of the tree is inclusive but the distance limit is not
+        matched = (found[:, 0] != self._tree.n) & (found_distances[:, 0] < distance_limit)
+        # Distances that only differ by rounding are ties too, the same as in SpatialIndex
+        tied = matched & (found_distances[:, -1] <= found_distances[:, 0] * (1 + _TIE_TOLERANCE)) if k > 1 else np.zeros(len(queried), dtype=np.bool_)
+
+        single = matched & ~tied
+        positions[queried[single]] = self._positions[found[single, 0]]
+        distances[queried[single]] = found_distances[single, 0]
+
+        for row in np.flatnonzero(tied).tolist():
+            query, distance = queried[row], found_distances[row, 0]
+            # The tolerance keeps rounding from leaving out the points that were found. Fall back to the closest one if it does.
+            candidates = self._tree.query_ball_point(points[query], distance * (1 + _TIE_TOLERANCE))
+            positions[query] = self._positions[min(candidates) if candidates else found[row, 0]]
+            distances[query] = distance
+
+        return positions, distances
+
+
+class GridIndex:
+    """Buckets latitude and longitude points into a grid of cells that are at least [cell_size] metres across
+
+    Any point within [cell_size] of a query point is in the cell of the query point or one of the 8 cells around it, so only
+    those cells need to be checked. Good for matching with a small distance limit, eg. 200 metres in a city. The grid does not
+    wrap around the antimeridian.
+    """
+
+    def __init__(self, latitudes: Sequence[float] | np.ndarray, longitudes: Sequence[float] | np.ndarray, cell_size: float):
+        """ Build the grid
+
+        Args:
+            latitudes (Sequence[float] | np.ndarray): The latitudes of the points in degrees
+            longitudes (Sequence[float] | np.ndarray): The longitudes of the points in degrees
+            cell_size (float): The minimum width and height of a cell in metres
+        """
+        if not 0 < cell_size < math.inf:
+            raise Exception(f"The cell size of a grid must be a positive number not {cell_size}")
+
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.cell_size = cell_size
+
+        valid = np.isfinite(self.latitudes) & np.isfinite(self.longitudes)
+
+        # A degree of longitude gets shorter away from the equator so the cells are made wide enough for the point furthest from it
+        self._cell_lat = math.degrees(cell_size / EARTH_RADIUS_METRES)
+        furthest = np.abs(self.latitudes[valid]).max(initial=0) + self._cell_lat
+        self._cell_lng = self._cell_lat / max(math.cos(math.radians(min(furthest, 90))), 1e-12)
+
+        self._cells: dict[tuple[int, int], list[int]] = {}
+        rows, columns = self._cell_of(self.latitudes[valid], self.longitudes[valid])
+        for position, cell in zip(np.flatnonzero(valid).tolist(), zip(rows.tolist(), columns.tolist())):
+            self._cells.setdefault(cell, []).append(position)
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def _cell_of(self, latitudes: np.ndarray, longitudes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Get the row and column of the cell of each point"""
+        return np.floor(latitudes / self._cell_lat).astype(np.int64), np.floor(longitudes / self._cell_lng).astype(np.int64)
+
+    def candidates(self, latitude: float, longitude: float) -> list[int]:
+        """Get the positions of the points in the cell of a point and the cells around it, in order
+
+        Args:
+            latitude (float): The latitude of the point in degrees
+            longitude (float): The longitude of the point in degrees
+
+        Returns:
+            list[int]: The positions of the points that may be within cell_size of the point
+        """
+        rows, columns = self._cell_of(np.array([latitude]), np.array([longitude]))
+        return self._neighborhood(rows.item(), columns.item())
+
+    def _neighborhood(self, row: int, column: int) -> list[int]:
+        result = []
+        for i in (row - 1, row, row + 1):
+            for j in (column - 1, column, column + 1):
+                result.extend(self._cells.get((i, j), ()))
+        result.sort()
+        return result
+
+    def nearest(
+        self, latitudes: Sequence[float] | np.ndarray, longitudes: Sequence[float] | np.ndarray, distance_limit: float | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Find the closest point to each of the query points that is strictly closer than distance_limit
+
+        Only the neighboring cells are checked so distance_limit can not be larger than cell_size. The result has the same form as
+        SpatialIndex.nearest and ties go to the point with the lowest position.
+
+        Args:
+            latitudes (Sequence[float] | np.ndarray): The latitudes of the query points in degrees
+            longitudes (Sequence[float] | np.ndarray): The longitudes of the query points in degrees
+            distance_limit (float | None, optional): The maximum distance in metres. Defaults to None which uses cell_size.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The position of the closest point for each query point, or -1 if there is no match, and the distances in metres
+        """
+        if distance_limit == None:
+            distance_limit = self.cell_size
+        if distance_limit > self.cell_size:
+            raise Exception(f"The distance limit ({distance_limit}) can not be larger than the cell size of the grid ({self.cell_size})")
+
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        positions = np.full(len(latitudes), -1, dtype=np.intp)
+        distances = np.zeros(len(latitudes), dtype=np.float64)
+
+        queried = np.flatnonzero(np.isfinite(latitudes) & np.isfinite(longitudes))
+        rows, columns = self._cell_of(latitudes[queried], longitudes[queried])
+
+        # Queries in the same cell share their candidates so each cell is checked with one distance matrix
+        order = np.lexsort((columns, rows))
+        queried, rows, columns = queried[order], rows[order], columns[order]
+        starts = np.flatnonzero(np.diff(rows, prepend=rows[:1] - 1) | np.diff(columns, prepend=columns[:1] - 1))
+        ends = np.append(starts[1:], len(queried))
+
+        for start, end, row, column in zip(starts.tolist(), ends.tolist(), rows[starts].tolist(), columns[starts].tolist()):
+            candidates = np.array(self._neighborhood(row, column), dtype=np.intp)
+            if len(candidates) == 0: continue
+
+            queries = queried[start:end]
+            matrix = haversine_matrix(latitudes[queries], longitudes[queries], self.latitudes[candidates], self.longitudes[candidates])
+            matrix[~(matrix < distance_limit)] = np.inf
+
+            # argmin returns the first of equal values and the candidates are in order so ties go to the first point
+            best = np.argmin(matrix, axis=1)
+            best_distances = matrix[np.arange(len(queries)), best]
+            within = best_distances < distance_limit
+            positions[queries[within]] = candidates[best[within]]
+            distances[queries[within]] = best_distances[within]
+
+        return positions, distances